@@ -1,5 +1,16 @@
+import datetime
+
 from django.contrib import admin
-from .models import Genre, Artist, Song, Playlist, UserProfile, SongPlay, SongDownload
+from django.utils import timezone
+
+from .models import (
+    Genre, Artist, Song, Playlist, UserProfile, SongPlay, SongDownload, MediaJob, MediaBlob, Like,
+    RequestMetric, SlowQuery,
+)
+from .instrumentation import summarize
+from .charts import invalidate_charts_snapshot
+from .search import get_search_backend
+from .pagecache import invalidate_tags
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
@@ -8,26 +19,44 @@ class GenreAdmin(admin.ModelAdmin):
 
 @admin.register(Artist)
 class ArtistAdmin(admin.ModelAdmin):
-    list_display = ['name']
+    list_display = ['name', 'song_count', 'play_count', 'download_count']
     search_fields = ['name']
+    readonly_fields = ['song_count', 'play_count', 'download_count']
 
 @admin.register(Song)
 class SongAdmin(admin.ModelAdmin):
-    list_display = ['title', 'artist', 'genre', 'duration', 'plays', 'downloads', 'upload_date']
-    list_filter = ['genre', 'upload_date']
+    list_display = ['title', 'artist', 'genre', 'duration', 'plays', 'downloads', 'like_count', 'is_approved', 'upload_date']
+    list_filter = ['is_approved', 'genre', 'upload_date']
+    list_select_related = ['artist', 'genre']
     search_fields = ['title', 'artist__name']
-    readonly_fields = ['plays', 'downloads', 'upload_date']
+    readonly_fields = ['plays', 'downloads', 'like_count', 'upload_date']
+    actions = ['approve_songs']
     fieldsets = (
         ('Basic Information', {
             'fields': ('title', 'artist', 'genre', 'duration')
         }),
+        ('Moderation', {
+            'fields': ('is_approved', 'is_featured')
+        }),
         ('Media Files', {
             'fields': ('audio_file', 'cover_image')
         }),
         ('Statistics', {
-            'fields': ('plays', 'downloads', 'upload_date')
+            'fields': ('plays', 'downloads', 'like_count', 'upload_date')
         }),
     )
+    
+    @admin.action(description='Approve selected songs')
+    def approve_songs(self, request, queryset):
+        # Bulk update skips post_save, so refresh the charts, search index and page cache here
+        songs = queryset.filter(is_approved=False)
+        song_ids = list(songs.values_list('id', flat=True))
+        genre_ids = set(songs.values_list('genre_id', flat=True))
+        updated = Song.objects.filter(id__in=song_ids).update(is_approved=True)
+        invalidate_charts_snapshot()
+        get_search_backend().index_songs(song_ids)
+        invalidate_tags('songs', 'charts', *(f'genre:{genre_id}' for genre_id in genre_ids))
+        self.message_user(request, f'{updated} song(s) approved.')
 
 @admin.register(Playlist)
 class PlaylistAdmin(admin.ModelAdmin):
@@ -38,7 +67,14 @@ class PlaylistAdmin(admin.ModelAdmin):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user']
-    filter_horizontal = ['favorite_genres', 'liked_songs']
+    filter_horizontal = ['favorite_genres']
+
+@admin.register(Like)
+class LikeAdmin(admin.ModelAdmin):
+    list_display = ['song', 'user', 'liked_at']
+    list_select_related = ['song', 'user']
+    search_fields = ['song__title', 'user__username']
+    raw_id_fields = ['song', 'user']
 
 @admin.register(SongPlay)
 class SongPlayAdmin(admin.ModelAdmin):
@@ -52,4 +88,77 @@ class SongDownloadAdmin(admin.ModelAdmin):
     list_display = ['song', 'user', 'ip_address', 'downloaded_at']
     list_filter = ['downloaded_at']
     search_fields = ['song__title', 'user__username']
-    readonly_fields = ['downloaded_at']
\ No newline at end of file
+    readonly_fields = ['downloaded_at']
+
+@admin.register(MediaJob)
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ['song', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status']
+    list_select_related = ['song']
+    search_fields = ['song__title']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'created_at']
+    search_fields = ['name', 'sha256']
+    readonly_fields = ['name', 'sha256', 'size', 'created_at']
+
+@admin.register(RequestMetric)
+class RequestMetricAdmin(admin.ModelAdmin):
+    """Hourly rows, with a per-URL-name summary of the last day above them"""
+    list_display = ['view_name', 'hour', 'requests', 'errors', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms',
+                    'queries_per_request']
+    date_hierarchy = 'hour'
+    search_fields = ['view_name']
+    ordering = ['-hour', 'view_name']
+    
+    SUMMARY_HOURS = 24
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    @admin.display(description='mean ms')
+    def mean_ms(self, obj):
+        return round(obj.total_ms / obj.requests, 1) if obj.requests else None
+    
+    @admin.display(description='p50 ms')
+    def p50_ms(self, obj):
+        return round(obj.percentile(50), 1) if obj.requests else None
+    
+    @admin.display(description='p95 ms')
+    def p95_ms(self, obj):
+        return round(obj.percentile(95), 1) if obj.requests else None
+    
+    @admin.display(description='p99 ms')
+    def p99_ms(self, obj):
+        return round(obj.percentile(99), 1) if obj.requests else None
+    
+    @admin.display(description='queries/request')
+    def queries_per_request(self, obj):
+        return round(obj.queries / obj.requests, 1) if obj.requests else None
+    
+    def changelist_view(self, request, extra_context=None):
+        since = timezone.now() - datetime.timedelta(hours=self.SUMMARY_HOURS)
+        extra_context = {
+            **(extra_context or {}),
+            'summary': summarize(RequestMetric.objects.filter(hour__gte=since)),
+            'summary_hours': self.SUMMARY_HOURS,
+        }
+        return super().changelist_view(request, extra_context)
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['view_name', 'duration_ms', 'recorded_at', 'sql']
+    list_filter = ['view_name']
+    date_hierarchy = 'recorded_at'
+    search_fields = ['view_name', 'sql']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MusicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'music'
+
+    def ready(self):
+        # Register signal handlers
+        from . import charts, pagecache, search  # noqa: F401
+        import sangabiz.db  # noqa: F401
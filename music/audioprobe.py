@@ -0,0 +1,172 @@
+"""
+Audio inspection and transcoding helpers for the media pipeline.
+
+probe_audio() uses ffprobe when it is installed and otherwise reads the
+container headers itself (MP3 frame/Xing headers, WAV, Ogg Vorbis), so
+durations are filled in even on hosts without ffmpeg. transcode() needs
+ffmpeg; callers should check ffmpeg_available() first.
+"""
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import wave
+
+# kbps by bitrate index, for MPEG-1 and MPEG-2/2.5 Layer III
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0],
+}
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],   # MPEG-2.5
+}
+
+
+class ProbeError(Exception):
+    pass
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+
+def probe_audio(path):
+    """Return {'duration': seconds, 'bitrate': kbps or None, 'format': name}"""
+    if shutil.which('ffprobe'):
+        try:
+            return _probe_ffprobe(path)
+        except (ProbeError, subprocess.SubprocessError, OSError, ValueError):
+            pass
+    with open(path, 'rb') as fh:
+        head = fh.read(12)
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return _probe_wav(path)
+    if head[:4] == b'OggS':
+        return _probe_ogg(path)
+    return _probe_mp3(path)
+
+
+def _probe_ffprobe(path):
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration,bit_rate,format_name',
+         '-of', 'json', path],
+        capture_output=True, check=True, timeout=60,
+    ).stdout
+    info = json.loads(output).get('format', {})
+    if 'duration' not in info:
+        raise ProbeError("ffprobe reported no duration")
+    bitrate = info.get('bit_rate')
+    return {
+        'duration': float(info['duration']),
+        'bitrate': int(bitrate) // 1000 if bitrate else None,
+        'format': info.get('format_name', '').split(',')[0],
+    }
+
+
+def _probe_wav(path):
+    try:
+        with wave.open(path, 'rb') as wav:
+            rate = wav.getframerate()
+            duration = wav.getnframes() / float(rate)
+            bitrate = rate * wav.getnchannels() * wav.getsampwidth() * 8 // 1000
+    except (wave.Error, EOFError, ZeroDivisionError) as e:
+        raise ProbeError(f"Unreadable WAV file: {e}")
+    return {'duration': duration, 'bitrate': bitrate, 'format': 'wav'}
+
+
+def _probe_ogg(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fh:
+        head = fh.read(4096)
+        fh.seek(max(size - 65536, 0))
+        tail = fh.read()
+    marker = head.find(b'\x01vorbis')
+    last_page = tail.rfind(b'OggS')
+    if marker < 0 or last_page < 0 or len(tail) < last_page + 14:
+        raise ProbeError("Not an Ogg Vorbis file")
+    # Identification header: version (4), channels (1), sample rate (4)
+    sample_rate = struct.unpack('<I', head[marker + 12:marker + 16])[0]
+    granule = struct.unpack('<q', tail[last_page + 6:last_page + 14])[0]
+    if not sample_rate or granule <= 0:
+        raise ProbeError("Ogg file has no audio")
+    duration = granule / float(sample_rate)
+    return {'duration': duration, 'bitrate': int(size * 8 / duration / 1000), 'format': 'ogg'}
+
+
+def _probe_mp3(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fh:
+        data = fh.read(128 * 1024)
+        fh.seek(max(size - 128, 0))
+        has_id3v1 = fh.read(3) == b'TAG'
+
+    # Skip an ID3v2 tag (syncsafe size)
+    start = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        start = 10 + tag_size + (10 if data[5] & 0x10 else 0)
+        if start + 4 > len(data):
+            with open(path, 'rb') as fh:
+                fh.seek(start)
+                data = data[:start] + fh.read(128 * 1024)
+
+    header = None
+    for offset in range(start, len(data) - 4):
+        if data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+            continue
+        version = (data[offset + 1] >> 3) & 3
+        layer = (data[offset + 1] >> 1) & 3
+        bitrate_index = data[offset + 2] >> 4
+        rate_index = (data[offset + 2] >> 2) & 3
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        header = offset, version, bitrate_index, rate_index, data[offset + 3] >> 6
+        break
+    if header is None:
+        raise ProbeError("No MPEG audio frames found")
+
+    offset, version, bitrate_index, rate_index, channel_mode = header
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[1 if mpeg1 else 2][bitrate_index]
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    samples_per_frame = 1152 if mpeg1 else 576
+    audio_bytes = size - offset - (128 if has_id3v1 else 0)
+
+    # VBR files carry the frame count in a Xing/Info or VBRI header
+    mono = channel_mode == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    xing = offset + 4 + side_info
+    frames = None
+    if data[xing:xing + 4] in (b'Xing', b'Info') and data[xing + 7] & 1:
+        frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+    elif data[offset + 36:offset + 40] == b'VBRI':
+        frames = struct.unpack('>I', data[offset + 50:offset + 54])[0]
+
+    if frames:
+        duration = frames * samples_per_frame / float(sample_rate)
+        bitrate = int(audio_bytes * 8 / duration / 1000) if duration else bitrate
+    else:
+        duration = audio_bytes * 8 / (bitrate * 1000.0)
+    return {'duration': duration, 'bitrate': bitrate, 'format': 'mp3'}
+
+
+def transcode(source, destination, fmt='mp3', bitrate=128):
+    """Re-encode ``source`` to a normalised stereo 44.1kHz MP3/OGG rendition"""
+    codec = ['-c:a', 'libvorbis'] if fmt == 'ogg' else ['-c:a', 'libmp3lame']
+    subprocess.run(
+        ['ffmpeg', '-y', '-v', 'error', '-i', source, '-vn', '-map_metadata', '-1',
+         '-ac', '2', '-ar', '44100', *codec, '-b:a', f'{bitrate}k', destination],
+        capture_output=True, check=True, timeout=600,
+    )
@@ -0,0 +1,446 @@
+"""
+Load-testing benchmarks over a synthetic catalog.
+
+``manage.py generate_catalog`` fills the database with genres, artists,
+songs (sharing a few tiny silent MP3 files), listeners, plays, downloads,
+likes and playlists, all with bulk inserts. Song popularity follows a
+Zipf-like curve, so charts, trending and recommendations see a realistic
+long tail. Point SQLITE_PATH at a scratch database first:
+
+    SQLITE_PATH=/tmp/bench.sqlite3 python manage.py migrate
+    SQLITE_PATH=/tmp/bench.sqlite3 python manage.py generate_catalog --songs 20000
+    SQLITE_PATH=/tmp/bench.sqlite3 python manage.py run_benchmarks --output bench.json
+
+``manage.py run_benchmarks`` requests each scenario in SCENARIOS through
+the Django test client and reports latency percentiles, the number of
+queries and the peak Python memory allocated while serving it. With
+``--baseline`` it compares against a previous run's JSON and fails when a
+view got slower, ran more queries, used more memory or started erroring.
+"""
+import contextlib
+import datetime
+import json
+import math
+import random
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import trending
+from .charts import invalidate_charts_snapshot
+from .models import Artist, Genre, Like, Playlist, PlaylistEntry, Song, SongDownload, SongPlay, UserProfile
+from .pagecache import invalidate_tags
+from .playlists import POSITION_GAP
+from .search import get_search_backend
+from .storage import content_storage
+
+BENCHMARK_PASSWORD = 'benchmark'
+
+GENRE_NAMES = [
+    'Afrobeat', 'Amapiano', 'Bongo Flava', 'Gospel', 'Hip Hop', 'Reggae', 'RnB',
+    'Dancehall', 'Jazz', 'Rock', 'Zouk', 'Kadongo Kamu', 'Gengetone', 'Soul',
+]
+WORDS = [
+    'love', 'night', 'river', 'city', 'fire', 'dream', 'home', 'rain', 'sun',
+    'heart', 'road', 'dance', 'gold', 'light', 'moon', 'story', 'money', 'sky',
+    'freedom', 'mama', 'party', 'island', 'shadow', 'morning', 'blessing',
+]
+
+# One MPEG-1 Layer III frame (128 kbps, 44.1 kHz) of silence
+MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+MP3_FRAMES_PER_SECOND = 38
+
+
+def _title(rng):
+    return ' '.join(rng.sample(WORDS, rng.randint(1, 3))).title()
+
+
+def _zipf_weights(count):
+    """Cumulative weights for picking item i with probability ~ 1 / (i + 1)"""
+    total, weights = 0.0, []
+    for rank in range(count):
+        total += 1 / (rank + 1)
+        weights.append(total)
+    return weights
+
+
+def _dummy_audio_files(count):
+    """Names of ``count`` short silent MP3s in content storage (1s, 2s, ...)"""
+    storage = content_storage()
+    return [
+        storage.save('songs/benchmark.mp3', ContentFile(MP3_FRAME * MP3_FRAMES_PER_SECOND * (seconds + 1)))
+        for seconds in range(count)
+    ]
+
+
+def _recount(songs, related, field, batch_size=1000):
+    """Set ``field`` on ``songs`` to the number of ``related`` rows pointing at each"""
+    rows = related.objects.filter(song=OuterRef('pk')).order_by().values('song')
+    total = Coalesce(Subquery(rows.annotate(total=Count('id')).values('total')), 0)
+    for start in range(0, len(songs), batch_size):
+        batch = [song.pk for song in songs[start:start + batch_size]]
+        Song.objects.filter(pk__in=batch).update(**{field: total})
+
+
+def generate_catalog(genres=10, artists=200, songs=5000, users=1000, plays=50000, downloads=5000,
+                     likes=10000, playlists=500, playlist_size=20, audio_files=8, days=30,
+                     prefix='bench', seed=0, batch_size=1000, log=None):
+    """
+    Bulk-insert a synthetic catalog and bring the denormalised counters,
+    trending scores and search index up to date. Returns the row counts.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    now = timezone.now()
+    span = datetime.timedelta(days=days).total_seconds()
+
+    def moment():
+        return now - datetime.timedelta(seconds=rng.uniform(0, span))
+
+    log(f"Writing {audio_files} dummy audio files")
+    audio = _dummy_audio_files(audio_files)
+
+    with transaction.atomic():
+        genre_rows = Genre.objects.bulk_create(
+            [Genre(name=GENRE_NAMES[i % len(GENRE_NAMES)] + (f' {i // len(GENRE_NAMES) + 1}' if i >= len(GENRE_NAMES) else ''),
+                   color='#%06x' % rng.randrange(0x1000000)) for i in range(genres)],
+            batch_size=batch_size,
+        )
+
+        log(f"Creating {users} listeners and {artists} artists")
+        password = make_password(BENCHMARK_PASSWORD)
+        user_rows = User.objects.bulk_create(
+            [User(username=f'{prefix}-listener-{i}', email=f'{prefix}-listener-{i}@example.com', password=password)
+             for i in range(users)]
+            + [User(username=f'{prefix}-artist-{i}', email=f'{prefix}-artist-{i}@example.com', password=password)
+               for i in range(artists)],
+            batch_size=batch_size,
+        )
+        listeners, artist_users = user_rows[:users], user_rows[users:]
+        # bulk_create bypasses create_user_with_profile
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=user, user_type='listener') for user in listeners]
+            + [UserProfile(user=user, user_type='artist') for user in artist_users],
+            batch_size=batch_size,
+        )
+        artist_rows = Artist.objects.bulk_create(
+            [Artist(user=user, name=f'{_title(rng)} {i}', genre=rng.choice(genre_rows), is_verified=rng.random() < 0.1)
+             for i, user in enumerate(artist_users)],
+            batch_size=batch_size,
+        )
+
+        log(f"Creating {songs} songs")
+        song_rows = Song.objects.bulk_create(
+            [
+                Song(
+                    title=_title(rng), artist=rng.choice(artist_rows), genre=rng.choice(genre_rows),
+                    audio_file=rng.choice(audio), duration=rng.randint(90, 360), bitrate=128,
+                    is_approved=rng.random() < 0.9, is_featured=rng.random() < 0.02,
+                )
+                for _ in range(songs)
+            ],
+            batch_size=batch_size,
+        )
+        # upload_date is auto_now_add; spread it out afterwards
+        for song in song_rows:
+            song.upload_date = moment()
+        Song.objects.bulk_update(song_rows, ['upload_date'], batch_size=batch_size)
+
+        # Popular songs get most of the traffic (shuffled, so not by id)
+        popular = song_rows[:]
+        rng.shuffle(popular)
+        popularity = _zipf_weights(len(popular))
+
+        def pick_songs(count):
+            return rng.choices(popular, cum_weights=popularity, k=count) if popular else []
+
+        log(f"Creating {plays} plays and {downloads} downloads")
+        for start in range(0, plays, batch_size):
+            SongPlay.objects.bulk_create([
+                SongPlay(song=song, user=rng.choice(listeners) if listeners and rng.random() < 0.7 else None,
+                         played_at=moment(), duration_played=song.duration, completed=rng.random() < 0.6)
+                for song in pick_songs(min(batch_size, plays - start))
+            ])
+        for start in range(0, downloads, batch_size):
+            SongDownload.objects.bulk_create([
+                SongDownload(song=song, user=rng.choice(listeners) if listeners else None, downloaded_at=moment())
+                for song in pick_songs(min(batch_size, downloads - start))
+            ])
+
+        log(f"Creating {likes} likes and {playlists} playlists")
+        liked = set()
+        if listeners:
+            liked = {(rng.choice(listeners).pk, song.pk) for song in pick_songs(likes)}
+        like_rows = [Like(user_id=user_id, song_id=song_id) for user_id, song_id in liked]
+        Like.objects.bulk_create(like_rows, batch_size=batch_size)
+        for like in like_rows:
+            like.liked_at = moment()
+        Like.objects.bulk_update(like_rows, ['liked_at'], batch_size=batch_size)
+
+        playlist_rows = Playlist.objects.bulk_create(
+            [Playlist(name=_title(rng), user=rng.choice(listeners), is_public=rng.random() < 0.5)
+             for _ in range(playlists if listeners else 0)],
+            batch_size=batch_size,
+        )
+        entries = []
+        for playlist in playlist_rows:
+            members = dict.fromkeys(song.pk for song in pick_songs(playlist_size))
+            entries += [
+                PlaylistEntry(playlist=playlist, song_id=song_id, position=(index + 1) * POSITION_GAP, added_at=moment())
+                for index, song_id in enumerate(members)
+            ]
+        PlaylistEntry.objects.bulk_create(entries, batch_size=batch_size)
+
+        log("Recounting plays, downloads, likes and artist totals")
+        # Only the generated rows; anything already in the database keeps its counters
+        _recount(song_rows, SongPlay, 'plays', batch_size)
+        _recount(song_rows, SongDownload, 'downloads', batch_size)
+        _recount(song_rows, Like, 'like_count', batch_size)
+        Artist.objects.filter(pk__in=[artist.pk for artist in artist_rows]).update(**Artist.stats_from_songs())
+
+    log("Rebuilding trending scores and the search index")
+    trending.rebuild()
+    get_search_backend().rebuild()
+    invalidate_charts_snapshot()
+    invalidate_tags('songs', 'charts', 'genres', 'artists')
+
+    return {
+        'genres': len(genre_rows),
+        'artists': len(artist_rows),
+        'songs': len(song_rows),
+        'users': len(listeners),
+        'plays': plays,
+        'downloads': downloads,
+        'likes': len(like_rows),
+        'playlists': len(playlist_rows),
+        'playlist_entries': len(entries),
+    }
+
+
+# Runner
+
+def _fixtures():
+    """Typical objects to request: a popular song, a busy genre, an active listener, ..."""
+    song = Song.objects.approved().order_by('-plays', '-id').first()
+    if song is None:
+        return None
+    playlist = (
+        Playlist.objects.filter(is_public=True).annotate(size=Count('songs'))
+        .order_by('-size', 'id').first()
+    )
+    user = User.objects.annotate(like_total=Count('likes')).order_by('-like_total', 'id').first()
+    popular = list(Song.objects.approved().order_by('-plays', '-id').values_list('id', flat=True)[:50])
+    return {
+        'song': song.pk,
+        'genre': song.genre_id,
+        'query': song.title.split()[0],
+        'playlist': playlist.pk if playlist else None,
+        'user': user,
+        'song_ids': ','.join(map(str, popular)),
+    }
+
+
+def _signup_form(fixtures):
+    name = f'signup-{uuid.uuid4().hex[:12]}'
+    return {
+        'username': name, 'email': f'{name}@example.com',
+        'password1': BENCHMARK_PASSWORD, 'password2': BENCHMARK_PASSWORD,
+    }
+
+
+def _discover_page_url(sort):
+    # The view quietly falls back to 'newest' for unknown sorts, which would
+    # time the wrong query
+    from .views import DISCOVER_SORTS
+
+    if sort not in DISCOVER_SORTS:
+        raise ValueError(f"Unknown discover sort {sort!r}")
+    return reverse('discover_page') + f'?sort={sort}'
+
+
+# name -> (method, url builder, log in first, body builder). The body builder
+# runs before every request; 'form' posts it form-encoded, other methods as JSON.
+SCENARIOS = {
+    'home': ('get', lambda f: reverse('home'), False, None),
+    'home_logged_in': ('get', lambda f: reverse('home'), True, None),
+    'discover': ('get', lambda f: reverse('discover'), False, None),
+    'discover_page': ('get', lambda f: _discover_page_url('plays'), False, None),
+    'genre_songs': ('get', lambda f: reverse('genre_songs', args=[f['genre']]), False, None),
+    'search': ('get', lambda f: reverse('search') + f"?q={f['query']}", False, None),
+    'search_suggest': ('get', lambda f: reverse('search_suggest') + f"?q={f['query'][:3]}", False, None),
+    'library': ('get', lambda f: reverse('library'), True, None),
+    'playlists': ('get', lambda f: reverse('playlists'), True, None),
+    'play_song': ('post', lambda f: reverse('play_song', args=[f['song']]), False, None),
+    'record_plays': ('post', lambda f: reverse('record_plays'), False,
+                     lambda f: {'events': [{'song': f['song'], 'seconds': 60, 'completed': True,
+                                            'started_at': timezone.now().isoformat()}]}),
+    'signup': ('form', lambda f: reverse('signup'), False, _signup_form),
+    'download_song': ('get', lambda f: reverse('download_song', args=[f['song']]), True, None),
+    'stream_song': ('get', lambda f: reverse('stream_song', args=[f['song']]), False, None),
+    'api_song': ('get', lambda f: reverse('api_song', args=[f['song']]), False, None),
+    'api_songs': ('get', lambda f: reverse('api_songs') + f"?ids={f['song_ids']}", False, None),
+    'api_related_songs': ('get', lambda f: reverse('api_related_songs', args=[f['song']]), False, None),
+    'api_trending': ('get', lambda f: reverse('api_trending'), False, None),
+    'api_genre_queue': ('get', lambda f: reverse('api_genre_queue', args=[f['genre']]), False, None),
+    'api_playlist_queue': ('get', lambda f: reverse('api_playlist_queue', args=[f['playlist']])
+                           if f['playlist'] else None, False, None),
+    'api_playlist_export': ('get', lambda f: reverse('api_playlist_export', args=[f['playlist']])
+                            if f['playlist'] else None, False, None),
+}
+
+
+def percentile(values, pct):
+    """Linear interpolation between the closest ranks of sorted ``values``"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _request(client, method, url, body):
+    """Make one request and read the whole body, streaming or not"""
+    if method == 'form':
+        response = client.post(url, body)
+    elif body is not None:
+        response = client.generic(method.upper(), url, data=json.dumps(body), content_type='application/json')
+    else:
+        response = getattr(client, method)(url)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    else:
+        response.content
+    response.close()
+    return response
+
+
+def run_scenario(client, method, url, build_body=None, iterations=20, warmup=2):
+    timings = []
+    queries = 0
+    for _ in range(warmup):
+        _request(client, method, url, build_body() if build_body else None)
+    for _ in range(iterations):
+        with contextlib.ExitStack() as stack:
+            body = build_body() if build_body else None
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            start = time.perf_counter()
+            response = _request(client, method, url, body)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, sum(len(context) for context in captured))
+
+    # Separate pass: tracing allocations slows everything down
+    tracemalloc.start()
+    try:
+        _request(client, method, url, build_body() if build_body else None)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': queries,
+        'peak_memory_kb': round(peak / 1024, 1),
+        'error': None if response.status_code < 400 else f'HTTP {response.status_code}',
+    }
+
+
+def run_benchmarks(names=None, iterations=20, warmup=2, cold=False, log=None):
+    """
+    Run the named scenarios (default: all) and return the JSON-ready report.
+    ``cold`` swaps in a dummy cache so every request misses the page cache
+    and charts snapshot.
+    """
+    log = log or (lambda message: None)
+    fixtures = _fixtures()
+    if fixtures is None:
+        raise ValueError("No approved songs; run generate_catalog first")
+
+    overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+    if cold:
+        overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+    logged_in = Client()
+    if fixtures['user'] is not None:
+        logged_in.force_login(fixtures['user'])
+
+    results = {}
+    with override_settings(**overrides):
+        for name in names or SCENARIOS:
+            method, build_url, login, build_body = SCENARIOS[name]
+            try:
+                url = build_url(fixtures)
+                if url is None:
+                    results[name] = {'error': 'skipped: no data', 'skipped': True}
+                    continue
+                log(f"{name}: {'POST' if method == 'form' else method.upper()} {url}")
+                results[name] = run_scenario(
+                    # A fresh anonymous client, as signing up logs the client in
+                    logged_in if login else Client(), method, url,
+                    (lambda: build_body(fixtures)) if build_body else None,
+                    iterations=iterations, warmup=warmup,
+                )
+            except Exception as exc:
+                results[name] = {'error': f'{type(exc).__name__}: {exc}'}
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'cold': cold,
+        'catalog': {
+            'songs': Song.objects.count(),
+            'users': User.objects.count(),
+            'plays': SongPlay.objects.count(),
+            'likes': Like.objects.count(),
+            'playlists': Playlist.objects.count(),
+        },
+        'scenarios': results,
+    }
+
+
+def compare(report, baseline, tolerance=0.2, min_ms=5.0, min_memory_kb=64):
+    """
+    Regressions in ``report`` against ``baseline``, as (scenario, message)
+    pairs. Timings and memory may grow by ``tolerance`` (plus ``min_ms`` /
+    ``min_memory_kb`` for noise on very cheap views); query counts may not
+    grow at all.
+    """
+    regressions = []
+    for name, base in baseline.get('scenarios', {}).items():
+        current = report['scenarios'].get(name)
+        if current is None:
+            continue
+        if current.get('error'):
+            if not base.get('error'):
+                regressions.append((name, f"now fails: {current['error']}"))
+            continue
+        if base.get('error'):
+            continue
+        if current['queries'] > base['queries']:
+            regressions.append((name, f"queries {base['queries']} -> {current['queries']}"))
+        for field in ('p50_ms', 'p95_ms'):
+            if current[field] > base[field] * (1 + tolerance) + min_ms:
+                regressions.append((name, f"{field} {base[field]} -> {current[field]}"))
+        if current['peak_memory_kb'] > base['peak_memory_kb'] * (1 + tolerance) + min_memory_kb:
+            regressions.append((name, f"peak memory {base['peak_memory_kb']} KiB -> {current['peak_memory_kb']} KiB"))
+    return regressions
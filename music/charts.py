@@ -0,0 +1,87 @@
+"""
+Precomputed charts snapshot for the home page.
+
+The top played/downloaded/trending lists, genre counts and global totals
+are built together (five queries) and stored under one cache key. Readers get the
+snapshot in a single cache lookup; it is rebuilt when older than
+CHARTS_SNAPSHOT_MAX_AGE seconds, by the ``rebuild_charts`` management
+command, or straight away when an approved song is edited, approved,
+unapproved or removed.
+"""
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Genre, Song
+from .trending import trending
+
+CHARTS_CACHE_KEY = 'music:charts-snapshot'
+CHARTS_LOCK_KEY = 'music:charts-snapshot:lock'
+
+
+def get_max_age():
+    return getattr(settings, 'CHARTS_SNAPSHOT_MAX_AGE', 300)
+
+
+def build_charts_snapshot():
+    songs = Song.objects.for_listing().approved()
+    # most_played is the head of the featured list, so one query covers both
+    featured = list(songs.top_by('plays', 8))
+    totals = Song.objects.approved().aggregate(
+        total_songs=Count('id'),
+        total_plays=Sum('plays'),
+        total_downloads=Sum('downloads'),
+    )
+    return {
+        'featured_songs': featured,
+        'most_played': featured[:5],
+        'most_downloaded': list(songs.top_by('downloads', 5)),
+        'trending': list(trending(queryset=songs)[:5]),
+        'genres': list(Genre.objects.annotate(song_count=Count('song', filter=Q(song__is_approved=True)))),
+        'total_songs': totals['total_songs'],
+        'total_plays': totals['total_plays'] or 0,
+        'total_downloads': totals['total_downloads'] or 0,
+        'built_at': timezone.now(),
+    }
+
+
+def rebuild_charts_snapshot():
+    snapshot = build_charts_snapshot()
+    cache.set(CHARTS_CACHE_KEY, snapshot, timeout=None)
+    return snapshot
+
+
+def get_charts_snapshot():
+    """Return the cached snapshot, rebuilding it if missing or stale"""
+    snapshot = cache.get(CHARTS_CACHE_KEY)
+    if snapshot is not None:
+        age = (timezone.now() - snapshot['built_at']).total_seconds()
+        # Only one request rebuilds a stale snapshot; the rest keep serving it
+        if age <= get_max_age() or not cache.add(CHARTS_LOCK_KEY, 1, timeout=30):
+            return snapshot
+        try:
+            return rebuild_charts_snapshot()
+        finally:
+            cache.delete(CHARTS_LOCK_KEY)
+    return rebuild_charts_snapshot()
+
+
+def invalidate_charts_snapshot():
+    cache.delete(CHARTS_CACHE_KEY)
+
+
+@receiver(post_save, sender=Song)
+def song_saved(sender, instance, created, raw=False, **kwargs):
+    # Charts only list approved songs: rebuild when one is edited or the
+    # approval changes (counter flushes use UPDATE and never get here)
+    if not raw and (instance.is_approved or instance.was_approved):
+        invalidate_charts_snapshot()
+
+
+@receiver(post_delete, sender=Song)
+def song_deleted(sender, instance, **kwargs):
+    if instance.is_approved:
+        invalidate_charts_snapshot()
@@ -0,0 +1,196 @@
+"""
+Write-behind buffer for play and download counters.
+
+Views record plays/downloads here instead of writing to the database. A
+background thread flushes the accumulated deltas every
+COUNTER_FLUSH_INTERVAL seconds: one ``F()`` UPDATE per distinct delta (for
+the songs and their artists' totals), ``bulk_create`` for the
+SongPlay/SongDownload rows, and the matching trending score updates
+(trending.py). The buffer lives in the worker process, so a crash loses at
+most one flush window.
+
+Setting COUNTER_FLUSH_INTERVAL to 0 writes through on every call, for
+one-off scripts (and tests) that read the counters straight back.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def apply_counter_deltas(model, field, deltas):
+    """
+    Add ``deltas`` ({pk: n}) to ``field`` using one UPDATE per distinct n.
+    Most songs get the same small delta per window, so this is a handful of
+    statements however many songs were played.
+    """
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+class CounterBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._plays = Counter()
+        self._downloads = Counter()
+        self._play_events = []
+        self._download_events = []
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'COUNTER_FLUSH_INTERVAL', 5)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'COUNTER_FLUSH_BATCH_SIZE', 500)
+
+    def record_play(self, song_id, user_id=None, ip_address=None, duration_played=0, played_at=None,
+                    completed=False):
+        self.record_plays([{
+            'song_id': song_id,
+            'duration_played': duration_played,
+            'played_at': played_at or timezone.now(),
+            'completed': completed,
+        }], user_id=user_id, ip_address=ip_address)
+
+    def record_plays(self, events, user_id=None, ip_address=None):
+        """Buffer a batch of plays (dicts with song_id, played_at, duration_played, completed)"""
+        with self._lock:
+            for event in events:
+                self._plays[event['song_id']] += 1
+                self._play_events.append(dict(event, user_id=user_id, ip_address=ip_address))
+        self._after_record()
+
+    def record_download(self, song_id, user_id=None, ip_address=None):
+        self._record(self._downloads, self._download_events, song_id, {
+            'user_id': user_id,
+            'ip_address': ip_address,
+            'downloaded_at': timezone.now(),
+        })
+
+    def _record(self, counter, events, song_id, fields):
+        with self._lock:
+            counter[song_id] += 1
+            events.append(dict(fields, song_id=song_id))
+        self._after_record()
+
+    def _after_record(self):
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        self._ensure_started()
+        with self._lock:
+            pending = len(self._play_events) + len(self._download_events)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def pending_plays(self, song_id):
+        with self._lock:
+            return self._plays[song_id]
+
+    def pending_downloads(self, song_id):
+        with self._lock:
+            return self._downloads[song_id]
+
+    def _swap(self):
+        with self._lock:
+            batch = (self._plays, self._downloads, self._play_events, self._download_events)
+            self._plays, self._downloads = Counter(), Counter()
+            self._play_events, self._download_events = [], []
+        return batch
+
+    def _requeue(self, plays, downloads, play_events, download_events):
+        with self._lock:
+            self._plays.update(plays)
+            self._downloads.update(downloads)
+            self._play_events[:0] = play_events
+            self._download_events[:0] = download_events
+
+    def flush(self):
+        """Write all buffered deltas and events in one transaction"""
+        batch = self._swap()
+        plays, downloads, play_events, download_events = batch
+        if not (play_events or download_events):
+            return 0
+        try:
+            self._write(plays, downloads, play_events, download_events)
+        except Exception:
+            logger.exception("Counter flush failed; retrying next window")
+            self._requeue(*batch)
+            return 0
+        return len(play_events) + len(download_events)
+
+    def _write(self, plays, downloads, play_events, download_events):
+        from .models import Artist, Song, SongPlay, SongDownload
+        from . import trending
+
+        # Drop events for songs/users deleted since they were recorded
+        song_artists = dict(
+            Song.objects.filter(pk__in=set(plays) | set(downloads)).order_by().values_list('pk', 'artist_id')
+        )
+        song_ids = set(song_artists)
+        user_ids = {e['user_id'] for e in play_events + download_events if e['user_id']}
+        user_ids = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+        def valid(events):
+            for event in events:
+                if event['song_id'] not in song_ids:
+                    continue
+                if event['user_id'] not in user_ids:
+                    event['user_id'] = None
+                yield event
+
+        with transaction.atomic():
+            for counts, song_field, artist_field in ((plays, 'plays', 'play_count'), (downloads, 'downloads', 'download_count')):
+                counts = {pk: n for pk, n in counts.items() if pk in song_ids}
+                apply_counter_deltas(Song, song_field, counts)
+                artist_counts = Counter()
+                for pk, n in counts.items():
+                    artist_counts[song_artists[pk]] += n
+                apply_counter_deltas(Artist, artist_field, artist_counts)
+            new_plays = SongPlay.objects.bulk_create(
+                [SongPlay(**event) for event in valid(play_events)],
+                batch_size=self.batch_size,
+            )
+            new_downloads = SongDownload.objects.bulk_create(
+                [SongDownload(**event) for event in valid(download_events)],
+                batch_size=self.batch_size,
+            )
+            trending.record_events(
+                plays=[(play.song_id, play.played_at) for play in new_plays],
+                downloads=[(download.song_id, download.downloaded_at) for download in new_downloads],
+            )
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='counter-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+counter_buffer = CounterBuffer()
@@ -5,7 +5,7 @@ class SongUploadForm(forms.ModelForm):
     duration_minutes = forms.IntegerField(
         min_value=0,
         max_value=59,
-        required=True,
+        required=False,
         widget=forms.NumberInput(attrs={
             'class': 'form-input',
             'placeholder': 'Minutes',
@@ -16,7 +16,7 @@ class SongUploadForm(forms.ModelForm):
     duration_seconds = forms.IntegerField(
         min_value=0,
         max_value=59,
-        required=True,
+        required=False,
         widget=forms.NumberInput(attrs={
             'class': 'form-input',
             'placeholder': 'Seconds',
@@ -56,8 +56,9 @@ class SongUploadForm(forms.ModelForm):
         minutes = cleaned_data.get('duration_minutes')
         seconds = cleaned_data.get('duration_seconds')
         
-        if minutes is not None and seconds is not None:
-            total_seconds = (minutes * 60) + seconds
+        # Duration is optional: the media pipeline measures it from the file
+        if minutes is not None or seconds is not None:
+            total_seconds = ((minutes or 0) * 60) + (seconds or 0)
             if total_seconds <= 0:
                 raise forms.ValidationError("Duration must be greater than 0 seconds.")
             cleaned_data['duration'] = total_seconds
@@ -66,11 +67,8 @@ class SongUploadForm(forms.ModelForm):
     
     def save(self, commit=True):
         song = super().save(commit=False)
-        minutes = self.cleaned_data.get('duration_minutes')
-        seconds = self.cleaned_data.get('duration_seconds')
-        
-        if minutes is not None and seconds is not None:
-            song.duration = (minutes * 60) + seconds
+        # Left empty for the media pipeline to measure
+        song.duration = self.cleaned_data.get('duration')
         
         if commit:
             song.save()
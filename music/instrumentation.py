@@ -0,0 +1,313 @@
+"""
+Per-view request metrics, cheap enough to leave on in production.
+
+music.middleware.RequestMetricsMiddleware times every request, counts its
+queries and their time (via ``connection.execute_wrapper``), adds up
+template render time (TimedDjangoTemplates, the TEMPLATES backend) and
+notes the response size. Results are added to an in-memory histogram per
+(URL name, hour); a background thread merges them into RequestMetric rows
+every INSTRUMENTATION_FLUSH_INTERVAL seconds, like the counter buffer
+(counters.py). A request costs a few perf_counter() calls and one locked
+dict update, and the database sees one small transaction per flush.
+
+Latencies go into fixed buckets (LATENCY_BOUNDS_MS, four per doubling), so
+hourly rows merge by adding counts and percentiles are accurate to within
+~10%. Queries slower than INSTRUMENTATION_SLOW_QUERY_MS are sampled
+(INSTRUMENTATION_SLOW_QUERY_SAMPLE_RATE, at most
+INSTRUMENTATION_SLOW_QUERIES_PER_FLUSH per flush) into SlowQuery, without
+their parameters. The admin shows both, with p50/p95/p99 per URL name.
+
+Streaming responses are timed up to the first byte; queries made while the
+body streams are not counted.
+"""
+import atexit
+import contextvars
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets: 0.5ms to ~46s, four per doubling.
+# The last bucket (index len(LATENCY_BOUNDS_MS)) holds anything slower.
+LATENCY_BOUNDS_MS = [2 ** (step / 4) for step in range(-4, 63)]
+
+SQL_MAX_LENGTH = 4000
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def histogram_percentile(counts, pct, maximum=None):
+    """
+    Estimate the ``pct`` percentile (ms) from bucket counts, interpolating
+    linearly inside the bucket it falls in, capped at the slowest request
+    seen (``maximum``) when given
+    """
+    estimate = _bucket_percentile(counts, pct)
+    if estimate is None or maximum is None:
+        return estimate
+    return min(estimate, maximum)
+
+
+def _bucket_percentile(counts, pct):
+    total = sum(counts)
+    if not total:
+        return None
+    rank = total * pct / 100
+    seen = 0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            low = LATENCY_BOUNDS_MS[index - 1] if index > 0 else 0.0
+            high = LATENCY_BOUNDS_MS[index] if index < len(LATENCY_BOUNDS_MS) else LATENCY_BOUNDS_MS[-1] * 2
+            return low + (high - low) * (rank - seen) / count
+        seen += count
+    return LATENCY_BOUNDS_MS[-1]
+
+
+def merge_histograms(a, b):
+    size = max(len(a), len(b))
+    return [
+        (a[index] if index < len(a) else 0) + (b[index] if index < len(b) else 0)
+        for index in range(size)
+    ]
+
+
+# The request being measured in this thread/task, if any
+_current = contextvars.ContextVar('music_request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent on queries and templates"""
+    __slots__ = ('queries', 'query_ms', 'template_ms', 'slow_queries')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_ms = 0.0
+        self.template_ms = 0.0
+        self.slow_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.queries += 1
+            self.query_ms += elapsed
+            if (elapsed >= get_setting('INSTRUMENTATION_SLOW_QUERY_MS', 100)
+                    and random.random() < get_setting('INSTRUMENTATION_SLOW_QUERY_SAMPLE_RATE', 0.1)):
+                self.slow_queries.append((sql[:SQL_MAX_LENGTH], elapsed))
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+
+class TimedTemplate(Template):
+    def __init__(self, template):
+        super().__init__(template.template, template.backend)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_ms += (time.perf_counter() - start) * 1000
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for the request metrics"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class ViewStats:
+    """Running totals for one (view, hour)"""
+    __slots__ = ('requests', 'errors', 'total_ms', 'max_ms', 'queries', 'query_ms', 'template_ms',
+                 'response_bytes', 'histogram')
+
+    TOTALS = ('requests', 'errors', 'total_ms', 'queries', 'query_ms', 'template_ms', 'response_bytes')
+
+    def __init__(self):
+        for field in self.TOTALS:
+            setattr(self, field, 0)
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+
+    def add(self, elapsed_ms, stats, status_code, response_bytes):
+        self.requests += 1
+        self.errors += status_code >= 500
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.queries += stats.queries
+        self.query_ms += stats.query_ms
+        self.template_ms += stats.template_ms
+        self.response_bytes += response_bytes
+        self.histogram[bisect_left(LATENCY_BOUNDS_MS, elapsed_ms)] += 1
+
+    def merge_into(self, target):
+        """Add these totals to ``target`` (a ViewStats or RequestMetric)"""
+        _merge(self, target)
+
+
+def _merge(source, target):
+    for field in ViewStats.TOTALS:
+        setattr(target, field, getattr(target, field) + getattr(source, field))
+    target.max_ms = max(target.max_ms, source.max_ms)
+    target.histogram = merge_histograms(target.histogram, source.histogram)
+
+
+class MetricsBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {}
+        self._slow_queries = []
+        # The database the buffered stats were gathered against
+        self._database = None
+
+    @property
+    def flush_interval(self):
+        return get_setting('INSTRUMENTATION_FLUSH_INTERVAL', 60)
+
+    def record(self, view_name, elapsed_ms, stats, status_code, response_bytes, now):
+        key = (view_name, now.replace(minute=0, second=0, microsecond=0))
+        max_slow = get_setting('INSTRUMENTATION_SLOW_QUERIES_PER_FLUSH', 50)
+        database = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        with self._lock:
+            if database != self._database:
+                # The test runner swapped databases; don't carry stats across
+                self._stats, self._slow_queries, self._database = {}, [], database
+            view_stats = self._stats.get(key)
+            if view_stats is None:
+                view_stats = self._stats[key] = ViewStats()
+            view_stats.add(elapsed_ms, stats, status_code, response_bytes)
+            for sql, duration in stats.slow_queries[:max(max_slow - len(self._slow_queries), 0)]:
+                self._slow_queries.append((view_name, sql, duration, now))
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_started()
+
+    def _swap(self):
+        with self._lock:
+            batch = (self._stats, self._slow_queries)
+            self._stats, self._slow_queries = {}, []
+        return batch
+
+    def _requeue(self, stats, slow_queries):
+        with self._lock:
+            for key, view_stats in stats.items():
+                view_stats.merge_into(self._stats.setdefault(key, ViewStats()))
+            self._slow_queries[:0] = slow_queries
+
+    def flush(self):
+        """Merge the buffered stats into RequestMetric rows in one transaction"""
+        database = self._database
+        stats, slow_queries = batch = self._swap()
+        if not (stats or slow_queries):
+            return 0
+        if connections[DEFAULT_DB_ALIAS].settings_dict['NAME'] != database:
+            # Gathered against a test database that is gone by now (atexit)
+            return 0
+        try:
+            self._write(stats, slow_queries)
+        except Exception:
+            logger.exception("Request metrics flush failed; retrying next window")
+            self._requeue(*batch)
+            return 0
+        return len(stats)
+
+    def _write(self, stats, slow_queries):
+        from .models import RequestMetric, SlowQuery
+
+        with transaction.atomic():
+            rows = RequestMetric.objects.select_for_update().filter(
+                hour__in={hour for _, hour in stats},
+                view_name__in={view_name for view_name, _ in stats},
+            )
+            existing = {(row.view_name, row.hour): row for row in rows}
+            created, updated = [], []
+            for (view_name, hour), view_stats in stats.items():
+                row = existing.get((view_name, hour))
+                if row is None:
+                    row = RequestMetric(view_name=view_name, hour=hour)
+                    created.append(row)
+                else:
+                    updated.append(row)
+                view_stats.merge_into(row)
+            RequestMetric.objects.bulk_create(created)
+            RequestMetric.objects.bulk_update(updated, [*ViewStats.TOTALS, 'max_ms', 'histogram'])
+            SlowQuery.objects.bulk_create([
+                SlowQuery(view_name=view_name, sql=sql, duration_ms=duration, recorded_at=when)
+                for view_name, sql, duration, when in slow_queries
+            ])
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+metrics_buffer = MetricsBuffer()
+
+
+def summarize(metrics):
+    """
+    Merge RequestMetric rows into one summary per URL name (a dict with
+    totals, averages and p50/p95/p99), slowest p95 first
+    """
+    totals = {}
+    for metric in metrics:
+        _merge(metric, totals.setdefault(metric.view_name, ViewStats()))
+    summary = []
+    for view_name, view_stats in totals.items():
+        requests = view_stats.requests or 1
+        summary.append({
+            'view_name': view_name,
+            'requests': view_stats.requests,
+            'errors': view_stats.errors,
+            'mean_ms': view_stats.total_ms / requests,
+            'p50_ms': histogram_percentile(view_stats.histogram, 50, view_stats.max_ms),
+            'p95_ms': histogram_percentile(view_stats.histogram, 95, view_stats.max_ms),
+            'p99_ms': histogram_percentile(view_stats.histogram, 99, view_stats.max_ms),
+            'max_ms': view_stats.max_ms,
+            'queries': view_stats.queries / requests,
+            'query_ms': view_stats.query_ms / requests,
+            'template_ms': view_stats.template_ms / requests,
+            'response_kb': view_stats.response_bytes / requests / 1024,
+        })
+    summary.sort(key=lambda row: row['p95_ms'] or 0, reverse=True)
+    return summary
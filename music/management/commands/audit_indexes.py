@@ -0,0 +1,156 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from music.models import (
+    ArtistStatRollup, Genre, MediaJob, Playlist, PlaylistEntry, Song, SongDownload, SongPlay, SongStatRollup,
+)
+from music.pagination import _seek_filter
+from music.trending import WINDOWS as TRENDING_WINDOWS, trending
+from music.views import DISCOVER_SORTS
+
+# Small lookup tables that are fine to read in full
+ALLOWED_SCANS = {'music_genre'}
+
+# Queries whose scans are accepted, and why
+ACCEPTED_SCANS = {
+    'home: charts totals': "sums every approved song; runs once per charts snapshot, not per request",
+    'discover: text filter': "icontains can't use a B-tree; pages are cached and stop at the LIMIT "
+                             "(full-text search is the search page's job)",
+}
+
+# Any SCAN, whether of the table or of a whole index (SQLite's SEARCH is the indexed lookup)
+FULL_SCAN_RE = re.compile(r'\bSCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?')
+
+
+def charts_totals():
+    # The aggregate in charts.build_charts_snapshot
+    Song.objects.approved().aggregate(total_songs=Count('id'), total_plays=Sum('plays'), total_downloads=Sum('downloads'))
+
+
+def discover_queries():
+    songs = Song.objects.for_listing()
+    sample = {'upload_date': timezone.now(), 'plays': 0, 'downloads': 0, 'title': 'm', 'id': 1}
+    for sort, ordering in DISCOVER_SORTS.items():
+        # The first page, and a later page seeking past a cursor
+        seek = _seek_filter(ordering, [sample[field.lstrip('-')] for field in ordering])
+        for label, queryset in (('', songs), (' by genre', songs.by_genre(1))):
+            yield f'discover: {sort}{label}', queryset.order_by(*ordering)[:25]
+            yield f'discover: {sort}{label}, next page', queryset.order_by(*ordering).filter(seek)[:25]
+    text = Q(title__icontains='love') | Q(artist__name__icontains='love')
+    yield 'discover: text filter', songs.filter(text).order_by(*DISCOVER_SORTS['newest'])[:25]
+
+
+def view_queries():
+    """
+    The querysets the music views run, with placeholder ids. A callable
+    stands for queries that aren't querysets (aggregates); the SQL it runs
+    is explained instead.
+    """
+    now = timezone.now()
+    week_ago = now - timezone.timedelta(days=7)
+    approved = Song.objects.for_listing().approved()
+
+    yield 'home: recent plays', SongPlay.objects.filter(user=1).select_related('song__artist').order_by('-played_at')[:5]
+    yield 'home: charts most played', approved.top_by('plays', 8)
+    yield 'home: charts most downloaded', approved.top_by('downloads', 5)
+    yield 'home: charts totals', charts_totals
+    yield 'home: charts genres', Genre.objects.annotate(song_count=Count('song', filter=Q(song__is_approved=True)))
+    yield from discover_queries()
+    yield 'genre_songs', Song.objects.for_listing().by_genre(1)
+    yield 'home: charts trending', trending(queryset=approved)[:5]
+    for window in TRENDING_WINDOWS:
+        yield f'trending: {window}', trending(window, queryset=Song.objects.for_player())[:20]
+        yield f'trending: {window} by genre', trending(window, genre=1, queryset=Song.objects.for_player())[:20]
+    yield 'top_songs: played', approved.top_by('plays', 10)
+    yield 'top_songs: downloaded', approved.top_by('downloads', 10)
+    yield 'library: liked songs', (
+        Song.objects.for_listing().filter(likes__user=1).order_by('-likes__liked_at')
+    )
+    yield 'library: playlists', Playlist.objects.filter(user=1).with_song_count()
+    yield 'my_uploads', Song.objects.for_listing().by_artist(1).order_by('-upload_date')
+    yield 'artist_dashboard: songs', Song.objects.for_listing().by_artist(1)
+    yield 'artist_dashboard: rollups', ArtistStatRollup.objects.filter(artist=1, period='day', bucket__gte=week_ago)
+    yield 'artist_dashboard: recent events', (
+        SongPlay.objects.filter(id__gt=1, song__artist=1, played_at__gte=week_ago).values('played_at')
+    )
+    yield 'song_analytics: rollups', SongStatRollup.objects.filter(song=1, period='day', bucket__gte=week_ago)
+    yield 'song_analytics: recent plays', SongPlay.objects.filter(song=1).select_related('user')[:20]
+    yield 'song_analytics: recent downloads', SongDownload.objects.filter(song=1).select_related('user')[:20]
+    yield 'api: songs', Song.objects.for_player().filter(id__in=[1, 2, 3])
+    yield 'api: related songs', Song.objects.for_player().approved().filter(neighbor_of__song=1).order_by('-neighbor_of__score')[:10]
+    yield 'home: recommended', (
+        Song.objects.for_listing().approved().filter(recommended_to__user=1).order_by('-recommended_to__score')[:8]
+    )
+    yield 'api: playlist queue', PlaylistEntry.objects.filter(playlist=1).order_by('position').values_list('song_id')
+    yield 'api: playlist export', (
+        Song.objects.for_player().filter(playlist_entries__playlist=1).order_by('playlist_entries__position')
+    )
+    yield 'api: genre queue', Song.objects.for_player().by_genre(1).order_by('-upload_date', '-id')[:51]
+    yield 'upload_status', MediaJob.objects.select_related('song').filter(id=1)
+    yield 'media worker: next job', MediaJob.objects.filter(status='queued').values_list('id', flat=True)[:10]
+
+
+def explain(query):
+    if not callable(query):
+        return query.explain()
+    with CaptureQueriesContext(connection) as ctx:
+        query()
+    lines = []
+    with connection.cursor() as cursor:
+        for captured in ctx.captured_queries:
+            cursor.execute('EXPLAIN QUERY PLAN ' + captured['sql'])
+            lines += [' '.join(map(str, row)) for row in cursor.fetchall()]
+    return '\n'.join(lines)
+
+
+def full_scans(query, plan, strict=False):
+    """
+    Tables ``plan`` reads in full. Walking an index in order is fine when the
+    query has a LIMIT and nothing is sorted afterwards: it stops after that
+    many rows (top-N charts, first pages). Unless ``strict``: a filter the
+    index can't answer (icontains) may walk the whole index before the LIMIT
+    is reached, so such queries are listed in ACCEPTED_SCANS.
+    """
+    limited = not strict and not callable(query) and query.query.high_mark is not None
+    sorted_after = 'USE TEMP B-TREE FOR ORDER BY' in plan
+    scans = []
+    for match in map(FULL_SCAN_RE.search, plan.splitlines()):
+        if not match or match.group(1) in ALLOWED_SCANS:
+            continue
+        if match.group(2) and limited and not sorted_after:
+            continue
+        scans.append(match.group(1))
+    return scans
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the querysets used by the music views and fail if any does a full table scan"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("audit_indexes reads SQLite's EXPLAIN QUERY PLAN output; run it against SQLite")
+
+        failures = []
+        for label, query in view_queries():
+            plan = explain(query)
+            scans = full_scans(query, plan, strict=label in ACCEPTED_SCANS)
+            if scans and label in ACCEPTED_SCANS:
+                self.stdout.write(f"ok   {label} (accepted scan of {', '.join(scans)}: {ACCEPTED_SCANS[label]})")
+                scans = []
+            elif scans:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f"FAIL {label}: full scan of {', '.join(scans)}"))
+            else:
+                self.stdout.write(f"ok   {label}")
+            if options['verbosity'] > 1 or scans:
+                for line in plan.splitlines():
+                    self.stdout.write(f"       {line}")
+
+        if failures:
+            raise CommandError(f"{len(failures)} queries do a full table scan")
+        self.stdout.write(self.style.SUCCESS("All view queries use an index"))
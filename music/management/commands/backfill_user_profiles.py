@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from music.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Create missing UserProfiles (users made through the admin or createsuperuser). "
+        "Users with an artist profile get user_type 'artist'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Profiles per INSERT")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        missing = (
+            User.objects.filter(userprofile__isnull=True)
+            .values_list('id', 'artist_profile__id')
+            .order_by('id')
+        )
+        created = 0
+        while True:
+            # Each pass picks up where the last left off; created rows drop out of the filter
+            batch = list(missing[:batch_size])
+            if not batch:
+                break
+            UserProfile.objects.bulk_create(
+                [
+                    UserProfile(user_id=user_id, user_type='artist' if artist_id else 'listener')
+                    for user_id, artist_id in batch
+                ],
+                # A profile created concurrently wins
+                ignore_conflicts=True,
+            )
+            created += len(batch)
+        self.stdout.write(f"Created {created} user profiles")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from music.recommendations import full_build, incremental_build
+
+
+class Command(BaseCommand):
+    help = "Rebuild the related-songs table and users' recommended songs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only process events added since the previous run")
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Songs (and users) processed per batch")
+
+    def handle(self, *args, **options):
+        build = incremental_build if options['incremental'] else full_build
+        result = build(chunk_size=options['chunk_size'])
+        self.stdout.write(
+            f"Updated {result['songs']} songs ({result['neighbors']} neighbours) "
+            f"and {result['users']} users ({result['recommendations']} recommendations)"
+        )
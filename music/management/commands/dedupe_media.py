@@ -0,0 +1,129 @@
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from music.charts import invalidate_charts_snapshot
+from music.models import Artist, MediaBlob, Playlist, Song, UserProfile
+from music.storage import content_storage
+from music.thumbnails import FORMATS, SCALES, derivative_name, get_presets
+
+FILE_FIELDS = [
+    (Song, 'audio_file'),
+    (Song, 'cover_image'),
+    (Song, 'stream_file'),
+    (Artist, 'image'),
+    (Playlist, 'cover_image'),
+    (UserProfile, 'profile_picture'),
+]
+UPLOAD_DIRS = ('songs', 'covers', 'artists', 'streams', 'playlist_covers', 'profile_pics')
+HASHED_NAME_RE = re.compile(r'^[\w-]+/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Move uploaded media into content-addressed storage and delete files "
+        "no model refers to (including the legacy root-level upload folders)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without touching anything")
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help="Never delete files modified more recently than this")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.cutoff = time.time() - options['grace_hours'] * 3600
+        self.storage = content_storage()
+
+        migrated = self.migrate_files()
+        if migrated and not self.dry_run:
+            invalidate_charts_snapshot()
+        removed, freed = self.collect_garbage()
+
+        prefix = "Would move" if self.dry_run else "Moved"
+        self.stdout.write(f"{prefix} {migrated} file references into content-addressed storage")
+        prefix = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(f"{prefix} {removed} unreferenced files ({freed / 1024 / 1024:.1f} MB)")
+
+    def locate(self, name):
+        # Early uploads were written relative to the project root, not MEDIA_ROOT
+        for root in (settings.MEDIA_ROOT, settings.BASE_DIR):
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def migrate_files(self):
+        moved = {}
+        count = 0
+        for model, field in FILE_FIELDS:
+            upload_to = model._meta.get_field(field).upload_to
+            rows = model.objects.exclude(**{field: ''}).exclude(**{field: None}).values_list('pk', field)
+            for pk, name in rows:
+                if HASHED_NAME_RE.match(name):
+                    continue
+                if name not in moved:
+                    path = self.locate(name)
+                    if path is None:
+                        self.stderr.write(f"{model.__name__} {pk}: missing file {name}")
+                        continue
+                    if self.dry_run:
+                        moved[name] = name
+                    else:
+                        with open(path, 'rb') as fh:
+                            moved[name] = self.storage.save(upload_to + os.path.basename(name), File(fh))
+                if not self.dry_run:
+                    model.objects.filter(pk=pk).update(**{field: moved[name]})
+                count += 1
+        return count
+
+    def referenced_names(self):
+        names = set()
+        for model, field in FILE_FIELDS:
+            names.update(model.objects.exclude(**{field: ''}).exclude(**{field: None}).values_list(field, flat=True))
+        return names
+
+    def expected_derivatives(self, referenced):
+        images = {name for name in referenced if not name.startswith(('songs/', 'streams/'))}
+        return {
+            derivative_name(name, preset, scale, fmt)
+            for name in images for preset in get_presets() for scale in SCALES for fmt in FORMATS
+        }
+
+    def collect_garbage(self):
+        referenced = self.referenced_names()
+        media_root = str(settings.MEDIA_ROOT)
+        targets = [(media_root, d, referenced) for d in UPLOAD_DIRS]
+        # Root-level copies are never served; keep only ones a row still points at
+        targets += [(str(settings.BASE_DIR), d, referenced) for d in UPLOAD_DIRS if str(settings.BASE_DIR) != media_root]
+        targets.append((media_root, 'derived', self.expected_derivatives(referenced)))
+
+        removed, freed = 0, 0
+        deleted_blobs = []
+        for root, directory, keep in targets:
+            top = os.path.join(root, directory)
+            for dirpath, dirnames, filenames in os.walk(top, topdown=False):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, root).replace(os.sep, '/')
+                    if name in keep:
+                        continue
+                    stat = os.stat(path)
+                    if stat.st_mtime > self.cutoff:
+                        continue
+                    removed += 1
+                    freed += stat.st_size
+                    if root == media_root:
+                        deleted_blobs.append(name)
+                    if not self.dry_run:
+                        os.remove(path)
+                if not self.dry_run and dirpath != top and not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+
+        if not self.dry_run:
+            MediaBlob.objects.filter(name__in=deleted_blobs).delete()
+        return removed, freed
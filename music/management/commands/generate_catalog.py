@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from music.benchmarks import generate_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a synthetic catalog for run_benchmarks "
+        "(use a scratch database: set SQLITE_PATH)"
+    )
+
+    def add_arguments(self, parser):
+        for name, default, help_text in (
+            ('genres', 10, "Genres"),
+            ('artists', 200, "Artists (each with its own user)"),
+            ('songs', 5000, "Songs"),
+            ('users', 1000, "Listeners"),
+            ('plays', 50000, "SongPlay rows"),
+            ('downloads', 5000, "SongDownload rows"),
+            ('likes', 10000, "Likes (duplicates are dropped)"),
+            ('playlists', 500, "Playlists"),
+            ('playlist-size', 20, "Songs per playlist"),
+            ('audio-files', 8, "Distinct dummy audio files shared by the songs"),
+            ('days', 30, "Spread upload, play and like times over this many days"),
+            ('seed', 0, "Random seed"),
+            ('batch-size', 1000, "Rows per INSERT"),
+        ):
+            parser.add_argument(f'--{name}', type=int, default=default, help=help_text)
+        parser.add_argument('--prefix', default='bench', help="Prefix for generated usernames")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f"Users named '{prefix}-...' already exist; pass a different --prefix")
+        counts = generate_catalog(
+            genres=options['genres'], artists=options['artists'], songs=options['songs'],
+            users=options['users'], plays=options['plays'], downloads=options['downloads'],
+            likes=options['likes'], playlists=options['playlists'],
+            playlist_size=options['playlist_size'], audio_files=options['audio_files'],
+            days=options['days'], prefix=prefix, seed=options['seed'],
+            batch_size=options['batch_size'], log=self.stdout.write,
+        )
+        self.stdout.write(', '.join(f"{count} {name.replace('_', ' ')}" for name, count in counts.items()))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from music.models import Artist, Playlist, Song
+from music.thumbnails import generate_all
+
+
+class Command(BaseCommand):
+    help = "Generate every thumbnail preset for existing cover and artist images"
+
+    def handle(self, *args, **options):
+        sources = set()
+        sources.update(Song.objects.exclude(cover_image='').exclude(cover_image=None).values_list('cover_image', flat=True))
+        sources.update(Artist.objects.exclude(image='').exclude(image=None).values_list('image', flat=True))
+        sources.update(Playlist.objects.exclude(cover_image='').exclude(cover_image=None).values_list('cover_image', flat=True))
+
+        failed = 0
+        for source in sorted(sources):
+            try:
+                generate_all(source)
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"{source}: {e}")
+        self.stdout.write(f"Generated thumbnails for {len(sources) - failed} images ({failed} failed)")
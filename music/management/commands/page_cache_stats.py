@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+import music.views  # noqa: F401  (registers the cached views)
+from music.pagecache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Show page cache hits and misses per view. Counts live in the cache, "
+        "so this only sees other processes with the file or Redis backend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters after printing them")
+
+    def handle(self, *args, **options):
+        for view, counts in get_stats().items():
+            total = counts['hit'] + counts['miss']
+            ratio = counts['hit'] / total * 100 if total else 0
+            self.stdout.write(f"{view:<20} {counts['hit']:>8} hits {counts['miss']:>8} misses  {ratio:5.1f}% hit rate")
+        if options['reset']:
+            reset_stats()
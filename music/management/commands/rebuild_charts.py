@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music.charts import rebuild_charts_snapshot
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cached home page charts snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Keep running and rebuild every N seconds (background tick)",
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            snapshot = rebuild_charts_snapshot()
+            self.stdout.write(
+                f"Charts snapshot rebuilt: {snapshot['total_songs']} songs, "
+                f"{snapshot['total_plays']} plays"
+            )
+            if interval <= 0:
+                break
+            time.sleep(interval)
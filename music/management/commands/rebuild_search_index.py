@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from music.models import Song
+from music.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the song search index from the database"
+
+    def handle(self, *args, **options):
+        get_search_backend().rebuild()
+        self.stdout.write(f"Search index rebuilt ({Song.objects.approved().count()} approved songs)")
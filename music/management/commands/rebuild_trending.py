@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from music.trending import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the decayed trending scores from the raw play/download events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(f"Rebuilt trending scores for {count} songs")
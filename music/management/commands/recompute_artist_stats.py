@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from music.models import Artist
+
+
+class Command(BaseCommand):
+    help = "Recompute every artist's denormalised song/play/download totals from the songs table"
+
+    def handle(self, *args, **options):
+        updated = Artist.objects.update(**Artist.stats_from_songs())
+        self.stdout.write(f"Recomputed stats for {updated} artists")
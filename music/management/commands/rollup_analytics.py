@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from music.rollups import compact, rollup
+
+
+class Command(BaseCommand):
+    help = "Fold new play/download events into the hourly and daily rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--compact', action='store_true',
+                            help="Also delete raw events and hourly rollups past their retention window")
+
+    def handle(self, *args, **options):
+        processed = rollup(batch_size=options['batch_size'])
+        self.stdout.write(f"Rolled up {processed} events")
+        if options['compact']:
+            for source, count in compact().items():
+                self.stdout.write(f"Deleted {count} rows from {source}")
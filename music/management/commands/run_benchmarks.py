@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music.benchmarks import SCENARIOS, compare, run_benchmarks
+from music.counters import counter_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles, query counts and peak memory per view "
+        "through the test client, optionally against a baseline JSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                            help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+        parser.add_argument('--iterations', type=int, default=20, help="Timed requests per scenario")
+        parser.add_argument('--warmup', type=int, default=2, help="Untimed requests before timing")
+        parser.add_argument('--cold', action='store_true',
+                            help="Use a dummy cache, so cached pages and snapshots are rebuilt every time")
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+        parser.add_argument('--baseline', help="JSON report from a previous run to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed relative growth in latency and memory (default 0.2)")
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        try:
+            report = run_benchmarks(
+                options['scenarios'], iterations=options['iterations'], warmup=options['warmup'],
+                cold=options['cold'], log=self.stderr.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            # Plays and downloads recorded by the scenarios
+            counter_buffer.flush()
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+            for name, result in report['scenarios'].items():
+                if result.get('error') and 'p50_ms' not in result:
+                    self.stdout.write(f"{name:<20} {result['error']}")
+                else:
+                    self.stdout.write(
+                        f"{name:<20} p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+                        f"{result['queries']:>3} queries  {result['peak_memory_kb']:>9.1f} KiB"
+                        + (f"  {result['error']}" if result['error'] else '')
+                    )
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        failed = [
+            name for name, result in report['scenarios'].items()
+            if result.get('error') and not result.get('skipped')
+        ]
+        if failed:
+            # A failing view can't show a regression, so don't let it pass quietly
+            raise CommandError(f"Scenarios failed: {', '.join(failed)}")
+
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)
+            regressions = compare(report, baseline, tolerance=options['tolerance'])
+            if regressions:
+                raise CommandError(
+                    "Regressions against the baseline:\n"
+                    + '\n'.join(f"  {name}: {message}" for name, message in regressions)
+                )
+            self.stderr.write("No regressions against the baseline")
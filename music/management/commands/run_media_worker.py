@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from music.pipeline import run_worker
+
+
+class Command(BaseCommand):
+    help = "Process queued media jobs (duration probing, hashing, transcoding)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help="Jobs to process in parallel")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds between queue checks")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        run_worker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+        )
@@ -0,0 +1,46 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+from .instrumentation import RequestStats, metrics_buffer
+
+
+class RequestMetricsMiddleware:
+    """
+    Record latency, queries, template time and response size per URL name
+    (see instrumentation.py). Put it after WhiteNoise so static files are
+    left out.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = stats.activate()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            RequestStats.deactivate(token)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        metrics_buffer.record(
+            match.view_name if match else '(unresolved)',
+            elapsed_ms, stats, response.status_code, size, timezone.now(),
+        )
+        return response
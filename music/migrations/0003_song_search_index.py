@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 virtual table used by music.search.SQLiteFTSBackend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS music_song_fts USING fts5("
+        "title, artist, genre, bio, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO music_song_fts (rowid, title, artist, genre, bio) "
+        "SELECT s.id, s.title, a.name, g.name, COALESCE(a.bio, '') "
+        "FROM music_song s "
+        "INNER JOIN music_artist a ON a.id = s.artist_id "
+        "INNER JOIN music_genre g ON g.id = s.genre_id "
+        "WHERE s.is_approved"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS music_song_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0002_buffered_event_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
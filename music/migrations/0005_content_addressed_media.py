@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:47
+
+import django.core.validators
+import music.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_media_pipeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('size', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='artist',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=music.storage.content_storage, upload_to='artists/'),
+        ),
+        migrations.AlterField(
+            model_name='playlist',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, storage=music.storage.content_storage, upload_to='playlist_covers/'),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='audio_file',
+            field=models.FileField(storage=music.storage.content_storage, upload_to='songs/', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['mp3', 'wav', 'ogg'])]),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, storage=music.storage.content_storage, upload_to='covers/'),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='stream_file',
+            field=models.FileField(blank=True, null=True, storage=music.storage.content_storage, upload_to='streams/'),
+        ),
+    ]
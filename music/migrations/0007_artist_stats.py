@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:50
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_artist_stats(apps, schema_editor):
+    Artist = apps.get_model('music', 'Artist')
+    Song = apps.get_model('music', 'Song')
+    songs = Song.objects.filter(artist=models.OuterRef('pk')).order_by().values('artist')
+    Artist.objects.update(**{
+        field: Coalesce(models.Subquery(songs.annotate(total=aggregate).values('total')), 0)
+        for field, aggregate in (
+            ('song_count', models.Count('id')),
+            ('play_count', models.Sum('plays')),
+            ('download_count', models.Sum('downloads')),
+        )
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='download_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='play_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='song_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_artist_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0007_artist_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['-upload_date', '-id'], name='music_song_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['-plays', '-id'], name='music_song_plays_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['-downloads', '-id'], name='music_song_downloads_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['title', 'id'], name='music_song_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['genre', '-upload_date', '-id'], name='music_song_genre_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['artist', '-upload_date', '-id'], name='music_song_artist_upload_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['-plays', '-id'], name='music_song_approved_plays_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['-downloads', '-id'], name='music_song_approved_dls_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='songdownload',
+            index=models.Index(fields=['song', '-downloaded_at'], name='music_download_song_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='songdownload',
+            index=models.Index(fields=['user', '-downloaded_at'], name='music_download_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='songplay',
+            index=models.Index(fields=['song', '-played_at'], name='music_play_song_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='songplay',
+            index=models.Index(fields=['user', '-played_at'], name='music_play_user_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='songplay',
+            name='completed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def merge_liked_songs(apps, schema_editor):
+    """Copy UserProfile.liked_songs into Like and count the likes per song"""
+    UserProfile = apps.get_model('music', 'UserProfile')
+    Like = apps.get_model('music', 'Like')
+    Song = apps.get_model('music', 'Song')
+    liked = UserProfile.liked_songs.through.objects.values_list('userprofile__user_id', 'song_id')
+    Like.objects.bulk_create(
+        [Like(user_id=user_id, song_id=song_id) for user_id, song_id in liked.iterator()],
+        batch_size=500,
+        # Songs liked in both stores
+        ignore_conflicts=True,
+    )
+    likes = Like.objects.filter(song=models.OuterRef('pk')).order_by().values('song')
+    Song.objects.update(like_count=Coalesce(
+        models.Subquery(likes.annotate(total=models.Count('id')).values('total')), 0,
+    ))
+
+
+def restore_liked_songs(apps, schema_editor):
+    UserProfile = apps.get_model('music', 'UserProfile')
+    Like = apps.get_model('music', 'Like')
+    Through = UserProfile.liked_songs.through
+    profiles = dict(UserProfile.objects.values_list('user_id', 'id'))
+    Through.objects.bulk_create(
+        [
+            Through(userprofile_id=profiles[user_id], song_id=song_id)
+            for user_id, song_id in Like.objects.values_list('user_id', 'song_id').iterator()
+            if user_id in profiles
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0009_songplay_completed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='song',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='likes', to='music.song'),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='likes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', '-liked_at'], name='music_like_user_idx'),
+        ),
+        migrations.RunPython(merge_liked_songs, restore_liked_songs),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='liked_songs',
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0010_likes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_to', to='music.song')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-score'], name='music_recommendation_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'song'), name='unique_user_recommendation')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SongNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='music.song')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='music.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['song', '-score'], name='music_neighbor_song_idx')],
+                'constraints': [models.UniqueConstraint(fields=('song', 'neighbor'), name='unique_song_neighbor')],
+            },
+        ),
+    ]
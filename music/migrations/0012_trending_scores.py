@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0011_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='trending_day',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='trending_week',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_approved', True), ('trending_day__isnull', False)), fields=['-trending_day', '-id'], name='music_song_trending_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_approved', True), ('trending_week__isnull', False)), fields=['-trending_week', '-id'], name='music_song_trending_week_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_approved', True), ('trending_day__isnull', False)), fields=['genre', '-trending_day', '-id'], name='music_song_genre_trend_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_approved', True), ('trending_week__isnull', False)), fields=['genre', '-trending_week', '-id'], name='music_song_genre_trend_wk_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# playlists.POSITION_GAP when this migration was written
+POSITION_GAP = 1 << 16
+
+
+def copy_playlist_songs(apps, schema_editor):
+    """Number each playlist's songs in the order they were added"""
+    Playlist = apps.get_model('music', 'Playlist')
+    PlaylistEntry = apps.get_model('music', 'PlaylistEntry')
+    created = dict(Playlist.objects.values_list('id', 'created_at'))
+    rows = Playlist.songs.through.objects.order_by('playlist_id', 'id').values_list('id', 'playlist_id', 'song_id')
+    entries, previous, rank = [], None, 0
+    for entry_id, playlist_id, song_id in rows.iterator():
+        rank = rank + 1 if playlist_id == previous else 1
+        previous = playlist_id
+        # Same ids, so the recommendations' incremental marks stay valid
+        entries.append(PlaylistEntry(
+            id=entry_id, playlist_id=playlist_id, song_id=song_id,
+            position=rank * POSITION_GAP, added_at=created[playlist_id],
+        ))
+    PlaylistEntry.objects.bulk_create(entries, batch_size=500)
+
+
+def restore_playlist_songs(apps, schema_editor):
+    Playlist = apps.get_model('music', 'Playlist')
+    PlaylistEntry = apps.get_model('music', 'PlaylistEntry')
+    Through = Playlist.songs.through
+    rows = PlaylistEntry.objects.order_by('playlist_id', 'position').values_list('playlist_id', 'song_id')
+    Through.objects.bulk_create(
+        [Through(playlist_id=playlist_id, song_id=song_id) for playlist_id, song_id in rows.iterator()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0012_trending_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.BigIntegerField()),
+                ('added_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='music.playlist')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='playlist_entries', to='music.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['playlist', 'position'], name='music_entry_position_idx')],
+                'constraints': [models.UniqueConstraint(fields=('playlist', 'song'), name='unique_playlist_song')],
+            },
+        ),
+        migrations.RunPython(copy_playlist_songs, restore_playlist_songs),
+        # Django can't add a through model to an existing M2M, so swap the field
+        migrations.RemoveField(
+            model_name='playlist',
+            name='songs',
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='songs',
+            field=models.ManyToManyField(blank=True, through='music.PlaylistEntry', to='music.song'),
+        ),
+    ]
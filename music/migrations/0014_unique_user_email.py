@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:20
+
+import logging
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+logger = logging.getLogger(__name__)
+
+
+def clear_duplicate_emails(apps, schema_editor):
+    """
+    Accounts created before the index may share an email. The oldest keeps
+    it; the others get a blank email (which the index allows) and are logged
+    so they can be asked for a new one.
+    """
+    User = apps.get_model('auth', 'User')
+    duplicates = (
+        User.objects.exclude(email='')
+        .values(address=Lower('email'))
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+        .values_list('address', flat=True)
+    )
+    for address in duplicates:
+        ids = list(
+            User.objects.annotate(address=Lower('email'))
+            .filter(address=address)
+            .order_by('date_joined', 'id')
+            .values_list('id', flat=True)
+        )
+        User.objects.filter(id__in=ids[1:]).update(email='')
+        logger.warning(
+            "%s is shared by users %s; kept it on user %s and cleared it on %s",
+            address, ', '.join(map(str, ids)), ids[0], ', '.join(map(str, ids[1:])),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('music', '0013_playlist_entries'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_emails, migrations.RunPython.noop),
+        # auth_user belongs to django.contrib.auth, so the index is raw SQL.
+        # Case-insensitive, and blank emails (createsuperuser) may repeat.
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX music_user_email_uniq ON auth_user (LOWER(email)) WHERE email <> ''",
+            "DROP INDEX music_user_email_uniq",
+        ),
+    ]
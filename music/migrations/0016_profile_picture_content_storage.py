@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:44
+
+import music.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0015_request_metrics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, storage=music.storage.content_storage, upload_to='profile_pics/'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:05
+
+from django.db import migrations, models
+
+
+def clear_unknown_durations(apps, schema_editor):
+    # Uploads used to store 0 until the media pipeline probed them, and
+    # probed durations are at least 1 second, so 0 always means "unknown"
+    Song = apps.get_model('music', 'Song')
+    Song.objects.filter(duration=0).update(duration=None)
+
+
+def restore_zero_durations(apps, schema_editor):
+    Song = apps.get_model('music', 'Song')
+    Song.objects.filter(duration__isnull=True).update(duration=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0016_profile_picture_content_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='song',
+            name='duration',
+            field=models.PositiveIntegerField(blank=True, help_text='Duration in seconds', null=True),
+        ),
+        migrations.RunPython(clear_unknown_durations, restore_zero_durations),
+    ]
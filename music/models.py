@@ -1,9 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
-from django.db.models.signals import post_save
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+
+from .instrumentation import histogram_percentile
+from .storage import content_storage
 
 class Genre(models.Model):
     name = models.CharField(max_length=100)
@@ -17,11 +21,8 @@ class ArtistManager(models.Manager):
         return self.filter(is_verified=True)
     
     def with_stats(self):
-        return self.annotate(
-            total_songs=models.Count('songs'),
-            total_plays=models.Sum('songs__plays'),
-            total_downloads=models.Sum('songs__downloads')
-        )
+        # Totals are stored on the artist row (song_count, play_count, download_count)
+        return self.all()
 
 class Artist(models.Model):
     user = models.OneToOneField(
@@ -31,12 +32,20 @@ class Artist(models.Model):
     )
     name = models.CharField(max_length=200)
     bio = models.TextField(blank=True, null=True)
-    image = models.ImageField(upload_to='artists/', blank=True, null=True)
+    image = models.ImageField(upload_to='artists/', storage=content_storage, blank=True, null=True)
     genre = models.ForeignKey('Genre', on_delete=models.SET_NULL, null=True, blank=True)
     website = models.URLField(blank=True, null=True)
     is_verified = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalised totals over the artist's songs. Kept in step by Song.save,
+    # the song delete handler and the counter flush; repaired by
+    # `manage.py recompute_artist_stats`.
+    song_count = models.PositiveIntegerField(default=0)
+    play_count = models.PositiveIntegerField(default=0)
+    download_count = models.PositiveIntegerField(default=0)
+    
+    STAT_FIELDS = ('song_count', 'play_count', 'download_count')
     
     objects = ArtistManager()
     
@@ -51,15 +60,70 @@ class Artist(models.Model):
     
     @property
     def total_plays(self):
-        return sum(song.plays for song in self.songs.all())
+        return self.play_count
     
     @property
     def total_downloads(self):
-        return sum(song.downloads for song in self.songs.all())
+        return self.download_count
     
     @property
     def total_songs(self):
-        return self.songs.count()
+        return self.song_count
+    
+    def save(self, *args, **kwargs):
+        # The totals only change through F() updates; never write back stale copies
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STAT_FIELDS
+            ]
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def stats_from_songs():
+        """Subquery expressions recomputing the totals from the songs table"""
+        songs = Song.objects.filter(artist=models.OuterRef('pk')).order_by().values('artist')
+        return {
+            field: Coalesce(models.Subquery(songs.annotate(total=aggregate).values('total')), 0)
+            for field, aggregate in (
+                ('song_count', models.Count('id')),
+                ('play_count', models.Sum('plays')),
+                ('download_count', models.Sum('downloads')),
+            )
+        }
+
+class SongQuerySet(models.QuerySet):
+    # Columns read by the song list templates (cards, rows, player data)
+    LISTING_FIELDS = (
+        'id', 'title', 'audio_file', 'cover_image', 'duration', 'upload_date',
+        'plays', 'downloads', 'is_approved', 'is_featured',
+        'artist', 'artist__name', 'genre', 'genre__name', 'genre__color',
+    )
+    
+    def for_listing(self):
+        """Load artist and genre in the same query and skip unused columns"""
+        return self.select_related('artist', 'genre').only(*self.LISTING_FIELDS)
+    
+    def for_player(self):
+        """Only the columns the player needs (see views.song_player_data)"""
+        return self.select_related('artist', 'genre').only(
+            'id', 'title', 'cover_image', 'duration', 'upload_date', 'plays', 'downloads',
+            'artist', 'artist__name', 'genre', 'genre__name',
+        )
+    
+    def approved(self):
+        return self.filter(is_approved=True)
+    
+    def by_genre(self, genre):
+        return self.filter(genre=genre)
+    
+    def by_artist(self, artist):
+        return self.filter(artist=artist)
+    
+    def top_by(self, field, limit=None):
+        """Order by a counter column (e.g. 'plays'), highest first"""
+        songs = self.order_by(f'-{field}', '-id')
+        return songs[:limit] if limit else songs
 
 class Song(models.Model):
     title = models.CharField(max_length=200)
@@ -67,44 +131,214 @@ class Song(models.Model):
     genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
     audio_file = models.FileField(
         upload_to='songs/',
+        storage=content_storage,
         validators=[FileExtensionValidator(allowed_extensions=['mp3', 'wav', 'ogg'])]
     )
-    cover_image = models.ImageField(upload_to='covers/', blank=True, null=True)
-    duration = models.PositiveIntegerField(help_text="Duration in seconds")
+    cover_image = models.ImageField(upload_to='covers/', storage=content_storage, blank=True, null=True)
+    # Null until the media pipeline has probed the upload (unless the artist typed it in)
+    duration = models.PositiveIntegerField(null=True, blank=True, help_text="Duration in seconds")
+    # Filled in by the media pipeline (see pipeline.py)
+    bitrate = models.PositiveIntegerField(null=True, blank=True, help_text="Bitrate in kbps")
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    stream_file = models.FileField(upload_to='streams/', storage=content_storage, blank=True, null=True)
     upload_date = models.DateTimeField(auto_now_add=True)
     plays = models.PositiveIntegerField(default=0)
     downloads = models.PositiveIntegerField(default=0)
+    # Number of Like rows, kept in step by the Like signal handlers below
+    like_count = models.PositiveIntegerField(default=0)
+    # log2 of the decayed event weight; see trending.py. NULL until the first event
+    trending_day = models.FloatField(null=True, blank=True, editable=False)
+    trending_week = models.FloatField(null=True, blank=True, editable=False)
     is_approved = models.BooleanField(default=False)  # For moderation
     is_featured = models.BooleanField(default=False)
     
+    objects = SongQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-upload_date']
+        # Each listing sort (see DISCOVER_SORTS) ends in -id for keyset pagination
+        indexes = [
+            models.Index(fields=['-upload_date', '-id'], name='music_song_upload_idx'),
+            models.Index(fields=['-plays', '-id'], name='music_song_plays_idx'),
+            models.Index(fields=['-downloads', '-id'], name='music_song_downloads_idx'),
+            models.Index(fields=['title', 'id'], name='music_song_title_idx'),
+            models.Index(fields=['genre', '-upload_date', '-id'], name='music_song_genre_upload_idx'),
+            models.Index(fields=['artist', '-upload_date', '-id'], name='music_song_artist_upload_idx'),
+            # Charts and top songs only rank approved songs
+            models.Index(
+                fields=['-plays', '-id'], condition=models.Q(is_approved=True),
+                name='music_song_approved_plays_idx',
+            ),
+            models.Index(
+                fields=['-downloads', '-id'], condition=models.Q(is_approved=True),
+                name='music_song_approved_dls_idx',
+            ),
+            # Trending charts (trending.py), overall and per genre
+            models.Index(
+                fields=['-trending_day', '-id'],
+                condition=models.Q(is_approved=True, trending_day__isnull=False),
+                name='music_song_trending_day_idx',
+            ),
+            models.Index(
+                fields=['-trending_week', '-id'],
+                condition=models.Q(is_approved=True, trending_week__isnull=False),
+                name='music_song_trending_week_idx',
+            ),
+            models.Index(
+                fields=['genre', '-trending_day', '-id'],
+                condition=models.Q(is_approved=True, trending_day__isnull=False),
+                name='music_song_genre_trend_day_idx',
+            ),
+            models.Index(
+                fields=['genre', '-trending_week', '-id'],
+                condition=models.Q(is_approved=True, trending_week__isnull=False),
+                name='music_song_genre_trend_wk_idx',
+            ),
+        ]
+    
+    TRENDING_FIELDS = ('trending_day', 'trending_week')
+    # Only changed by F() updates (increment_*, the counter flush, the Like signals)
+    COUNTER_FIELDS = ('plays', 'downloads', 'like_count')
+    
+    # Approval state as last loaded/saved, so signal handlers can spot changes
+    was_approved = False
+    # Artist as last loaded/saved, so save() can move the artist totals
+    was_artist_id = None
     
     def __str__(self):
         return f"{self.title} - {self.artist.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        song = super().from_db(db, field_names, values)
+        song.was_approved = song.__dict__.get('is_approved', False)
+        song.was_artist_id = song.__dict__.get('artist_id')
+        return song
+    
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                Artist.objects.filter(pk=self.artist_id).update(
+                    song_count=models.F('song_count') + 1,
+                    play_count=models.F('play_count') + self.plays,
+                    download_count=models.F('download_count') + self.downloads,
+                )
+        else:
+            # Counters and trending scores change under us with every counter
+            # flush; never write back stale copies
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.name not in self.TRENDING_FIELDS
+                    and field.name not in self.COUNTER_FIELDS
+                ]
+            moved = self.was_artist_id is not None and self.was_artist_id != self.artist_id
+            if moved and {'artist', 'artist_id'} & set(kwargs['update_fields']):
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                    self._move_artist_stats(self.was_artist_id, self.artist_id)
+            else:
+                super().save(*args, **kwargs)
+        self.was_approved = self.is_approved
+        self.was_artist_id = self.artist_id
+    
+    def _move_artist_stats(self, old_artist_id, new_artist_id):
+        # The stored counters, not this instance's (possibly stale) copies
+        plays, downloads = Song.objects.filter(pk=self.pk).values_list('plays', 'downloads').get()
+        Artist.objects.filter(pk=old_artist_id).update(
+            song_count=models.F('song_count') - 1,
+            play_count=models.F('play_count') - plays,
+            download_count=models.F('download_count') - downloads,
+        )
+        Artist.objects.filter(pk=new_artist_id).update(
+            song_count=models.F('song_count') + 1,
+            play_count=models.F('play_count') + plays,
+            download_count=models.F('download_count') + downloads,
+        )
+    
     def increment_plays(self):
+        with transaction.atomic():
+            Song.objects.filter(pk=self.pk).update(plays=models.F('plays') + 1)
+            Artist.objects.filter(pk=self.artist_id).update(play_count=models.F('play_count') + 1)
         self.plays += 1
-        self.save()
     
     def increment_downloads(self):
+        with transaction.atomic():
+            Song.objects.filter(pk=self.pk).update(downloads=models.F('downloads') + 1)
+            Artist.objects.filter(pk=self.artist_id).update(download_count=models.F('download_count') + 1)
         self.downloads += 1
-        self.save()
     
     @property
     def formatted_duration(self):
+        if self.duration is None:
+            return ''
         minutes = self.duration // 60
         seconds = self.duration % 60
         return f"{minutes}:{seconds:02d}"
 
+class MediaJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='media_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='music_mediajob_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.song_id} ({self.status})"
+
+class MediaBlob(models.Model):
+    """A file written by ContentAddressedStorage (see storage.py)"""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name
+
+class PlaylistQuerySet(models.QuerySet):
+    def with_song_count(self):
+        return self.annotate(song_count=models.Count('songs'))
+    
+    def with_previews(self, size=3):
+        """
+        Song counts plus each playlist's first ``size`` entries (with song and
+        artist) in ``preview_entries``: two queries however many playlists there are
+        """
+        preview = PlaylistEntry.objects.select_related('song__artist').only(
+            'id', 'playlist', 'song', 'song__title', 'song__artist', 'song__artist__name',
+        ).order_by('position')
+        return self.with_song_count().prefetch_related(
+            models.Prefetch('entries', queryset=preview[:size], to_attr='preview_entries')
+        )
+
 class Playlist(models.Model):
     name = models.CharField(max_length=200)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    songs = models.ManyToManyField(Song, blank=True)
+    songs = models.ManyToManyField(Song, through='PlaylistEntry', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_public = models.BooleanField(default=False)
     description = models.TextField(blank=True, null=True)
-    cover_image = models.ImageField(upload_to='playlist_covers/', blank=True, null=True)
+    cover_image = models.ImageField(upload_to='playlist_covers/', storage=content_storage, blank=True, null=True)
+    
+    objects = PlaylistQuerySet.as_manager()
     
     def __str__(self):
         return self.name
@@ -112,6 +346,27 @@ class Playlist(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+class PlaylistEntry(models.Model):
+    """
+    A song's place in a playlist. Positions are sparse (see playlists.py),
+    so moving or inserting a song only writes that song's row.
+    """
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='entries')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='playlist_entries')
+    position = models.BigIntegerField()
+    added_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['playlist', 'song'], name='unique_playlist_song')
+        ]
+        indexes = [
+            models.Index(fields=['playlist', 'position'], name='music_entry_position_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.playlist_id}:{self.position} {self.song_id}"
+
 class UserProfile(models.Model):
     USER_TYPE_CHOICES = [
         ('listener', 'Listener'),
@@ -121,9 +376,8 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     user_type = models.CharField(max_length=20, choices=USER_TYPE_CHOICES, default='listener')
     favorite_genres = models.ManyToManyField(Genre, blank=True)
-    liked_songs = models.ManyToManyField('Song', related_name='liked_by', blank=True)
     bio = models.TextField(blank=True, null=True)
-    profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    profile_picture = models.ImageField(upload_to='profile_pics/', storage=content_storage, blank=True, null=True)
     location = models.CharField(max_length=100, blank=True, null=True)
     website = models.URLField(blank=True, null=True)
     date_of_birth = models.DateField(blank=True, null=True)
@@ -152,30 +406,157 @@ class UserProfile(models.Model):
 class SongPlay(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
-    played_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered plays are written after the fact (see counters.py)
+    played_at = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     duration_played = models.PositiveIntegerField(default=0)  # Seconds played
+    completed = models.BooleanField(default=False)  # Listened to the end
     
     class Meta:
         ordering = ['-played_at']
+        indexes = [
+            models.Index(fields=['song', '-played_at'], name='music_play_song_idx'),
+            models.Index(fields=['user', '-played_at'], name='music_play_user_idx'),
+        ]
 
 class SongDownload(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
-    downloaded_at = models.DateTimeField(auto_now_add=True)
+    downloaded_at = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     
     class Meta:
         ordering = ['-downloaded_at']
+        indexes = [
+            models.Index(fields=['song', '-downloaded_at'], name='music_download_song_idx'),
+            models.Index(fields=['user', '-downloaded_at'], name='music_download_user_idx'),
+        ]
+
+class StatRollup(models.Model):
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()  # Start of the hour/day (UTC)
+    plays = models.PositiveIntegerField(default=0)
+    downloads = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        abstract = True
+        ordering = ['period', 'bucket']
+
+class SongStatRollup(StatRollup):
+    """Plays/downloads of one song per hour or day, built by rollups.py"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='stat_rollups')
+    
+    class Meta(StatRollup.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'period', 'bucket'], name='music_songrollup_unique'),
+        ]
+
+class ArtistStatRollup(StatRollup):
+    """Plays/downloads of all of an artist's songs per hour or day"""
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='stat_rollups')
+    
+    class Meta(StatRollup.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['artist', 'period', 'bucket'], name='music_artistrollup_unique'),
+        ]
+
+class RollupState(models.Model):
+    """High-water mark: the last event id already folded into the rollups"""
+    source = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.source} @ {self.last_id}"
+
+class RequestMetric(models.Model):
+    """One view's requests during one hour, flushed from instrumentation.py"""
+    view_name = models.CharField(max_length=200)
+    hour = models.DateTimeField()  # Start of the hour (UTC)
+    requests = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)  # 5xx responses
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    queries = models.PositiveBigIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    template_ms = models.FloatField(default=0)
+    response_bytes = models.PositiveBigIntegerField(default=0)
+    # Request counts per instrumentation.LATENCY_BOUNDS_MS bucket
+    histogram = models.JSONField(default=list)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'view_name'], name='unique_request_metric')
+        ]
+    
+    def __str__(self):
+        return f"{self.view_name} @ {self.hour:%Y-%m-%d %H:00}"
+    
+    def percentile(self, pct):
+        return histogram_percentile(self.histogram, pct, self.max_ms)
+
+class SlowQuery(models.Model):
+    """A sampled query slower than INSTRUMENTATION_SLOW_QUERY_MS"""
+    view_name = models.CharField(max_length=200)
+    sql = models.TextField()
+    duration_ms = models.FloatField()
+    recorded_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['-recorded_at'], name='music_slowquery_recorded_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.view_name}: {self.duration_ms:.0f}ms"
+
+class SongNeighbor(models.Model):
+    """One of a song's most similar songs, precomputed by recommendations.py"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'neighbor'], name='unique_song_neighbor'),
+        ]
+        indexes = [
+            models.Index(fields=['song', '-score'], name='music_neighbor_song_idx'),
+        ]
+
+class Recommendation(models.Model):
+    """A song on a user's personal home shelf, precomputed by recommendations.py"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='recommended_to')
+    score = models.FloatField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'song'], name='unique_user_recommendation'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'], name='music_recommendation_user_idx'),
+        ]
 
 class Like(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # The only store of liked songs; (user, song) is unique, so liking twice is a no-op
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='likes')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='likes')
     liked_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         unique_together = ['user', 'song']
         ordering = ['-liked_at']
+        # The library lists a user's likes, most recent first
+        indexes = [
+            models.Index(fields=['user', '-liked_at'], name='music_like_user_idx'),
+        ]
 
 class Follow(models.Model):
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
@@ -186,18 +567,36 @@ class Follow(models.Model):
         unique_together = ['follower', 'artist']
         ordering = ['-followed_at']
 
-# FIXED Signal handlers - Use get_or_create to avoid duplicates
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        UserProfile.objects.get_or_create(user=instance)
+@receiver(post_delete, sender=Song)
+def remove_song_from_artist_stats(sender, instance, **kwargs):
+    # instance.plays may be stale, so recount the (few) remaining songs instead
+    Artist.objects.filter(pk=instance.artist_id).update(**Artist.stats_from_songs())
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    try:
-        instance.userprofile.save()
-    except ObjectDoesNotExist:
-        UserProfile.objects.get_or_create(user=instance)
+@receiver(post_save, sender=Like)
+def add_like_to_song_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Song.objects.filter(pk=instance.song_id).update(like_count=models.F('like_count') + 1)
+
+@receiver(post_delete, sender=Like)
+def remove_like_from_song_count(sender, instance, **kwargs):
+    Song.objects.filter(pk=instance.song_id, like_count__gt=0).update(like_count=models.F('like_count') - 1)
+
+# Profiles are created with the user, never by a User signal, so logins and
+# other User updates don't touch them. `manage.py backfill_user_profiles`
+# adds profiles for users created some other way (admin, createsuperuser).
+def create_user_with_profile(username, email, password, user_type='listener', artist=None, **extra_fields):
+    """
+    Create a user and their UserProfile, plus an Artist from the ``artist``
+    field dict if given, in one transaction. Raises IntegrityError when the
+    username or email is taken.
+    """
+    with transaction.atomic():
+        user = User.objects.create_user(username=username, email=email, password=password, **extra_fields)
+        # Also caches user.userprofile
+        UserProfile.objects.create(user=user, user_type='artist' if artist is not None else user_type)
+        if artist is not None:
+            Artist.objects.create(user=user, **artist)
+    return user
 
 # Safe utility function for creating artist profiles
 def create_artist_profile(user, **kwargs):
@@ -219,9 +618,7 @@ def create_artist_profile(user, **kwargs):
             # Create new artist profile
             artist = Artist.objects.create(user=user, **kwargs)
             # Update user profile
-            profile = user.userprofile
-            profile.user_type = 'artist'
-            profile.save()
+            UserProfile.objects.update_or_create(user=user, defaults={'user_type': 'artist'})
             return artist, True
     except Exception as e:
         print(f"Error creating artist profile: {e}")
@@ -0,0 +1,194 @@
+"""
+Tagged caching for pages that look the same to every anonymous visitor.
+
+Views decorated with @cache_anonymous_page store their rendered response
+under a key built from the URL and the current *version* of each tag the
+page depends on ('songs', 'artists', 'genres', 'genre:<id>', 'charts').
+Invalidation bumps a tag's version (invalidate_tags), so every page that
+depends on it misses on the next request. Nothing is deleted or scanned. The signal
+handlers at the bottom of this module bump the tags when songs, artists or
+genres change. cached_value() applies the same scheme to arbitrary data.
+
+Play and download counts are not tags: the counter buffer writes them with
+UPDATE, which sends no signals, so cached pages show counts up to
+PAGE_CACHE_TIMEOUT seconds old (plus the browser's max-age). Lower the
+timeout if counts must be fresher.
+
+Responses get an ETag and Cache-Control. Pages that embed a CSRF token are
+stored with a placeholder and get the visitor's own token when served, so
+they are only marked cacheable by the browser (private). Hit/miss counts
+per view are kept in the cache (``manage.py page_cache_stats``).
+
+Tag versions must be shared by all workers for invalidation to reach them,
+so use the file or Redis backend (CACHE_BACKEND) when running more than
+one process.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .models import Artist, Genre, Song
+
+TAG_PREFIX = 'music:tag:'
+PAGE_PREFIX = 'music:page:'
+VALUE_PREFIX = 'music:value:'
+STATS_PREFIX = 'music:pagecache-stats:'
+
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b'__pagecache_csrf_token__'
+
+# Names of the decorated views, for page_cache_stats
+cached_views = set()
+
+
+def get_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 300)
+
+
+def tag_versions(tags):
+    keys = [TAG_PREFIX + tag for tag in tags]
+    versions = cache.get_many(keys)
+    # A tag seen for the first time (or evicted) starts at a fresh version,
+    # so it can never collide with pages stored under an older one
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate_tags(*tags):
+    for tag in tags:
+        try:
+            cache.incr(TAG_PREFIX + tag)
+        except ValueError:
+            # Not cached yet, so nothing depends on it
+            pass
+
+
+def _key(prefix, name, tags):
+    versions = ':'.join(str(version) for version in tag_versions(tags))
+    return prefix + hashlib.md5(f'{name}|{versions}'.encode()).hexdigest()
+
+
+def cached_value(name, tags, build, timeout=None):
+    """Return build(), cached until one of ``tags`` is invalidated"""
+    key = _key(VALUE_PREFIX, name, tags)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout or get_timeout())
+    return value
+
+
+def record(view_name, outcome):
+    key = f'{STATS_PREFIX}{view_name}:{outcome}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_stats():
+    keys = [f'{STATS_PREFIX}{name}:{outcome}' for name in sorted(cached_views) for outcome in ('hit', 'miss')]
+    counts = cache.get_many(keys)
+    return {
+        name: {outcome: counts.get(f'{STATS_PREFIX}{name}:{outcome}', 0) for outcome in ('hit', 'miss')}
+        for name in sorted(cached_views)
+    }
+
+
+def reset_stats():
+    cache.delete_many([f'{STATS_PREFIX}{name}:{outcome}' for name in cached_views for outcome in ('hit', 'miss')])
+
+
+def _finish(request, entry, outcome):
+    status, content_type, content, etag = entry
+    has_token = CSRF_PLACEHOLDER in content
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if has_token:
+            content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+        response = HttpResponse(content, status=status, content_type=content_type)
+    response['ETag'] = etag
+    response['X-Cache'] = outcome
+    max_age = getattr(settings, 'PAGE_CACHE_BROWSER_MAX_AGE', 60)
+    if has_token:
+        # Each visitor's copy carries their own CSRF token; shared caches must not keep it
+        patch_cache_control(response, private=True, max_age=max_age)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age, s_maxage=get_timeout())
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def cache_anonymous_page(tags):
+    """
+    Cache a view's response for anonymous GET/HEAD requests. ``tags`` is a
+    list, or a callable taking the view's URL kwargs and returning one.
+    """
+    def decorator(view):
+        cached_views.add(view.__name__)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Flash messages are shown once, so those pages are never shared
+            if (request.method not in ('GET', 'HEAD') or request.user.is_authenticated
+                    or len(messages.get_messages(request))):
+                return view(request, *args, **kwargs)
+
+            page_tags = tags(**kwargs) if callable(tags) else tags
+            key = _key(PAGE_PREFIX, f'{view.__name__}|{request.get_full_path()}', page_tags)
+            entry = cache.get(key)
+            if entry is not None:
+                record(view.__name__, 'hit')
+                return _finish(request, entry, 'HIT')
+
+            record(view.__name__, 'miss')
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming or response.cookies:
+                return response
+            content = CSRF_INPUT_RE.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+            etag = '"%s"' % hashlib.md5(content).hexdigest()
+            if CSRF_PLACEHOLDER in content:
+                # Served bodies differ only in the token
+                etag = 'W/' + etag
+            entry = (response.status_code, response['Content-Type'], content, etag)
+            cache.set(key, entry, get_timeout())
+            return _finish(request, entry, 'MISS')
+        return wrapper
+    return decorator
+
+
+# Invalidation
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def invalidate_song_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_tags('songs', 'charts', f'genre:{instance.genre_id}')
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_genre_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_tags('genres', f'genre:{instance.pk}')
+
+
+@receiver(post_save, sender=Artist)
+def invalidate_artist_pages(sender, instance, created, raw=False, **kwargs):
+    # Artist names appear in every song listing
+    if not raw and not created:
+        invalidate_tags('artists', 'charts')
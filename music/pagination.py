@@ -0,0 +1,97 @@
+import base64
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque token"""
+    raw = json.dumps(values, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _seek_filter(fields, values):
+    """
+    Build the "rows after this key" condition for a compound ordering, e.g.
+    ('-upload_date', '-id') ->
+    upload_date <= v0 AND (upload_date < v0 OR (upload_date = v0 AND id < v1))
+
+    The redundant leading bound lets SQLite seek into the index instead of
+    scanning it from the top, which it does for the OR on its own.
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    first = fields[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=24):
+    """
+    Return one fixed-size page of ``queryset`` ordered by ``ordering``.
+
+    ``ordering`` must end with a unique column (normally ``id``) so that every
+    row has a distinct key. The cost of a page does not depend on how deep into
+    the listing it is, unlike OFFSET pagination.
+    """
+    model = queryset.model
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(ordering):
+            raise InvalidCursor(cursor)
+        try:
+            values = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(ordering, values)
+            ]
+        except Exception:
+            raise InvalidCursor(cursor)
+        queryset = queryset.filter(_seek_filter(ordering, values))
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([
+            getattr(last, field.lstrip('-')) for field in ordering
+        ])
+    return KeysetPage(items, next_cursor)
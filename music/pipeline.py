@@ -0,0 +1,177 @@
+"""
+Background processing for uploaded songs.
+
+upload_music saves the song and queues a MediaJob row; the request returns
+straight away. A worker then probes the real duration and bitrate, hashes
+the file and, when ffmpeg is installed, writes a normalised streaming
+rendition to Song.stream_file. Cover thumbnails are generated here too.
+
+Jobs run on a small in-process thread pool (MEDIA_PIPELINE_WORKERS) once the
+upload transaction commits. The queue lives in the database, so jobs left
+behind by a restart are picked up by ``manage.py run_media_worker``, which
+can also run as the only worker with MEDIA_PIPELINE_WORKERS = 0.
+"""
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .audioprobe import ProbeError, ffmpeg_available, file_sha256, probe_audio, transcode
+from .models import MediaJob, Song
+from .thumbnails import InvalidThumbnail, generate_all as generate_all_thumbnails
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue_media_job(song):
+    job = MediaJob.objects.create(song=song)
+    if get_setting('MEDIA_PIPELINE_WORKERS', 2) > 0:
+        transaction.on_commit(lambda: _submit(job.id))
+    return job
+
+
+def _submit(job_id):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_setting('MEDIA_PIPELINE_WORKERS', 2),
+            thread_name_prefix='media-pipeline',
+        )
+    _executor.submit(_run_in_thread, job_id)
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        if claim_job(job_id):
+            process_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def claim_job(job_id):
+    """Atomically move a queued job to processing; False if another worker has it"""
+    return MediaJob.objects.filter(id=job_id, status='queued').update(
+        status='processing', started_at=timezone.now(), attempts=F('attempts') + 1,
+    ) == 1
+
+
+def claim_next_job():
+    for job_id in MediaJob.objects.filter(status='queued').values_list('id', flat=True)[:10]:
+        if claim_job(job_id):
+            return job_id
+    return None
+
+
+def requeue_stale_jobs():
+    """Put jobs whose worker died (processing for too long) back in the queue"""
+    cutoff = timezone.now() - timezone.timedelta(seconds=get_setting('MEDIA_JOB_TIMEOUT', 900))
+    max_attempts = get_setting('MEDIA_JOB_MAX_ATTEMPTS', 3)
+    stale = MediaJob.objects.filter(status='processing', started_at__lt=cutoff)
+    stale.filter(attempts__gte=max_attempts).update(
+        status='failed', error='Timed out', finished_at=timezone.now(),
+    )
+    return stale.update(status='queued')
+
+
+def process_job(job_id):
+    job = MediaJob.objects.select_related('song').get(id=job_id)
+    song = job.song
+    try:
+        result = process_song_media(song)
+    except Exception as e:
+        logger.exception("Media job %s failed", job_id)
+        MediaJob.objects.filter(id=job_id).update(
+            status='failed', error=str(e)[:1000], finished_at=timezone.now(),
+        )
+        return False
+
+    Song.objects.filter(id=song.id).update(**result)
+    MediaJob.objects.filter(id=job_id).update(status='done', error='', finished_at=timezone.now())
+    return True
+
+
+def process_song_media(song):
+    """Probe, hash and transcode a song's upload; return the Song fields to update"""
+    source = song.audio_file.path
+    try:
+        info = probe_audio(source)
+    except ProbeError as e:
+        raise ProbeError(f"Could not read audio file: {e}")
+
+    result = {
+        'bitrate': info['bitrate'],
+        'content_hash': file_sha256(source),
+    }
+    # Keep a duration the artist typed in unless we measured one
+    if info['duration']:
+        result['duration'] = max(int(round(info['duration'])), 1)
+
+    if song.cover_image:
+        # Resize the cover now so the first listing view does not have to
+        try:
+            generate_all_thumbnails(song.cover_image.name)
+        except (OSError, InvalidThumbnail):
+            logger.warning("Could not create thumbnails for %s", song.cover_image.name)
+
+    if needs_transcode(info) and ffmpeg_available():
+        fmt = get_setting('MEDIA_STREAM_FORMAT', 'mp3')
+        bitrate = get_setting('MEDIA_STREAM_BITRATE', 128)
+        fd, rendition = tempfile.mkstemp(suffix=f'.{fmt}')
+        os.close(fd)
+        try:
+            transcode(source, rendition, fmt=fmt, bitrate=bitrate)
+            name = f"{os.path.splitext(os.path.basename(song.audio_file.name))[0]}.{fmt}"
+            with open(rendition, 'rb') as fh:
+                song.stream_file.save(name, File(fh), save=False)
+            result['stream_file'] = song.stream_file.name
+        finally:
+            os.remove(rendition)
+    return result
+
+
+def needs_transcode(info):
+    """WAV and high-bitrate files get a smaller rendition for streaming"""
+    if info['format'] not in ('mp3', 'ogg'):
+        return True
+    return (info['bitrate'] or 0) > get_setting('MEDIA_STREAM_BITRATE', 128) * 1.5
+
+
+def run_worker(concurrency=1, poll_interval=2.0, once=False):
+    """Process queued jobs until stopped (or until the queue is empty if ``once``)"""
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='media-worker') as pool:
+        while True:
+            requeue_stale_jobs()
+            claimed = []
+            while len(claimed) < concurrency:
+                job_id = claim_next_job()
+                if job_id is None:
+                    break
+                claimed.append(job_id)
+            for future in [pool.submit(_process_claimed, job_id) for job_id in claimed]:
+                future.result()
+            if not claimed:
+                if once:
+                    return
+                time.sleep(poll_interval)
+
+
+def _process_claimed(job_id):
+    close_old_connections()
+    try:
+        return process_job(job_id)
+    finally:
+        close_old_connections()
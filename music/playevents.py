@@ -0,0 +1,100 @@
+"""
+Validation for batched playback events.
+
+The player queues one event per track it plays (song id, start time,
+seconds actually listened, whether it reached the end) and posts them in
+batches to the record_plays view, usually with navigator.sendBeacon when
+the page is hidden. clean_play_events() checks a whole batch with a single
+query and returns the events that count as plays, ready for
+counter_buffer.record_plays().
+"""
+import datetime
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Song
+
+# Allowed clock skew between the browser and the server
+FUTURE_TOLERANCE = datetime.timedelta(minutes=5)
+
+
+class InvalidPlayEvents(ValueError):
+    pass
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _parse_event(raw):
+    if not isinstance(raw, dict):
+        return None
+    try:
+        song_id = int(raw['song'])
+        seconds = float(raw.get('seconds', 0))
+    except (KeyError, TypeError, ValueError):
+        return None
+    try:
+        started_at = parse_datetime(raw['started_at']) if isinstance(raw.get('started_at'), str) else None
+    except ValueError:
+        # Well formed but impossible, e.g. February 30th
+        return None
+    if started_at is None or seconds < 0 or not math.isfinite(seconds):
+        return None
+    if timezone.is_naive(started_at):
+        started_at = timezone.make_aware(started_at, datetime.timezone.utc)
+    return song_id, started_at, seconds, raw.get('completed') is True
+
+
+def clean_play_events(raw_events, now=None):
+    """
+    Return (plays, rejected) for a list of raw events. Plays shorter than
+    PLAY_MIN_SECONDS (or half the song, if that is shorter) that did not
+    finish the song are not counted, nor are repeats of a (song, start time)
+    pair or more than PLAY_EVENTS_MAX_PER_SONG plays of one song.
+    """
+    if not isinstance(raw_events, list):
+        raise InvalidPlayEvents("Expected a list of events")
+    max_batch = get_setting('PLAY_EVENTS_MAX_BATCH', 200)
+    if len(raw_events) > max_batch:
+        raise InvalidPlayEvents(f"At most {max_batch} events per request")
+
+    now = now or timezone.now()
+    oldest = now - datetime.timedelta(hours=get_setting('PLAY_EVENT_MAX_AGE_HOURS', 168))
+    min_seconds = get_setting('PLAY_MIN_SECONDS', 30)
+    max_per_song = get_setting('PLAY_EVENTS_MAX_PER_SONG', 5)
+
+    parsed = [_parse_event(raw) for raw in raw_events]
+    song_ids = {event[0] for event in parsed if event}
+    durations = dict(Song.objects.filter(id__in=song_ids).order_by().values_list('id', 'duration'))
+
+    plays = []
+    seen = set()
+    per_song = Counter()
+    for event in parsed:
+        if event is None:
+            continue
+        song_id, started_at, seconds, completed = event
+        if song_id not in durations or not oldest <= started_at <= now + FUTURE_TOLERANCE:
+            continue
+        # A track cannot be listened to for longer than it lasts (once probed)
+        duration = durations[song_id]
+        seconds = int(min(seconds, duration or seconds))
+        if not completed and seconds < min(min_seconds, duration / 2 if duration else min_seconds):
+            continue
+        # The endpoint is anonymous; one request can't replay a song into the charts
+        if (song_id, started_at) in seen or per_song[song_id] >= max_per_song:
+            continue
+        seen.add((song_id, started_at))
+        per_song[song_id] += 1
+        plays.append({
+            'song_id': song_id,
+            'played_at': min(started_at, now),
+            'duration_played': seconds,
+            'completed': completed,
+        })
+    return plays, len(raw_events) - len(plays)
@@ -0,0 +1,231 @@
+"""
+Ordered playlists.
+
+Each song in a playlist is a PlaylistEntry with a sparse ``position``. New
+entries are appended POSITION_GAP after the last one, and a song put
+between two others takes the midpoint, so a move writes one row. Only when
+two neighbours end up adjacent (after ~16 inserts into the same gap) is
+the playlist renumbered, in a single bulk_update.
+
+apply_diff() applies a whole edit under one transaction: it reads the
+playlist's positions once, works out the new order in memory and writes
+with a DELETE, a bulk_create and a bulk_update (batched by 500 rows),
+however many songs change. A diff looks like
+
+    {
+        "remove": [12, 13],
+        "add": [5, {"song": 6, "after": 5}, {"song": 7, "before": 1}],
+        "move": [{"song": 9, "after": 6}, {"song": 2}]
+    }
+
+Songs are given by id and appear in a playlist at most once. Removals run
+first, then additions and moves in order, so an anchor may be a song added
+earlier in the same diff. Without ``after``/``before`` a song goes to the
+end. Adding a song that is already there leaves it where it is.
+"""
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Playlist, PlaylistEntry, Song
+
+POSITION_GAP = 1 << 16
+
+
+class InvalidPlaylistEdit(ValueError):
+    pass
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _batches(ids, size=500):
+    # Keeps id__in lists under SQLite's variable limit
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+class _Order:
+    """A playlist's songs sorted by position, for planning an edit"""
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: row[1])
+        self.songs = [song_id for song_id, _ in rows]
+        self.positions = [position for _, position in rows]
+        self.position_of = dict(rows)
+        # Songs whose position changed
+        self.moved = set()
+
+    def __contains__(self, song_id):
+        return song_id in self.position_of
+
+    def __len__(self):
+        return len(self.songs)
+
+    def remove(self, song_id):
+        index = bisect_left(self.positions, self.position_of.pop(song_id))
+        while self.songs[index] != song_id:
+            # Equal positions (only possible in legacy data)
+            index += 1
+        del self.songs[index]
+        del self.positions[index]
+
+    def _slot(self, after, before):
+        for anchor in (after, before):
+            if anchor is not None and anchor not in self:
+                raise InvalidPlaylistEdit(f"Song {anchor} is not in the playlist")
+        if after is not None:
+            return bisect_right(self.positions, self.position_of[after])
+        if before is not None:
+            return bisect_left(self.positions, self.position_of[before])
+        return len(self.positions)
+
+    def _renumber(self):
+        self.positions = [(index + 1) * POSITION_GAP for index in range(len(self.songs))]
+        self.position_of = dict(zip(self.songs, self.positions))
+        self.moved.update(self.songs)
+
+    def insert(self, song_id, after=None, before=None):
+        index = self._slot(after, before)
+        low = self.positions[index - 1] if index > 0 else None
+        high = self.positions[index] if index < len(self.positions) else None
+        if low is not None and high is not None and high - low < 2:
+            self._renumber()
+            low, high = self.positions[index - 1], self.positions[index]
+        if high is None:
+            position = (low or 0) + POSITION_GAP
+        elif low is None:
+            position = high - POSITION_GAP
+        else:
+            position = (low + high) // 2
+        self.songs.insert(index, song_id)
+        self.positions.insert(index, position)
+        self.position_of[song_id] = position
+        self.moved.add(song_id)
+
+
+def _parse_item(item):
+    """(song_id, after, before) from ``5`` or ``{"song": 5, "after": 4}``"""
+    if not isinstance(item, dict):
+        item = {'song': item}
+    try:
+        song_id = int(item['song'])
+        after = int(item['after']) if item.get('after') is not None else None
+        before = int(item['before']) if item.get('before') is not None else None
+    except (KeyError, TypeError, ValueError):
+        raise InvalidPlaylistEdit(f"Invalid entry: {item!r}")
+    if after is not None and before is not None:
+        raise InvalidPlaylistEdit("Give 'after' or 'before', not both")
+    return song_id, after, before
+
+
+def parse_diff(diff):
+    """Validate a raw diff into (remove, add, move) lists"""
+    if not isinstance(diff, dict):
+        raise InvalidPlaylistEdit("Expected an object with remove/add/move lists")
+    parts = []
+    for key in ('remove', 'add', 'move'):
+        items = diff.get(key) or []
+        if not isinstance(items, list):
+            raise InvalidPlaylistEdit(f"'{key}' must be a list")
+        parts.append(items)
+    remove, add, move = parts
+    max_operations = get_setting('PLAYLIST_EDIT_MAX_OPERATIONS', 5000)
+    if len(remove) + len(add) + len(move) > max_operations:
+        raise InvalidPlaylistEdit(f"At most {max_operations} changes per request")
+    try:
+        remove = [int(song_id) for song_id in remove]
+    except (TypeError, ValueError):
+        raise InvalidPlaylistEdit("'remove' must be a list of song ids")
+    return remove, [_parse_item(item) for item in add], [_parse_item(item) for item in move]
+
+
+def apply_diff(playlist, remove=(), add=(), move=()):
+    """
+    Apply parsed removals, additions and moves (see parse_diff) to
+    ``playlist`` in one transaction. Returns counts of what changed.
+    """
+    new_ids = {song_id for song_id, _, _ in add}
+    known = set()
+    for batch in _batches(new_ids):
+        known.update(Song.objects.filter(pk__in=batch).order_by().values_list('id', flat=True))
+    if new_ids - known:
+        raise InvalidPlaylistEdit(f"Unknown songs: {', '.join(map(str, sorted(new_ids - known)))}")
+
+    with transaction.atomic():
+        # Serialise edits to the same playlist
+        Playlist.objects.select_for_update().only('id').get(pk=playlist.pk)
+        entries = PlaylistEntry.objects.filter(playlist=playlist)
+        rows = list(entries.values_list('song_id', 'id', 'position'))
+        entry_ids = {song_id: entry_id for song_id, entry_id, _ in rows}
+        order = _Order([(song_id, position) for song_id, _, position in rows])
+
+        removed = set()
+        for song_id in remove:
+            if song_id in order:
+                order.remove(song_id)
+                removed.add(song_id)
+        added = 0
+        for song_id, after, before in add:
+            if song_id not in order:
+                order.insert(song_id, after, before)
+                added += 1
+        moved = 0
+        for song_id, after, before in move:
+            if song_id not in order:
+                raise InvalidPlaylistEdit(f"Song {song_id} is not in the playlist")
+            if song_id in (after, before):
+                continue
+            order.remove(song_id)
+            order.insert(song_id, after, before)
+            moved += 1
+
+        # A song removed and added back keeps its entry (and added_at)
+        readded = removed & order.position_of.keys()
+        for batch in _batches(removed - readded):
+            entries.filter(song__in=batch).delete()
+        now = timezone.now()
+        PlaylistEntry.objects.bulk_create(
+            [
+                PlaylistEntry(playlist=playlist, song_id=song_id, position=order.position_of[song_id], added_at=now)
+                for song_id in order.moved if song_id not in entry_ids
+            ],
+            batch_size=500,
+        )
+        PlaylistEntry.objects.bulk_update(
+            [
+                PlaylistEntry(id=entry_ids[song_id], position=order.position_of[song_id])
+                for song_id in order.moved if song_id in entry_ids
+            ],
+            ['position'],
+            batch_size=500,
+        )
+
+    return {
+        'added': added - len(readded),
+        'removed': len(removed - readded),
+        'moved': moved + len(readded),
+        'song_count': len(order),
+    }
+
+
+def append_songs(playlist, song_ids):
+    return apply_diff(playlist, add=[(song_id, None, None) for song_id in song_ids])
+
+
+def remove_songs(playlist, song_ids):
+    return apply_diff(playlist, remove=song_ids)
+
+
+def queue_songs(playlist, chunk_size=500):
+    """Iterate over the playlist's songs in order, for the player, without loading them all"""
+    return (
+        Song.objects.for_player()
+        .filter(playlist_entries__playlist=playlist)
+        .order_by('playlist_entries__position')
+        .iterator(chunk_size=chunk_size)
+    )
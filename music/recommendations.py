@@ -0,0 +1,325 @@
+"""
+Offline "more like this" and personal recommendations.
+
+Listening data forms a sparse user x song matrix. Each *basket* is a row:
+a user's songs (played: weight 1, liked: weight 3) or a playlist's songs
+(weight 2). Two songs are similar when they share baskets:
+
+    score(i, j) = sum over baskets of w(i) * w(j) / sqrt(n(i) * n(j))
+
+where n(s) is the song's total weight over all baskets. This is cosine
+similarity for unweighted data, and the n(j) term stops the most popular
+songs from being everyone's neighbour.
+
+``manage.py build_recommendations`` computes this a chunk of songs at a
+time, reading only the baskets that contain the chunk, so memory depends on
+the chunk size rather than the catalog. It keeps the top
+RECOMMENDATION_NEIGHBORS approved songs per song in SongNeighbor. It then
+builds each user's home shelf (Recommendation) from the neighbours of the
+songs they liked and played. Songs by followed artists and in favourite
+genres get a boost; users with no history get the most played songs from
+those artists and genres. Pages read both tables with one indexed query.
+
+``--incremental`` only processes plays, likes, playlist additions, follows
+and favourite genres added since the previous run (marks in RollupState).
+Removals (unlikes, deleted playlists) are picked up by the next full build,
+which should run nightly.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Follow, Like, Playlist, Recommendation, RollupState, Song, SongNeighbor, SongPlay, UserProfile
+
+PLAY_WEIGHT = 1
+LIKE_WEIGHT = 3
+PLAYLIST_WEIGHT = 2
+
+# Shelf score multipliers for songs by followed artists / in favourite genres
+FOLLOW_BOOST = 1.5
+GENRE_BOOST = 1.2
+
+# Keeps id__in lists under SQLite's variable limit
+IN_BATCH = 500
+
+PlaylistSong = Playlist.songs.through
+FavoriteGenre = UserProfile.favorite_genres.through
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def in_batches(ids, size=IN_BATCH):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+# Baskets
+
+def _basket_keys(song_ids):
+    """The users and playlists whose baskets contain any of ``song_ids``"""
+    users, playlists = set(), set()
+    for batch in in_batches(song_ids):
+        users.update(SongPlay.objects.filter(song__in=batch, user__isnull=False)
+                     .order_by().values_list('user_id', flat=True).distinct())
+        users.update(Like.objects.filter(song__in=batch).order_by().values_list('user_id', flat=True))
+        playlists.update(PlaylistSong.objects.filter(song__in=batch).values_list('playlist_id', flat=True))
+    return users, playlists
+
+
+def _load_baskets(user_ids, playlist_ids, max_basket):
+    """{('user' | 'playlist', id): {song_id: weight}}"""
+    baskets = defaultdict(lambda: defaultdict(int))
+    for batch in in_batches(user_ids):
+        played = (SongPlay.objects.filter(user__in=batch).order_by()
+                  .values_list('user_id', 'song_id').distinct())
+        for user_id, song_id in played:
+            baskets[('user', user_id)][song_id] += PLAY_WEIGHT
+        for user_id, song_id in Like.objects.filter(user__in=batch).order_by().values_list('user_id', 'song_id'):
+            baskets[('user', user_id)][song_id] += LIKE_WEIGHT
+    for batch in in_batches(playlist_ids):
+        for playlist_id, song_id in PlaylistSong.objects.filter(playlist__in=batch).values_list('playlist_id', 'song_id'):
+            baskets[('playlist', playlist_id)][song_id] += PLAYLIST_WEIGHT
+    # Huge baskets (catalog-wide playlists, bots) cost O(n^2) and say little
+    return {key: basket for key, basket in baskets.items() if len(basket) <= max_basket}
+
+
+def _song_weights(song_ids):
+    """n(s): each song's total weight over all baskets"""
+    weights = defaultdict(int)
+    for batch in in_batches(song_ids):
+        counts = (
+            (SongPlay.objects.filter(song__in=batch, user__isnull=False)
+             .values('song_id').annotate(count=Count('user_id', distinct=True)), PLAY_WEIGHT),
+            (Like.objects.filter(song__in=batch).values('song_id').annotate(count=Count('id')), LIKE_WEIGHT),
+            (PlaylistSong.objects.filter(song__in=batch).values('song_id').annotate(count=Count('id')), PLAYLIST_WEIGHT),
+        )
+        for rows, weight in counts:
+            for row in rows.order_by():
+                weights[row['song_id']] += row['count'] * weight
+    return weights
+
+
+def _approved(song_ids):
+    approved = set()
+    for batch in in_batches(song_ids):
+        approved.update(Song.objects.filter(id__in=batch, is_approved=True).values_list('id', flat=True))
+    return approved
+
+
+# Song neighbours
+
+def compute_neighbors(song_ids, top_k, max_basket):
+    """{song_id: [(score, neighbor_id), ...]} for a chunk of songs"""
+    targets = set(song_ids)
+    users, playlists = _basket_keys(targets)
+    baskets = _load_baskets(users, playlists, max_basket)
+
+    cooccurrence = {song_id: defaultdict(float) for song_id in targets}
+    for basket in baskets.values():
+        for song_id in targets.intersection(basket):
+            weight = basket[song_id]
+            scores = cooccurrence[song_id]
+            for other_id, other_weight in basket.items():
+                if other_id != song_id:
+                    scores[other_id] += weight * other_weight
+
+    candidates = set(targets).union(*cooccurrence.values())
+    weights = _song_weights(candidates)
+    approved = _approved(candidates)
+    neighbors = {}
+    for song_id, scores in cooccurrence.items():
+        if not weights[song_id]:
+            neighbors[song_id] = []
+            continue
+        neighbors[song_id] = heapq.nlargest(top_k, (
+            (total / math.sqrt(weights[song_id] * weights[other_id]), other_id)
+            for other_id, total in scores.items()
+            if other_id in approved and weights[other_id]
+        ))
+    return neighbors
+
+
+def update_neighbors(song_ids, chunk_size=None):
+    """Recompute and store the neighbours of ``song_ids``; returns rows written"""
+    top_k = get_setting('RECOMMENDATION_NEIGHBORS', 20)
+    max_basket = get_setting('RECOMMENDATION_MAX_BASKET', 500)
+    chunk_size = chunk_size or get_setting('RECOMMENDATION_CHUNK_SIZE', 500)
+    written = 0
+    for chunk in in_batches(sorted(song_ids), chunk_size):
+        neighbors = compute_neighbors(chunk, top_k, max_basket)
+        rows = [
+            SongNeighbor(song_id=song_id, neighbor_id=neighbor_id, score=score)
+            for song_id, scored in neighbors.items()
+            for score, neighbor_id in scored
+        ]
+        with transaction.atomic():
+            SongNeighbor.objects.filter(song__in=chunk).delete()
+            SongNeighbor.objects.bulk_create(rows, batch_size=500)
+        written += len(rows)
+    return written
+
+
+# Home shelves
+
+def compute_shelves(user_ids, size):
+    """{user_id: [(score, song_id), ...]} for a chunk of users"""
+    seeds = defaultdict(lambda: defaultdict(int))
+    for user_id, song_id in SongPlay.objects.filter(user__in=user_ids).order_by().values_list('user_id', 'song_id').distinct():
+        seeds[user_id][song_id] += PLAY_WEIGHT
+    for user_id, song_id in Like.objects.filter(user__in=user_ids).order_by().values_list('user_id', 'song_id'):
+        seeds[user_id][song_id] += LIKE_WEIGHT
+
+    followed = defaultdict(set)
+    for user_id, artist_id in Follow.objects.filter(follower__in=user_ids).order_by().values_list('follower_id', 'artist_id'):
+        followed[user_id].add(artist_id)
+    genres = defaultdict(set)
+    favorites = FavoriteGenre.objects.filter(userprofile__user__in=user_ids).values_list('userprofile__user_id', 'genre_id')
+    for user_id, genre_id in favorites:
+        genres[user_id].add(genre_id)
+
+    similar = defaultdict(list)
+    seed_songs = set().union(*seeds.values())
+    for batch in in_batches(seed_songs):
+        for song_id, neighbor_id, score in SongNeighbor.objects.filter(song__in=batch).values_list('song_id', 'neighbor_id', 'score'):
+            similar[song_id].append((neighbor_id, score))
+
+    candidates = {neighbor_id for pairs in similar.values() for neighbor_id, _ in pairs}
+    song_info = {}
+    for batch in in_batches(candidates):
+        song_info.update((row[0], row[1:]) for row in Song.objects.filter(id__in=batch).values_list('id', 'artist_id', 'genre_id'))
+
+    shelves = {}
+    for user_id in user_ids:
+        heard = seeds.get(user_id, {})
+        scores = defaultdict(float)
+        for song_id, weight in heard.items():
+            for neighbor_id, score in similar.get(song_id, ()):
+                if neighbor_id not in heard:
+                    scores[neighbor_id] += weight * score
+        for song_id in scores:
+            artist_id, genre_id = song_info[song_id]
+            if artist_id in followed[user_id]:
+                scores[song_id] *= FOLLOW_BOOST
+            if genre_id in genres[user_id]:
+                scores[song_id] *= GENRE_BOOST
+        shelf = heapq.nlargest(size, ((score, song_id) for song_id, score in scores.items()))
+        if len(shelf) < size and (followed[user_id] or genres[user_id]):
+            shelf += _popular_fallback(followed[user_id], genres[user_id], heard.keys() | scores.keys(), size - len(shelf))
+        shelves[user_id] = shelf
+    return shelves
+
+
+def _popular_fallback(artist_ids, genre_ids, exclude, limit):
+    """Most played approved songs by ``artist_ids`` or in ``genre_ids``, scored below any real match"""
+    songs = Song.objects.approved().filter(Q(artist__in=artist_ids) | Q(genre__in=genre_ids))
+    top = songs.top_by('plays', limit + len(exclude)).values_list('id', flat=True)
+    song_ids = [song_id for song_id in top if song_id not in exclude][:limit]
+    return [(1e-6 / (rank + 1), song_id) for rank, song_id in enumerate(song_ids)]
+
+
+def update_shelves(user_ids, chunk_size=None):
+    size = get_setting('RECOMMENDATION_SHELF_SIZE', 20)
+    chunk_size = chunk_size or get_setting('RECOMMENDATION_CHUNK_SIZE', 500)
+    written = 0
+    for chunk in in_batches(sorted(user_ids), chunk_size):
+        shelves = compute_shelves(chunk, size)
+        rows = [
+            Recommendation(user_id=user_id, song_id=song_id, score=score)
+            for user_id, shelf in shelves.items()
+            for score, song_id in shelf
+        ]
+        with transaction.atomic():
+            Recommendation.objects.filter(user__in=chunk).delete()
+            Recommendation.objects.bulk_create(rows, batch_size=500)
+        written += len(rows)
+    return written
+
+
+# Builds
+
+# Tables whose new rows an incremental build picks up: (RollupState source,
+# queryset, song field or None, user field or None, playlist field or None)
+EVENT_SOURCES = (
+    ('recommendations:songplay', SongPlay.objects.filter(user__isnull=False), 'song_id', 'user_id', None),
+    ('recommendations:like', Like.objects.all(), 'song_id', 'user_id', None),
+    ('recommendations:playlist_songs', PlaylistSong.objects.all(), 'song_id', 'playlist__user', 'playlist_id'),
+    ('recommendations:follow', Follow.objects.all(), None, 'follower_id', None),
+    ('recommendations:favorite_genres', FavoriteGenre.objects.all(), None, 'userprofile__user', None),
+)
+
+
+def _latest_ids():
+    return {
+        source: queryset.order_by('-id').values_list('id', flat=True).first() or 0
+        for source, queryset, _, _, _ in EVENT_SOURCES
+    }
+
+
+def _save_marks(marks):
+    for source, last_id in marks.items():
+        RollupState.objects.update_or_create(source=source, defaults={'last_id': last_id})
+
+
+def full_build(chunk_size=None):
+    marks = _latest_ids()
+    song_ids = set()
+    for batch_ids in (
+        SongPlay.objects.filter(user__isnull=False).order_by().values_list('song_id', flat=True).distinct(),
+        Like.objects.order_by().values_list('song_id', flat=True).distinct(),
+        PlaylistSong.objects.order_by().values_list('song_id', flat=True).distinct(),
+    ):
+        song_ids.update(batch_ids)
+    # Songs that lost all their signals keep no stale neighbours
+    stale = set(SongNeighbor.objects.order_by().values_list('song_id', flat=True).distinct()) - song_ids
+    for batch in in_batches(stale):
+        SongNeighbor.objects.filter(song__in=batch).delete()
+    neighbors = update_neighbors(song_ids, chunk_size)
+
+    user_ids = set()
+    for source, queryset, _, user_field, _ in EVENT_SOURCES:
+        user_ids.update(queryset.order_by().values_list(user_field, flat=True).distinct())
+    user_ids.discard(None)
+    stale = set(Recommendation.objects.order_by().values_list('user_id', flat=True).distinct()) - user_ids
+    for batch in in_batches(stale):
+        Recommendation.objects.filter(user__in=batch).delete()
+    shelves = update_shelves(user_ids, chunk_size)
+
+    _save_marks(marks)
+    return {'songs': len(song_ids), 'neighbors': neighbors, 'users': len(user_ids), 'recommendations': shelves}
+
+
+def incremental_build(chunk_size=None):
+    marks = _latest_ids()
+    previous = dict(RollupState.objects.filter(source__in=marks).values_list('source', 'last_id'))
+
+    songs, users, playlists = set(), set(), set()
+    for source, queryset, song_field, user_field, playlist_field in EVENT_SOURCES:
+        fields = [field for field in (song_field, user_field, playlist_field) if field]
+        new_rows = queryset.filter(id__gt=previous.get(source, 0), id__lte=marks[source]).order_by().values_list(*fields)
+        for row in new_rows.distinct():
+            values = dict(zip(fields, row))
+            if song_field:
+                songs.add(values[song_field])
+            if values[user_field] is not None:
+                users.add(values[user_field])
+            if playlist_field:
+                playlists.add(values[playlist_field])
+
+    # A new (basket, song) pair changes the scores of every song in that basket
+    max_basket = get_setting('RECOMMENDATION_MAX_BASKET', 500)
+    baskets = _load_baskets(users, playlists, max_basket) if songs else {}
+    for basket in baskets.values():
+        songs.update(basket)
+    neighbors = update_neighbors(songs, chunk_size)
+    shelves = update_shelves(users, chunk_size)
+
+    _save_marks(marks)
+    return {'songs': len(songs), 'neighbors': neighbors, 'users': len(users), 'recommendations': shelves}
+
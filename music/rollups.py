@@ -0,0 +1,172 @@
+"""
+Hourly and daily play/download rollups.
+
+SongPlay and SongDownload get a row per event. ``manage.py rollup_analytics``
+(run from cron every few minutes) folds new events into SongStatRollup and
+ArtistStatRollup. It starts after the last event id recorded in RollupState,
+so each run reads only what arrived since the previous one. Dashboards read
+the daily rollups plus the few events not rolled up yet (song_activity,
+artist_activity), so a 30-day view costs 30 rows instead of one per play.
+
+compact() deletes rolled-up raw events older than ANALYTICS_RAW_RETENTION_DAYS
+and hourly rollups older than ANALYTICS_HOURLY_RETENTION_DAYS.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import ArtistStatRollup, RollupState, SongDownload, SongPlay, SongStatRollup
+
+UTC = datetime.timezone.utc
+
+# Event model, timestamp field, rollup counter
+SOURCES = (
+    (SongPlay, 'played_at', 'plays'),
+    (SongDownload, 'downloaded_at', 'downloads'),
+)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def source_name(model):
+    return model._meta.label_lower
+
+
+def high_water_marks():
+    marks = dict(RollupState.objects.values_list('source', 'last_id'))
+    return {model: marks.get(source_name(model), 0) for model, _, _ in SOURCES}
+
+
+def rollup(batch_size=10000):
+    """Fold every event newer than the high-water marks into the rollups"""
+    processed = 0
+    for model, time_field, counter in SOURCES:
+        state, _ = RollupState.objects.get_or_create(source=source_name(model))
+        last_id = state.last_id
+        max_id = model.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        while last_id < max_id:
+            upper = min(last_id + batch_size, max_id)
+            count = _rollup_batch(model, time_field, counter, last_id, upper)
+            if count is None:
+                # Another rollup run moved the mark; let it finish
+                break
+            processed += count
+            last_id = upper
+    return processed
+
+
+def _rollup_batch(model, time_field, counter, lower, upper):
+    with transaction.atomic():
+        # Move the mark first: it takes the write lock and stops a concurrent
+        # run from counting the same events twice
+        claimed = RollupState.objects.filter(source=source_name(model), last_id=lower).update(last_id=upper)
+        if not claimed:
+            return None
+
+        hourly = (
+            model.objects.filter(id__gt=lower, id__lte=upper)
+            .annotate(hour=TruncHour(time_field, tzinfo=UTC))
+            .values('song_id', 'song__artist_id', 'hour')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        songs = defaultdict(int)
+        artists = defaultdict(int)
+        total = 0
+        for row in hourly:
+            total += row['count']
+            hour = row['hour']
+            day = hour.replace(hour=0)
+            for period, bucket in (('hour', hour), ('day', day)):
+                songs[(row['song_id'], period, bucket)] += row['count']
+                artists[(row['song__artist_id'], period, bucket)] += row['count']
+
+        _merge(SongStatRollup, 'song_id', counter, songs)
+        _merge(ArtistStatRollup, 'artist_id', counter, artists)
+    return total
+
+
+def _merge(model, key_field, counter, counts):
+    if not counts:
+        return
+    existing = {
+        (getattr(row, key_field), row.period, row.bucket): row
+        for row in model.objects.filter(**{
+            f'{key_field}__in': {key for key, _, _ in counts},
+            'bucket__in': {bucket for _, _, bucket in counts},
+        })
+    }
+    to_update, to_create = [], []
+    for (key, period, bucket), count in counts.items():
+        row = existing.get((key, period, bucket))
+        if row is None:
+            to_create.append(model(**{key_field: key, 'period': period, 'bucket': bucket, counter: count}))
+        else:
+            setattr(row, counter, getattr(row, counter) + count)
+            to_update.append(row)
+    model.objects.bulk_update(to_update, [counter], batch_size=500)
+    model.objects.bulk_create(to_create, batch_size=500)
+
+
+def compact(now=None):
+    """Delete rolled-up raw events and hourly rollups past their retention"""
+    now = now or timezone.now()
+    raw_cutoff = now - datetime.timedelta(days=get_setting('ANALYTICS_RAW_RETENTION_DAYS', 90))
+    hourly_cutoff = now - datetime.timedelta(days=get_setting('ANALYTICS_HOURLY_RETENTION_DAYS', 14))
+
+    deleted = {}
+    marks = high_water_marks()
+    for model, time_field, _ in SOURCES:
+        # Events above the mark have not been counted yet, whatever their age
+        events = model.objects.filter(id__lte=marks[model], **{f'{time_field}__lt': raw_cutoff})
+        deleted[source_name(model)] = events.delete()[0]
+    for model in (SongStatRollup, ArtistStatRollup):
+        deleted[source_name(model)] = model.objects.filter(period='hour', bucket__lt=hourly_cutoff).delete()[0]
+    return deleted
+
+
+def _activity(rollups, event_filter, days):
+    today = timezone.now().astimezone(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+    since = today - datetime.timedelta(days=days - 1)
+    series = {since + datetime.timedelta(days=i): {'plays': 0, 'downloads': 0} for i in range(days)}
+
+    rows = rollups.filter(period='day', bucket__gte=since).values_list('bucket', 'plays', 'downloads')
+    for bucket, plays, downloads in rows:
+        series[bucket]['plays'] += plays
+        series[bucket]['downloads'] += downloads
+
+    # Add the events that arrived since the last rollup run
+    marks = high_water_marks()
+    for model, time_field, counter in SOURCES:
+        tail = (
+            model.objects.filter(id__gt=marks[model], **event_filter, **{f'{time_field}__gte': since})
+            .annotate(day=TruncDay(time_field, tzinfo=UTC))
+            .values('day')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for row in tail:
+            if row['day'] in series:
+                series[row['day']][counter] += row['count']
+
+    return {
+        'plays': sum(day['plays'] for day in series.values()),
+        'downloads': sum(day['downloads'] for day in series.values()),
+        'days': [dict(day=day, **counts) for day, counts in series.items()],
+    }
+
+
+def song_activity(song, days=30):
+    """Daily plays/downloads of ``song`` over the last ``days`` days (including today)"""
+    return _activity(song.stat_rollups.all(), {'song': song}, days)
+
+
+def artist_activity(artist, days=30):
+    return _activity(artist.stat_rollups.all(), {'song__artist': artist}, days)
@@ -0,0 +1,196 @@
+"""
+Song search.
+
+Searches go through a backend chosen by the SEARCH_BACKEND setting. The
+default, SQLiteFTSBackend, keeps an FTS5 index of approved songs
+(title, artist name, genre name, artist bio) and ranks matches with bm25.
+Every term is matched as a prefix, so "kin den" finds "King Denzo". Another
+database (e.g. Postgres tsvector) can be plugged in by subclassing
+SearchBackend. DatabaseBackend is the plain ORM fallback.
+
+The index is kept in sync by the Song/Artist/Genre signal handlers at the
+bottom of this module; ``manage.py rebuild_search_index`` rebuilds it.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Artist, Genre, Song
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(query):
+    return TERM_RE.findall(query.lower())[:10]
+
+
+class SearchBackend:
+    def search(self, query, offset=0, limit=20):
+        """Return ranked song ids for one page of results"""
+        raise NotImplementedError
+
+    def suggest(self, query, limit=8):
+        """Return song ids for typeahead, best matches first"""
+        return self.search(query, 0, limit)
+
+    def index_songs(self, song_ids):
+        pass
+
+    def remove_songs(self, song_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class DatabaseBackend(SearchBackend):
+    """Unindexed icontains search; works on any database"""
+
+    def search(self, query, offset=0, limit=20):
+        songs = Song.objects.approved()
+        for term in search_terms(query):
+            songs = songs.filter(
+                Q(title__icontains=term) | Q(artist__name__icontains=term) | Q(genre__name__icontains=term)
+            )
+        return list(songs.order_by('-plays', '-id').values_list('id', flat=True)[offset:offset + limit])
+
+
+class SQLiteFTSBackend(SearchBackend):
+    table = 'music_song_fts'
+    # bm25 weights for title, artist, genre, bio
+    weights = (10.0, 6.0, 2.0, 1.0)
+    # Typeahead ranks at most this many candidate matches
+    suggest_candidates = 200
+
+    def match_expression(self, query, columns=None, min_length=1):
+        terms = [term for term in search_terms(query) if len(term) >= min_length]
+        if not terms:
+            return None
+        expression = ' '.join(f'"{term}"*' for term in terms)
+        if columns:
+            expression = '{%s} : (%s)' % (' '.join(columns), expression)
+        return expression
+
+    def search(self, query, offset=0, limit=20):
+        expression = self.match_expression(query)
+        if expression is None:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, %s, %s, %s, %s) LIMIT %s OFFSET %s',
+                [expression, *self.weights, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def suggest(self, query, limit=8):
+        # Single letters are not in the prefix index (prefix='2 3'), so skip them here
+        expression = self.match_expression(query, columns=['title', 'artist'], min_length=2)
+        if expression is None:
+            return []
+        # Rank a bounded set of candidates so short prefixes stay fast on big catalogs
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM (SELECT rowid, bm25({self.table}, %s, %s, %s, %s) AS score '
+                f'FROM {self.table} WHERE {self.table} MATCH %s LIMIT %s) ORDER BY score LIMIT %s',
+                [*self.weights, expression, self.suggest_candidates, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_songs(self, song_ids):
+        song_ids = list(song_ids)
+        if not song_ids:
+            return
+        self.remove_songs(song_ids)
+        rows = (
+            Song.objects.approved()
+            .filter(id__in=song_ids)
+            .values_list('id', 'title', 'artist__name', 'genre__name', 'artist__bio')
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, artist, genre, bio) VALUES (%s, %s, %s, %s, %s)',
+                [(pk, title, artist, genre, bio or '') for pk, title, artist, genre, bio in rows],
+            )
+
+    def remove_songs(self, song_ids):
+        song_ids = list(song_ids)
+        if not song_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(song_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', song_ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, artist, genre, bio) '
+                'SELECT s.id, s.title, a.name, g.name, COALESCE(a.bio, \'\') '
+                'FROM music_song s '
+                'INNER JOIN music_artist a ON a.id = s.artist_id '
+                'INNER JOIN music_genre g ON g.id = s.genre_id '
+                'WHERE s.is_approved'
+            )
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        default = 'music.search.SQLiteFTSBackend' if connection.vendor == 'sqlite' else 'music.search.DatabaseBackend'
+        _backend = import_string(getattr(settings, 'SEARCH_BACKEND', default))()
+    return _backend
+
+
+def search_songs(query, offset=0, limit=20):
+    """Return one page of matching songs, ready for the listing templates"""
+    ids = get_search_backend().search(query, offset, limit)
+    songs = Song.objects.for_listing().in_bulk(ids)
+    return [songs[pk] for pk in ids if pk in songs]
+
+
+def suggest_songs(query, limit=8):
+    ids = get_search_backend().suggest(query, limit)
+    rows = {
+        row['id']: row
+        for row in Song.objects.filter(id__in=ids).values('id', 'title', 'artist__name')
+    }
+    return [rows[pk] for pk in ids if pk in rows]
+
+
+# Index maintenance
+
+@receiver(post_save, sender=Song)
+def index_song(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.is_approved:
+        get_search_backend().index_songs([instance.pk])
+    elif instance.was_approved:
+        get_search_backend().remove_songs([instance.pk])
+
+
+@receiver(post_delete, sender=Song)
+def unindex_song(sender, instance, **kwargs):
+    get_search_backend().remove_songs([instance.pk])
+
+
+@receiver(post_save, sender=Artist)
+def reindex_artist(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        get_search_backend().index_songs(instance.songs.approved().values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+def reindex_genre(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        get_search_backend().index_songs(instance.song_set.approved().values_list('id', flat=True))
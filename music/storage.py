@@ -0,0 +1,91 @@
+"""
+Content-addressed storage for uploaded media.
+
+Files are stored as <upload_to>/<aa>/<sha256><ext>, so uploading the same
+bytes twice maps to the same name and the second upload writes nothing.
+Each stored blob gets a MediaBlob row. ``manage.py dedupe_media`` moves
+legacy uploads into this layout and removes files nothing refers to.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    chunk_size = 1024 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from content in _save; identical files share a name
+        return name
+
+    def hashed_name(self, name, digest):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{extension}').replace('\\', '/')
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            # Large uploads are already on disk: hash, then move into place
+            source = content.temporary_file_path()
+            digest = hashlib.sha256()
+            with open(source, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(self.chunk_size), b''):
+                    digest.update(chunk)
+            stored = self.hashed_name(name, digest.hexdigest())
+            if not self.exists(stored):
+                os.makedirs(os.path.dirname(self.path(stored)), exist_ok=True)
+                file_move_safe(source, self.path(stored), allow_overwrite=True)
+        else:
+            # Hash while writing to a temporary file, in a single pass
+            digest = hashlib.sha256()
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.upload-')
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    if hasattr(content, 'seek'):
+                        content.seek(0)
+                    for chunk in content.chunks(self.chunk_size):
+                        digest.update(chunk)
+                        fh.write(chunk)
+                stored = self.hashed_name(name, digest.hexdigest())
+                if self.exists(stored):
+                    os.remove(tmp)
+                else:
+                    os.makedirs(os.path.dirname(self.path(stored)), exist_ok=True)
+                    # Same name means same bytes, so a concurrent replace is harmless
+                    os.replace(tmp, self.path(stored))
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+        if self.file_permissions_mode is not None:
+            os.chmod(self.path(stored), self.file_permissions_mode)
+        self.record_blob(stored, digest.hexdigest())
+        return stored
+
+    def record_blob(self, name, digest):
+        from .models import MediaBlob
+
+        MediaBlob.objects.get_or_create(name=name, defaults={
+            'sha256': digest,
+            'size': self.size(name),
+        })
+
+
+_storage = None
+
+
+def content_storage():
+    """Storage callable for model FileFields"""
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
@@ -0,0 +1,131 @@
+"""
+Range-aware audio delivery.
+
+Full responses hand the open file to FileResponse, so gunicorn can send it
+with sendfile() instead of reading it through the worker. Partial (206)
+responses stream only the requested byte range in fixed-size chunks. If
+AUDIO_SENDFILE_HEADER is set (e.g. 'X-Accel-Redirect' behind nginx), the
+transfer is handed off to the front-end server entirely.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeFile:
+    """File-like wrapper that reads at most ``length`` bytes from ``start``"""
+
+    def __init__(self, fh, start, length):
+        self.fh = fh
+        self.fh.seek(start)
+        self.remaining = length
+
+    def read(self, size=CHUNK_SIZE):
+        if self.remaining <= 0:
+            return b''
+        data = self.fh.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fh.close()
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) for a single "bytes=" range, None if the header should
+    be ignored (missing or multi-range), or False if it cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def file_etag(stat):
+    return quote_etag(f'{stat.st_size:x}-{int(stat.st_mtime):x}')
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('W/'):
+        # If-Range requires a strong comparison; a weak validator never matches
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve_audio(request, fieldfile, as_attachment=False, filename=None):
+    """Serve ``fieldfile`` with ETag/Last-Modified, conditional GET and Range support"""
+    path = fieldfile.path
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    content_type = mimetypes.guess_type(path)[0] or 'audio/mpeg'
+    size = stat.st_size
+    byte_range = None
+    if if_range_matches(request, etag, last_modified):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    sendfile_header = getattr(settings, 'AUDIO_SENDFILE_HEADER', '')
+    if sendfile_header:
+        # The front-end server handles ranges and conditional requests itself
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'AUDIO_SENDFILE_PREFIX', settings.MEDIA_URL)
+        response[sendfile_header] = prefix.rstrip('/') + '/' + fieldfile.name
+    elif byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(RangeFile(open(path, 'rb'), start, length), status=206, content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+
+    if as_attachment:
+        response['Content-Disposition'] = content_disposition_header(True, filename or os.path.basename(path))
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, max-age=%d' % getattr(settings, 'AUDIO_CACHE_MAX_AGE', 86400)
+    return response
@@ -0,0 +1,32 @@
+from django import template
+from django.utils.html import format_html
+
+from music import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(image, preset, scale=1, fmt='jpg'):
+    """URL of one derivative, e.g. {% thumbnail_url song.cover_image 'card' %}"""
+    return thumbnails.thumbnail_url(image, preset, scale, fmt)
+
+
+@register.simple_tag
+def thumbnail_srcset(image, preset, fmt='webp'):
+    """1x/2x srcset for an <img>, e.g. srcset="{% thumbnail_srcset song.cover_image 'thumb' %}" """
+    return thumbnails.thumbnail_srcset(image, preset, fmt)
+
+
+@register.simple_tag
+def thumbnail_background(image, preset):
+    """background-image declarations: a JPEG fallback, then a WebP 1x/2x image-set"""
+    fallback = thumbnails.thumbnail_url(image, preset)
+    if not image:
+        return format_html("background-image: url('{}');", fallback)
+    return format_html(
+        "background-image: url('{}'); background-image: image-set(url('{}') 1x, url('{}') 2x);",
+        fallback,
+        thumbnails.thumbnail_url(image, preset, 1, 'webp'),
+        thumbnails.thumbnail_url(image, preset, 2, 'webp'),
+    )
@@ -1,3 +1,1036 @@
-from django.test import TestCase
+import datetime
+import json
+import math
+import os
+import shutil
+import struct
+import tempfile
+import time
+import wave
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import rollups, trending
+from .audioprobe import ProbeError, probe_audio
+from .counters import CounterBuffer
+from .models import (
+    Artist, ArtistStatRollup, Genre, Like, MediaBlob, MediaJob, Playlist, PlaylistEntry, RollupState, Song,
+    SongDownload, SongPlay, SongStatRollup, UserProfile,
+)
+from .pagination import keyset_paginate
+from .pipeline import claim_job, process_job
+from .playevents import InvalidPlayEvents, clean_play_events
+from .playlists import POSITION_GAP, append_songs, apply_diff
+from .search import search_songs
+from .storage import content_storage
+from .streaming import parse_range
+from .views import DISCOVER_SORTS
+
+
+class SongListingQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(name='Afrobeat')
+        cls.other_genre = Genre.objects.create(name='Gospel')
+
+    def add_songs(self, count):
+        for i in range(count):
+            user = User.objects.create(username=f'artist{Artist.objects.count()}')
+            artist = Artist.objects.create(user=user, name=f'Artist {i}')
+            Song.objects.create(
+                title=f'Song {i}',
+                artist=artist,
+                genre=self.genre if i % 2 else self.other_genre,
+                audio_file=f'songs/song{i}.mp3',
+                duration=180,
+                is_approved=True,
+            )
+
+    def count_listing_queries(self, queryset):
+        with CaptureQueriesContext(connection) as ctx:
+            for song in queryset:
+                song.artist.name, song.genre.name, song.cover_image, song.audio_file
+        return len(ctx.captured_queries)
+
+    def test_listing_helpers_use_a_single_query(self):
+        self.add_songs(6)
+        listings = [
+            Song.objects.for_listing(),
+            Song.objects.for_listing().approved(),
+            Song.objects.for_listing().by_genre(self.genre),
+            Song.objects.for_listing().approved().top_by('plays', 5),
+            Song.objects.for_listing().top_by('downloads'),
+        ]
+        for queryset in listings:
+            self.assertEqual(self.count_listing_queries(queryset), 1)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.add_songs(3)
+        small = self.count_listing_queries(Song.objects.for_listing())
+        self.add_songs(20)
+        large = self.count_listing_queries(Song.objects.for_listing())
+        self.assertEqual(small, large)
+
+    def test_discover_page_query_count_is_constant(self):
+        self.add_songs(4)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/discover/page/')
+        small = len(ctx.captured_queries)
+        self.add_songs(20)
+        with self.assertNumQueries(small):
+            response = self.client.get('/discover/page/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_keyset_pages_cover_every_song_once(self):
+        self.add_songs(11)
+        # Ties on plays are broken by id
+        Song.objects.filter(id__in=Song.objects.order_by('id').values('id')[:6]).update(plays=3)
+        songs = Song.objects.for_listing()
+        for ordering in DISCOVER_SORTS.values():
+            seen, cursor = [], None
+            while True:
+                page = keyset_paginate(songs, ordering, cursor, 4)
+                seen += [song.pk for song in page.items]
+                cursor = page.next_cursor
+                if not cursor:
+                    break
+            self.assertEqual(seen, list(songs.order_by(*ordering).values_list('pk', flat=True)))
+
+
+class CounterBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        cls.artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        cls.songs = [
+            Song.objects.create(
+                title=f'Song {i}', artist=cls.artist, genre=genre,
+                audio_file=f'songs/song{i}.mp3', duration=180,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        # A private buffer that only writes when flushed
+        self.buffer = CounterBuffer()
+        patcher = mock.patch.object(self.buffer, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, plays=(), downloads=()):
+        with override_settings(COUNTER_FLUSH_INTERVAL=60):
+            self.buffer.record_plays([
+                {'song_id': song.pk, 'played_at': timezone.now(), 'duration_played': 60, 'completed': False}
+                for song in plays
+            ])
+            for song in downloads:
+                self.buffer.record_download(song.pk)
+
+    def test_flush_merges_deltas(self):
+        first, second, third = self.songs
+        self.record(plays=[first, first, first, second], downloads=[first, third])
+        self.assertEqual(self.buffer.pending_plays(first.pk), 3)
+        self.assertEqual(self.buffer.flush(), 6)
+
+        counts = dict(Song.objects.values_list('pk', 'plays'))
+        self.assertEqual(counts, {first.pk: 3, second.pk: 1, third.pk: 0})
+        self.artist.refresh_from_db()
+        self.assertEqual((self.artist.play_count, self.artist.download_count), (4, 2))
+        self.assertEqual(SongPlay.objects.count(), 4)
+        self.assertEqual(SongDownload.objects.count(), 2)
+        self.assertEqual(self.buffer.pending_plays(first.pk), 0)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_write_is_requeued(self):
+        first, second, _ = self.songs
+        self.record(plays=[first, second])
+        with mock.patch.object(self.buffer, '_write', side_effect=DatabaseError), self.assertLogs('music.counters'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending_plays(first.pk), 1)
+
+        self.record(plays=[first])
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(Song.objects.get(pk=first.pk).plays, 2)
+        self.assertEqual(SongPlay.objects.count(), 3)
+
+    def test_deleted_songs_are_dropped(self):
+        first, second, _ = self.songs
+        self.record(plays=[first, second], downloads=[second])
+        Song.objects.filter(pk=second.pk).delete()
+        self.buffer.flush()
+
+        self.assertEqual(Song.objects.get(pk=first.pk).plays, 1)
+        self.assertEqual(list(SongPlay.objects.values_list('song_id', flat=True)), [first.pk])
+        self.assertFalse(SongDownload.objects.exists())
+        self.artist.refresh_from_db()
+        self.assertEqual((self.artist.play_count, self.artist.download_count), (1, 0))
+
+
+class PlaylistEditTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        cls.songs = [
+            Song.objects.create(
+                title=f'Song {i}', artist=artist, genre=genre,
+                audio_file=f'songs/song{i}.mp3', duration=180,
+            )
+            for i in range(5)
+        ]
+        cls.user = User.objects.create_user('listener', 'listener@example.com', 'password')
+        cls.playlist = Playlist.objects.create(name='Mix', user=cls.user)
+
+    def order(self):
+        return list(self.playlist.entries.order_by('position').values_list('song_id', flat=True))
+
+    def ids(self, *indexes):
+        return [self.songs[i].pk for i in indexes]
+
+    def test_append_to_empty_playlist(self):
+        result = append_songs(self.playlist, self.ids(2, 0))
+        self.assertEqual(result, {'added': 2, 'removed': 0, 'moved': 0, 'song_count': 2})
+        self.assertEqual(self.order(), self.ids(2, 0))
+        positions = list(self.playlist.entries.order_by('position').values_list('position', flat=True))
+        self.assertEqual(positions, [POSITION_GAP, 2 * POSITION_GAP])
+
+    def test_insert_into_exhausted_gap_renumbers(self):
+        first, second, third = self.ids(0, 1, 2)
+        PlaylistEntry.objects.bulk_create([
+            PlaylistEntry(playlist=self.playlist, song_id=first, position=10),
+            PlaylistEntry(playlist=self.playlist, song_id=second, position=11),
+        ])
+        result = apply_diff(self.playlist, add=[(third, first, None)])
+        self.assertEqual(result['added'], 1)
+        self.assertEqual(self.order(), [first, third, second])
+        positions = dict(self.playlist.entries.values_list('song_id', 'position'))
+        self.assertEqual(
+            [positions[first], positions[second]], [POSITION_GAP, 2 * POSITION_GAP],
+        )
+        self.assertTrue(POSITION_GAP < positions[third] < 2 * POSITION_GAP)
+
+    def test_remove_and_readd_keeps_entry(self):
+        append_songs(self.playlist, self.ids(0, 1, 2))
+        entry = self.playlist.entries.get(song_id=self.songs[0].pk)
+        result = apply_diff(self.playlist, remove=self.ids(0), add=[(self.songs[0].pk, self.songs[2].pk, None)])
+        self.assertEqual(result, {'added': 0, 'removed': 0, 'moved': 1, 'song_count': 3})
+        self.assertEqual(self.order(), self.ids(1, 2, 0))
+        readded = self.playlist.entries.get(song_id=self.songs[0].pk)
+        self.assertEqual((readded.pk, readded.added_at), (entry.pk, entry.added_at))
+
+    def test_move_with_unknown_anchor_is_rejected(self):
+        append_songs(self.playlist, self.ids(0, 1))
+        self.client.force_login(self.user)
+        response = self.client.patch(
+            f'/api/playlists/{self.playlist.pk}/songs/',
+            json.dumps({'move': [{'song': self.songs[0].pk, 'after': self.songs[4].pk}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.order(), self.ids(0, 1))
+
+
+class TrendingTests(TestCase):
+    def test_log2_add(self):
+        self.assertEqual(trending.log2_add(None, 3.0), 3.0)
+        self.assertAlmostEqual(trending.log2_add(3.0, 3.0), 4.0)
+        self.assertAlmostEqual(trending.log2_add(0.0, 1.0), math.log2(3))
+        # Far apart exponents don't overflow
+        self.assertAlmostEqual(trending.log2_add(5000.0, 0.0), 5000.0)
+        self.assertAlmostEqual(trending.log2_add(0.0, 5000.0), 5000.0)
+
+    def test_decayed_score_halves_every_half_life(self):
+        when = timezone.now()
+        for window, (_, half_life) in trending.WINDOWS.items():
+            value = trending.log_weight(when, 2, half_life)
+            self.assertAlmostEqual(trending.decayed_score(value, window, now=when), 2.0)
+            self.assertAlmostEqual(trending.decayed_score(value, window, now=when + half_life), 1.0)
+            self.assertAlmostEqual(trending.decayed_score(value, window, now=when + 3 * half_life), 0.25)
+        self.assertEqual(trending.decayed_score(None, 'day'), 0.0)
+
+    def test_record_events_orders_charts(self):
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        fresh, older, silent = [
+            Song.objects.create(
+                title=f'Song {i}', artist=artist, genre=genre,
+                audio_file=f'songs/song{i}.mp3', duration=180, is_approved=True,
+            )
+            for i in range(3)
+        ]
+        now = timezone.now()
+        # One play now against a download (worth two plays) three days ago
+        trending.record_events(plays=[(fresh.pk, now)], downloads=[(older.pk, now - datetime.timedelta(days=3))])
+
+        self.assertEqual(list(trending.trending('day')), [fresh, older])
+        self.assertEqual(list(trending.trending('week')), [older, fresh])
+        silent.refresh_from_db()
+        self.assertIsNone(silent.trending_day)
+
+        # Two more plays of the older song overtake on the day chart too
+        trending.record_events(plays=[(older.pk, now), (older.pk, now)])
+        self.assertEqual(list(trending.trending('day')), [older, fresh])
+
+    def test_top_songs_page_shows_trending(self):
+        cache.clear()
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        song = Song.objects.create(
+            title='Rising Song', artist=artist, genre=genre,
+            audio_file='songs/rising.mp3', duration=180, is_approved=True,
+        )
+        trending.record_events(plays=[(song.pk, timezone.now())])
+        self.client.force_login(User.objects.create_user('listener', 'listener@example.com', 'password'))
+
+        response = self.client.get('/analytics/top-songs/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'top_songs.html')
+        self.assertEqual(response.context['trending_day'], [song])
+        self.assertEqual(response.context['trending_week'], [song])
+        self.assertContains(response, 'Trending Today')
+        self.assertContains(response, 'Rising Song')
+
+
+class LikeApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        cls.song = Song.objects.create(
+            title='Song', artist=artist, genre=genre, audio_file='songs/song.mp3', duration=180,
+        )
+        cls.user = User.objects.create_user('listener', 'listener@example.com', 'password')
+        cls.url = f'/api/songs/{cls.song.pk}/like/'
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def like_count(self):
+        return Song.objects.values_list('like_count', flat=True).get(pk=self.song.pk)
+
+    def test_put_and_delete_are_idempotent(self):
+        for _ in range(2):
+            response = self.client.put(self.url)
+            self.assertEqual(response.json(), {'liked': True, 'like_count': 1})
+        self.assertEqual(Like.objects.filter(song=self.song).count(), 1)
+        self.assertEqual(self.client.get(self.url).json(), {'liked': True, 'like_count': 1})
+
+        for _ in range(2):
+            response = self.client.delete(self.url)
+            self.assertEqual(response.json(), {'liked': False, 'like_count': 0})
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(self.like_count(), 0)
+
+    def test_like_count_follows_other_users(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        Like.objects.create(user=other, song=self.song)
+        self.assertEqual(self.client.put(self.url).json()['like_count'], 2)
+        other.delete()
+        self.assertEqual(self.like_count(), 1)
+        # A stale instance doesn't write like_count back
+        self.song.save()
+        self.assertEqual(self.like_count(), 1)
+
+    def test_anonymous_requests_are_rejected(self):
+        self.client.logout()
+        self.assertEqual(self.client.put(self.url).status_code, 401)
+        self.assertEqual(self.like_count(), 0)
+
+
+class SignupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(name='Afrobeat')
+        User.objects.create_user('taken', 'Taken@Example.com', 'password')
+
+    def signup(self, **fields):
+        data = {
+            'username': 'newcomer', 'email': 'newcomer@example.com',
+            'password1': 'secret-pass', 'password2': 'secret-pass',
+            **fields,
+        }
+        return self.client.post('/signup/', data)
+
+    def errors(self, response):
+        return [str(message) for message in response.context['messages']]
+
+    def test_username_clash(self):
+        response = self.signup(username='taken')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.errors(response), ['Username already exists.'])
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_email_clash_ignores_case(self):
+        response = self.signup(email='taken@EXAMPLE.com')
+        self.assertEqual(self.errors(response), ['Email already exists.'])
+        self.assertFalse(User.objects.filter(username='newcomer').exists())
+        self.assertFalse(UserProfile.objects.filter(user__username='newcomer').exists())
+
+    def test_artist_created_with_user(self):
+        response = self.signup(is_artist='on', artist_name='Newcomer', genre=str(self.genre.pk))
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        user = User.objects.get(username='newcomer')
+        self.assertEqual(user.userprofile.user_type, 'artist')
+        self.assertEqual((user.artist_profile.name, user.artist_profile.genre), ('Newcomer', self.genre))
+
+    def test_failed_artist_rolls_back_user(self):
+        with mock.patch.object(Artist.objects, 'create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.signup(is_artist='on', artist_name='Newcomer')
+        self.assertFalse(User.objects.filter(username='newcomer').exists())
+        self.assertFalse(UserProfile.objects.filter(user__username='newcomer').exists())
+
+
+class RollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        cls.user = User.objects.create_user('artist', 'artist@example.com', 'password')
+        UserProfile.objects.create(user=cls.user, user_type='artist')
+        cls.artist = Artist.objects.create(user=cls.user, name='Artist')
+        cls.song = Song.objects.create(
+            title='Song', artist=cls.artist, genre=genre, audio_file='songs/song.mp3', duration=180,
+        )
+
+    def setUp(self):
+        now = timezone.now().astimezone(datetime.timezone.utc)
+        self.hour = now.replace(minute=0, second=0, microsecond=0)
+        self.day = self.hour.replace(hour=0)
+
+    def play(self, when, count=1):
+        SongPlay.objects.bulk_create([SongPlay(song=self.song, played_at=when) for _ in range(count)])
+
+    def rollup_counts(self, model=SongStatRollup):
+        return {(row.period, row.bucket): (row.plays, row.downloads) for row in model.objects.all()}
+
+    def test_rollup_moves_high_water_mark(self):
+        self.play(self.hour, 2)
+        SongDownload.objects.create(song=self.song, downloaded_at=self.hour)
+        self.assertEqual(rollups.rollup(), 3)
+
+        self.assertEqual(self.rollup_counts(), {('hour', self.hour): (2, 1), ('day', self.day): (2, 1)})
+        self.assertEqual(self.rollup_counts(ArtistStatRollup), self.rollup_counts())
+        marks = rollups.high_water_marks()
+        self.assertEqual(marks[SongPlay], SongPlay.objects.order_by('-id').values_list('id', flat=True)[0])
+        # Nothing new, nothing counted twice
+        self.assertEqual(rollups.rollup(), 0)
+        self.assertEqual(self.rollup_counts()[('day', self.day)], (2, 1))
+
+    def test_rollup_merges_into_existing_rows(self):
+        self.play(self.hour)
+        rollups.rollup()
+        earlier = self.hour - datetime.timedelta(hours=1) if self.hour.hour else self.hour
+        self.play(self.hour, 2)
+        self.play(earlier)
+        # Small batches exercise several claims in one run
+        self.assertEqual(rollups.rollup(batch_size=1), 3)
+
+        counts = self.rollup_counts()
+        self.assertEqual(counts[('day', self.day)], (4, 0))
+        self.assertEqual(sum(plays for (period, _), (plays, _) in counts.items() if period == 'hour'), 4)
+        self.assertEqual(SongStatRollup.objects.filter(period='day').count(), 1)
+
+    def test_concurrent_claim_is_skipped(self):
+        self.play(self.hour, 2)
+        RollupState.objects.create(source=rollups.source_name(SongPlay), last_id=0)
+        last_id = SongPlay.objects.order_by('-id').values_list('id', flat=True)[0]
+        # Another run already moved the mark past 0
+        RollupState.objects.filter(source=rollups.source_name(SongPlay)).update(last_id=1)
+        self.assertIsNone(rollups._rollup_batch(SongPlay, 'played_at', 'plays', 0, last_id))
+        self.assertFalse(SongStatRollup.objects.exists())
+
+        with mock.patch.object(rollups, '_rollup_batch', return_value=None) as batch:
+            self.assertEqual(rollups.rollup(), 0)
+        # Gives up on the first lost claim per source instead of looping
+        self.assertEqual(batch.call_count, 1)
+
+    def test_compact_keeps_events_above_the_mark(self):
+        old = self.hour - datetime.timedelta(days=120)
+        self.play(old, 2)
+        rollups.rollup()
+        self.play(old)
+        deleted = rollups.compact()
+
+        self.assertEqual(deleted['music.songplay'], 2)
+        self.assertEqual(SongPlay.objects.count(), 1)
+        # Hourly rows past retention go; daily rows stay
+        self.assertEqual(deleted['music.songstatrollup'], 1)
+        self.assertEqual(list(SongStatRollup.objects.values_list('period', flat=True)), ['day'])
+
+    def test_activity_adds_events_not_rolled_up(self):
+        self.play(self.hour, 2)
+        self.play(self.hour - datetime.timedelta(days=40))
+        rollups.rollup()
+        self.play(self.hour, 3)
+        SongDownload.objects.create(song=self.song, downloaded_at=self.hour)
+
+        activity = rollups.song_activity(self.song, days=30)
+        self.assertEqual((activity['plays'], activity['downloads']), (5, 1))
+        self.assertEqual(len(activity['days']), 30)
+        self.assertEqual(activity['days'][-1], {'day': self.day, 'plays': 5, 'downloads': 1})
+        self.assertEqual(rollups.artist_activity(self.artist, days=30)['plays'], 5)
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/analytics/song/{self.song.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'song_analysis.html')
+        self.assertEqual(response.context['activity']['plays'], 5)
+
+
+class PlayEventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        cls.song, cls.short_song, cls.unprobed = [
+            Song.objects.create(
+                title=f'Song {i}', artist=artist, genre=genre,
+                audio_file=f'songs/song{i}.mp3', duration=duration,
+            )
+            for i, duration in enumerate([180, 40, None])
+        ]
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def event(self, song=None, seconds=0, ago=datetime.timedelta(minutes=10), completed=False, **extra):
+        return {
+            'song': (song or self.song).pk,
+            'started_at': (self.now - ago).isoformat(),
+            'seconds': seconds,
+            'completed': completed,
+            **extra,
+        }
+
+    def clean(self, events):
+        return clean_play_events(events, now=self.now)
+
+    def test_min_seconds(self):
+        plays, rejected = self.clean([
+            self.event(seconds=29),
+            self.event(seconds=30, ago=datetime.timedelta(minutes=9)),
+            self.event(seconds=5, completed=True, ago=datetime.timedelta(minutes=8)),
+            # Half of a 40 second song is enough
+            self.event(self.short_song, seconds=20),
+            # Longer than the song: capped at its duration
+            self.event(self.short_song, seconds=500, ago=datetime.timedelta(minutes=5)),
+        ])
+        self.assertEqual(rejected, 1)
+        self.assertEqual([play['duration_played'] for play in plays], [30, 5, 20, 40])
+
+    @override_settings(PLAY_EVENTS_MAX_PER_SONG=2)
+    def test_duplicates_and_per_song_cap(self):
+        repeated = [self.event(seconds=60)] * 50
+        self.assertEqual(self.clean(repeated), (self.clean(repeated[:1])[0], 49))
+        distinct = [self.event(seconds=60, ago=datetime.timedelta(minutes=i + 1)) for i in range(5)]
+        plays, rejected = self.clean(distinct + [self.event(self.short_song, seconds=40)])
+        self.assertEqual([play['song_id'] for play in plays], [self.song.pk] * 2 + [self.short_song.pk])
+        self.assertEqual(rejected, 3)
+
+    def test_age_window(self):
+        plays, rejected = self.clean([
+            self.event(seconds=60, ago=datetime.timedelta(days=8)),
+            self.event(seconds=60, ago=-datetime.timedelta(minutes=10)),
+            self.event(seconds=60, ago=-datetime.timedelta(minutes=2)),
+        ])
+        self.assertEqual(rejected, 2)
+        # Small clock skew is tolerated, but a play can't be in the future
+        self.assertEqual([play['played_at'] for play in plays], [self.now])
+
+    def test_invalid_events_are_dropped(self):
+        plays, rejected = self.clean([
+            'not an event',
+            {'seconds': 60},
+            self.event(seconds=-1),
+            self.event(seconds=float('nan')),
+            self.event(self.unprobed, seconds=float('inf')),
+            self.event(started_at='2026-02-30T00:00:00'),
+            self.event(started_at='yesterday'),
+            {'song': 0, 'started_at': self.now.isoformat(), 'completed': True},
+            self.event(self.unprobed, seconds=60),
+        ])
+        self.assertEqual(rejected, 8)
+        self.assertEqual([play['song_id'] for play in plays], [self.unprobed.pk])
+        with self.assertRaises(InvalidPlayEvents):
+            self.clean({'song': self.song.pk})
+        with self.assertRaises(InvalidPlayEvents):
+            self.clean([self.event()] * 201)
+
+    @override_settings(COUNTER_FLUSH_INTERVAL=0)
+    def test_record_plays_endpoint(self):
+        body = json.dumps({'events': [
+            self.event(seconds=60),
+            self.event(started_at='2026-02-30T00:00:00'),
+        ]})
+        # JSON numbers too large for a float parse as infinity
+        body = body.replace('"events": [', '"events": [{"song": %d, "started_at": "%s", "seconds": 1e999}, '
+                            % (self.unprobed.pk, self.now.isoformat()))
+        response = self.client.post('/plays/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'accepted': 1, 'rejected': 2})
+        self.assertEqual(Song.objects.get(pk=self.song.pk).plays, 1)
+
+        response = self.client.post('/plays/', '{"events": 5}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        settings = override_settings(MEDIA_ROOT=self.media_root, BASE_DIR=self.base_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, name, content, age_hours=48):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        stamp = time.time() - age_hours * 3600
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def stored_files(self, directory):
+        return sorted(
+            os.path.relpath(os.path.join(dirpath, filename), self.media_root).replace(os.sep, '/')
+            for dirpath, _, filenames in os.walk(os.path.join(self.media_root, directory))
+            for filename in filenames
+        )
+
+    def test_same_content_is_stored_once(self):
+        storage = content_storage()
+        first = storage.save('covers/one.PNG', ContentFile(b'cover bytes'))
+        second = storage.save('covers/two.png', ContentFile(b'cover bytes'))
+        other = storage.save('covers/three.png', ContentFile(b'other bytes'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^covers/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(self.stored_files('covers'), sorted([first, other]))
+        self.assertEqual(MediaBlob.objects.get(name=first).size, len(b'cover bytes'))
+        self.assertEqual(MediaBlob.objects.count(), 2)
+
+    def test_large_upload_is_moved_into_place(self):
+        upload = TemporaryUploadedFile('song.mp3', 'audio/mpeg', 0, None)
+        upload.write(b'audio bytes')
+        upload.flush()
+        self.addCleanup(upload.close)
+
+        name = content_storage().save('songs/song.mp3', upload)
+        again = content_storage().save('songs/copy.mp3', ContentFile(b'audio bytes'))
+
+        self.assertEqual(name, again)
+        self.assertEqual(self.stored_files('songs'), [name])
+        with content_storage().open(name) as fh:
+            self.assertEqual(fh.read(), b'audio bytes')
+
+    def test_dedupe_media_moves_legacy_files_and_collects_garbage(self):
+        first, second = (
+            UserProfile.objects.create(user=User.objects.create(username=name)) for name in ('first', 'second')
+        )
+        self.write('profile_pics/first.png', b'same face')
+        self.write('profile_pics/second.png', b'same face')
+        UserProfile.objects.filter(pk=first.pk).update(profile_picture='profile_pics/first.png')
+        UserProfile.objects.filter(pk=second.pk).update(profile_picture='profile_pics/second.png')
+        self.write('profile_pics/orphan.png', b'nobody')
+        self.write('profile_pics/fresh.png', b'just uploaded', age_hours=0)
+        self.write('covers/orphan.png', b'old cover')
+
+        dry_run = StringIO()
+        call_command('dedupe_media', '--dry-run', stdout=dry_run, stderr=StringIO())
+        self.assertIn('Would move 2 file references', dry_run.getvalue())
+        self.assertEqual(len(self.stored_files('profile_pics')), 4)
+
+        call_command('dedupe_media', stdout=StringIO(), stderr=StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.profile_picture.name, second.profile_picture.name)
+        self.assertRegex(first.profile_picture.name, r'^profile_pics/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        # The legacy copies and the old orphan are gone; the recent upload is inside the grace period
+        self.assertEqual(
+            self.stored_files('profile_pics'), sorted([first.profile_picture.name, 'profile_pics/fresh.png']),
+        )
+        self.assertEqual(self.stored_files('covers'), [])
+        self.assertTrue(MediaBlob.objects.filter(name=first.profile_picture.name).exists())
+
+
+class StreamingTests(TestCase):
+    content = bytes(range(256)) * 8
+
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        cls.song = Song.objects.create(
+            title='Song', artist=artist, genre=genre, audio_file='songs/stream.mp3', duration=180,
+        )
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root, AUDIO_SENDFILE_HEADER='')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(self.media_root, 'songs'))
+        with open(os.path.join(self.media_root, 'songs', 'stream.mp3'), 'wb') as fh:
+            fh.write(self.content)
+        self.url = f'/stream/{self.song.pk}/'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_parse_range(self):
+        size = len(self.content)
+        self.assertEqual(parse_range('bytes=0-', size), (0, size - 1))
+        self.assertEqual(parse_range('bytes=10-19', size), (10, 19))
+        self.assertEqual(parse_range('bytes=10-99999', size), (10, size - 1))
+        self.assertEqual(parse_range('bytes=-500', size), (size - 500, size - 1))
+        self.assertEqual(parse_range('bytes=-99999', size), (0, size - 1))
+        self.assertIs(parse_range(f'bytes={size}-', size), False)
+        self.assertIs(parse_range('bytes=20-10', size), False)
+        self.assertIs(parse_range('bytes=-0', size), False)
+        for header in (None, '', 'bytes=-', 'bytes=0-1,5-9', 'items=0-9', 'bytes=a-b', 'bytes 0-9'):
+            self.assertIsNone(parse_range(header, size), header)
+
+    def test_full_and_partial_responses(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response, body = self.get(HTTP_RANGE='bytes=0-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Content-Range'], f'bytes 0-{len(self.content) - 1}/{len(self.content)}')
+
+        response, body = self.get(HTTP_RANGE='bytes=-500')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[-500:])
+        self.assertEqual(response['Content-Length'], '500')
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response, _ = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+        # Multi-range and malformed headers are ignored in favour of the whole file
+        for header in ('bytes=0-9,20-29', 'bytes=nonsense'):
+            response, body = self.get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(body, self.content)
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+
+        response, body = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[10:20])
+
+        # A stale or weak validator means the client's partial copy may be wrong
+        for validator in ('"stale"', 'W/' + etag, 'Thu, 01 Jan 1970 00:00:00 GMT'):
+            response, body = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(body, self.content)
+
+    def test_conditional_get(self):
+        response, _ = self.get()
+        response, body = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+
+class SongApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        cls.song, cls.other = [
+            Song.objects.create(
+                title=f'Song {i}', artist=artist, genre=genre, audio_file=f'songs/song{i}.mp3', duration=180,
+            )
+            for i in range(2)
+        ]
+
+    def test_matching_etag_returns_not_modified(self):
+        url = f'/api/songs/{self.song.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Song 0')
+        self.assertIn('public', response['Cache-Control'])
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+        batch = self.client.get(f'/api/songs/?ids={self.other.pk},{self.song.pk}')
+        self.assertEqual([song['id'] for song in batch.json()['songs']], [self.other.pk, self.song.pk])
+        self.assertEqual(self.client.get(
+            f'/api/songs/?ids={self.other.pk},{self.song.pk}', HTTP_IF_NONE_MATCH=batch['ETag'],
+        ).status_code, 304)
+
+    def test_etag_changes_after_edit(self):
+        url = f'/api/songs/{self.song.pk}/'
+        etag = self.client.get(url)['ETag']
+
+        self.song.title = 'Renamed'
+        self.song.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        genre = Genre.objects.create(name='Afrobeat')
+        artist = Artist.objects.create(user=User.objects.create(username='artist'), name='Artist')
+        cls.song = Song.objects.create(
+            title='Original Title', artist=artist, genre=genre, audio_file='songs/song.mp3', duration=180,
+            is_approved=True,
+        )
+        cls.user = User.objects.create_user(username='listener', password='pw')
+        UserProfile.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_second_anonymous_request_makes_no_queries(self):
+        for url in ('/', '/discover/'):
+            first = self.client.get(url)
+            self.assertEqual(first['X-Cache'], 'MISS')
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second['X-Cache'], 'HIT')
+            # Same stored page; only the visitor's CSRF token is filled in per request
+            self.assertEqual(second['ETag'], first['ETag'])
+
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=second['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.get('/discover/')
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/discover/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Cache', response)
+        self.assertTrue(queries.captured_queries)
+
+    def test_saving_a_song_invalidates_pages(self):
+        for url in ('/', '/discover/'):
+            self.assertContains(self.client.get(url), 'Original Title')
+
+        self.song.title = 'Edited Title'
+        self.song.save()
+
+        for url in ('/', '/discover/'):
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS', url)
+            self.assertContains(response, 'Edited Title')
+            self.assertNotContains(response, 'Original Title')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        highlife = Genre.objects.create(name='Highlife')
+        afrobeat = Genre.objects.create(name='Afrobeat')
+        cls.artist = Artist.objects.create(user=User.objects.create(username='denzo'), name='King Denzo')
+        other = Artist.objects.create(user=User.objects.create(username='ama'), name='Ama Mensah')
+
+        def song(title, artist, genre, approved=True):
+            return Song.objects.create(
+                title=title, artist=artist, genre=genre, audio_file='songs/x.mp3', duration=180,
+                is_approved=approved,
+            )
+
+        cls.sunrise = song('Accra Sunrise', cls.artist, highlife)
+        cls.night = song('Lagos Nights', other, afrobeat)
+        cls.hidden = song('Accra Secret', other, highlife, approved=False)
+
+    def search(self, query):
+        return [song.pk for song in search_songs(query)]
+
+    def test_prefix_search_over_title_artist_and_genre(self):
+        self.assertEqual(self.search('accr sun'), [self.sunrise.pk])
+        self.assertEqual(self.search('kin den'), [self.sunrise.pk])
+        self.assertEqual(self.search('afro'), [self.night.pk])
+        self.assertEqual(self.search('nothing matches'), [])
+
+    def test_unapproved_songs_are_excluded(self):
+        self.assertEqual(self.search('secret'), [])
+        self.assertEqual(self.search('accra'), [self.sunrise.pk])
+
+        self.hidden.is_approved = True
+        self.hidden.save()
+        self.assertEqual(self.search('secret'), [self.hidden.pk])
+
+        self.hidden.is_approved = False
+        self.hidden.save()
+        self.assertEqual(self.search('secret'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.sunrise.title = 'Kumasi Sunset'
+        self.sunrise.save()
+        self.assertEqual(self.search('accra'), [])
+        self.assertEqual(self.search('kumasi'), [self.sunrise.pk])
+
+        self.artist.name = 'Queen Denzo'
+        self.artist.save()
+        self.assertEqual(self.search('queen'), [self.sunrise.pk])
+        self.assertEqual(self.search('king'), [])
+
+        self.night.delete()
+        self.assertEqual(self.search('lagos'), [])
+
+    def test_query_syntax_is_escaped(self):
+        for query in ('"accra', 'accra*', '*', 'accra NEAR sunrise', 'NEAR(accra sunrise)',
+                      'accra OR lagos', '-accra', 'title:accra', '{title}: accra', '^accra', '"', '()'):
+            response = self.client.get('/search/', {'q': query})
+            self.assertEqual(response.status_code, 200, query)
+            response = self.client.get('/search/suggest/', {'q': query})
+            self.assertEqual(response.status_code, 200, query)
+        # Operators are searched for as plain words, which no song contains
+        self.assertEqual(self.search('accra OR lagos'), [])
+        self.assertEqual(self.search('"accra" *'), [self.sunrise.pk])
+
+    def test_search_suggest(self):
+        response = self.client.get('/search/suggest/', {'q': 'accra su'})
+        self.assertEqual(response.json(), {'results': [
+            {'id': self.sunrise.pk, 'title': 'Accra Sunrise', 'artist': 'King Denzo'},
+        ]})
+        # Suggestions only match titles and artists, and skip one-letter terms
+        self.assertEqual(self.client.get('/search/suggest/', {'q': 'highlife'}).json(), {'results': []})
+        self.assertEqual(self.client.get('/search/suggest/', {'q': 'a'}).json(), {'results': []})
+        self.assertEqual(self.client.get('/search/suggest/', {'q': ''}).json(), {'results': []})
+
+
+def wav_bytes(seconds, rate=8000):
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\x00\x00' * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def mp3_bytes(frames, xing_frames=None):
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo: 417-byte frames of 1152 samples
+    header = b'\xff\xfb\x90\x00'
+    frame = header + bytes(413)
+    data = bytearray(frame * frames)
+    if xing_frames is not None:
+        # Xing tag after the 32 bytes of side info, with the frame-count flag set
+        data[36:48] = b'Xing' + struct.pack('>II', 1, xing_frames)
+    # An ID3v2 tag (10-byte header, 20-byte body) in front, as most encoders write
+    return b'ID3\x04\x00\x00\x00\x00\x00\x14' + bytes(20) + bytes(data)
+
+
+@mock.patch('music.audioprobe.shutil.which', return_value=None)
+class AudioProbeTests(TestCase):
+    def write(self, content, suffix):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_wav(self, which):
+        info = probe_audio(self.write(wav_bytes(2.5), '.wav'))
+        self.assertEqual(info, {'duration': 2.5, 'bitrate': 128, 'format': 'wav'})
+
+    def test_constant_bitrate_mp3(self, which):
+        info = probe_audio(self.write(mp3_bytes(100), '.mp3'))
+        self.assertEqual((info['format'], info['bitrate']), ('mp3', 128))
+        self.assertAlmostEqual(info['duration'], 100 * 1152 / 44100, delta=0.01)
+
+    def test_variable_bitrate_mp3_uses_the_xing_frame_count(self, which):
+        info = probe_audio(self.write(mp3_bytes(10, xing_frames=1000), '.mp3'))
+        self.assertAlmostEqual(info['duration'], 1000 * 1152 / 44100, places=3)
+        self.assertEqual(info['format'], 'mp3')
+
+    def test_unreadable_files(self, which):
+        with self.assertRaises(ProbeError):
+            probe_audio(self.write(b'not audio at all' * 100, '.mp3'))
+        with self.assertRaises(ProbeError):
+            probe_audio(self.write(b'RIFF\x00\x00\x00\x00WAVEjunk', '.wav'))
+
+
+@override_settings(MEDIA_PIPELINE_WORKERS=0)
+@mock.patch('music.audioprobe.shutil.which', return_value=None)
+class MediaPipelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(name='Afrobeat')
+        cls.user = User.objects.create_user(username='artist', password='pw')
+        UserProfile.objects.create(user=cls.user, user_type='artist')
+        Artist.objects.create(user=cls.user, name='Artist')
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.user)
+
+    def upload(self, content, name='track.wav', content_type='audio/wav', **extra):
+        response = self.client.post('/upload/', {
+            'title': 'Track', 'genre': self.genre.pk,
+            'audio_file': SimpleUploadedFile(name, content, content_type=content_type),
+            **extra,
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200, response.content)
+        return MediaJob.objects.select_related('song').get(pk=response.json()['job_id'])
+
+    def test_duration_is_unknown_until_the_job_runs(self, which):
+        job = self.upload(wav_bytes(3))
+        self.assertEqual(job.status, 'queued')
+        self.assertIsNone(job.song.duration)
+        self.assertEqual(self.client.get(f'/upload/status/{job.pk}/').json()['formatted_duration'], '')
+
+        self.assertTrue(claim_job(job.pk))
+        self.assertTrue(process_job(job.pk))
+
+        job.refresh_from_db()
+        song = Song.objects.get(pk=job.song_id)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((song.duration, song.bitrate), (3, 128))
+        self.assertEqual(len(song.content_hash), 64)
+        status = self.client.get(f'/upload/status/{job.pk}/').json()
+        self.assertEqual((status['status'], status['formatted_duration']), ('done', '0:03'))
+
+    def test_measured_duration_replaces_the_typed_one(self, which):
+        job = self.upload(mp3_bytes(100), 'track.mp3', 'audio/mpeg', duration_minutes=4)
+        self.assertEqual(job.song.duration, 240)
+        process_job(job.pk)
+        self.assertEqual(Song.objects.get(pk=job.song_id).duration, 3)
+
+    def test_unreadable_upload_fails_the_job(self, which):
+        job = self.upload(b'not audio at all' * 100, 'track.mp3', 'audio/mpeg')
+        with self.assertLogs('music.pipeline', 'ERROR'):
+            self.assertFalse(process_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('Could not read audio file', job.error)
+        self.assertIsNone(Song.objects.get(pk=job.song_id).duration)
@@ -0,0 +1,117 @@
+"""
+Resized WebP/JPEG derivatives of cover and artist images.
+
+Templates ask for an image at a named preset (THUMBNAIL_PRESETS) through the
+tags in templatetags/music_images.py, which emit 1x/2x srcsets. A derivative
+is generated on first request by the ``thumbnail`` view (or eagerly by the
+media pipeline and ``manage.py generate_thumbnails``). It is stored under
+MEDIA_ROOT/derived/ with a name hashed from the source name and the preset.
+Uploads are named by content hash (storage.py), so derivatives can be cached
+forever.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.conf import settings
+from django.templatetags.static import static
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+DEFAULT_PRESETS = {
+    'thumb': (64, 64),
+    'card': (300, 300),
+    'large': (600, 600),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+SCALES = (1, 2)
+# Only files under these upload directories can be resized
+SOURCE_DIRS = ('covers/', 'artists/', 'playlist_covers/', 'profile_pics/')
+
+# Derivatives known to exist, so templates skip the filesystem check
+_known = set()
+
+
+class InvalidThumbnail(ValueError):
+    pass
+
+
+def get_presets():
+    return getattr(settings, 'THUMBNAIL_PRESETS', DEFAULT_PRESETS)
+
+
+def validate(source, preset, scale, fmt):
+    if preset not in get_presets() or scale not in SCALES or fmt not in FORMATS:
+        raise InvalidThumbnail(f"Unknown thumbnail {preset}@{scale}x.{fmt}")
+    normalized = posixpath.normpath(source)
+    if normalized != source or not source.startswith(SOURCE_DIRS):
+        raise InvalidThumbnail(f"Invalid thumbnail source {source!r}")
+
+
+def derivative_name(source, preset, scale, fmt):
+    width, height = get_presets()[preset]
+    digest = hashlib.sha256(f'{source}|{width}x{height}'.encode()).hexdigest()[:24]
+    return f'derived/{preset}/{digest[:2]}/{digest}@{scale}x.{fmt}'
+
+
+def derivative_path(source, preset, scale, fmt):
+    return os.path.join(settings.MEDIA_ROOT, derivative_name(source, preset, scale, fmt))
+
+
+def generate(source, preset, scale, fmt):
+    """Create the derivative if it does not exist yet and return its path"""
+    validate(source, preset, scale, fmt)
+    path = derivative_path(source, preset, scale, fmt)
+    if path in _known or os.path.exists(path):
+        _known.add(path)
+        return path
+
+    width, height = get_presets()[preset]
+    pil_format, options = FORMATS[fmt]
+    with Image.open(os.path.join(settings.MEDIA_ROOT, source)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image = ImageOps.fit(image, (width * scale, height * scale), Image.LANCZOS)
+
+        # Write to a temporary file first so readers never see a partial image
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=f'.{fmt}')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                image.save(fh, pil_format, **options)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    _known.add(path)
+    return path
+
+
+def generate_all(source):
+    """Eagerly create every preset/scale/format of ``source``"""
+    for preset in get_presets():
+        for scale in SCALES:
+            for fmt in FORMATS:
+                generate(source, preset, scale, fmt)
+
+
+def thumbnail_url(image, preset, scale=1, fmt='jpg'):
+    if not image:
+        return static('images/default-cover.jpg')
+    source = image.name
+    if getattr(settings, 'THUMBNAIL_SERVE_DIRECT', False):
+        # Media is served by the front-end server; link straight to generated files
+        path = derivative_path(source, preset, scale, fmt)
+        if path in _known or os.path.exists(path):
+            _known.add(path)
+            return settings.MEDIA_URL + derivative_name(source, preset, scale, fmt)
+    return reverse('thumbnail', kwargs={'preset': preset, 'scale': scale, 'fmt': fmt, 'source': source})
+
+
+def thumbnail_srcset(image, preset, fmt='webp'):
+    if not image:
+        return static('images/default-cover.jpg')
+    return ', '.join(f'{thumbnail_url(image, preset, scale, fmt)} {scale}x' for scale in SCALES)
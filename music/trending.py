@@ -0,0 +1,125 @@
+"""
+Trending charts from exponentially decayed play/download scores.
+
+A song's trending score is the sum of its events, each worth
+``weight * 2 ** (-age / half_life)``. Every score shrinks by the same factor
+as time passes, so the ranking is unchanged if we drop that factor and
+store ``log2(sum(weight * 2 ** ((t - EPOCH) / half_life)))`` instead: adding
+an event only touches that song's row and nothing has to decay. The counter
+flush calls record_events() with each batch of new events.
+
+Two windows are kept, as Song columns with indexes for the approved and
+per-genre charts: 'day' (half-life 24h) and 'week' (half-life 7 days).
+Reading the top N is an index scan of N rows. Songs with no events
+keep NULL and sort last.
+
+``manage.py rebuild_trending`` recomputes the columns from the raw events
+(e.g. after changing the weights).
+"""
+import datetime
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Song, SongDownload, SongPlay
+
+UTC = datetime.timezone.utc
+EPOCH = datetime.datetime(2025, 1, 1, tzinfo=UTC)
+
+PLAY_WEIGHT = 1
+DOWNLOAD_WEIGHT = 2
+
+# Window name -> (Song column, half-life)
+WINDOWS = {
+    'day': ('trending_day', datetime.timedelta(hours=24)),
+    'week': ('trending_week', datetime.timedelta(days=7)),
+}
+
+
+def log_weight(when, weight, half_life):
+    return math.log2(weight) + (when - EPOCH) / half_life
+
+
+def log2_add(a, b):
+    """log2(2 ** a + 2 ** b) without overflowing"""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def decayed_score(value, window, now=None):
+    """A stored column value as the event weight surviving at ``now``"""
+    if value is None:
+        return 0.0
+    _, half_life = WINDOWS[window]
+    return 2 ** (value - ((now or timezone.now()) - EPOCH) / half_life)
+
+
+def _scores(events):
+    """{song_id: {column: log score}} for (song_id, when, weight) events"""
+    scores = defaultdict(dict)
+    for song_id, when, weight in events:
+        for column, half_life in WINDOWS.values():
+            scores[song_id][column] = log2_add(scores[song_id].get(column), log_weight(when, weight, half_life))
+    return scores
+
+
+def _merge(scores, replace=False):
+    columns = [column for column, _ in WINDOWS.values()]
+    songs = list(Song.objects.select_for_update().filter(pk__in=scores).only('id', *columns))
+    for song in songs:
+        for column in columns:
+            value = scores[song.pk].get(column)
+            if not replace:
+                value = log2_add(getattr(song, column), value) if value is not None else getattr(song, column)
+            setattr(song, column, value)
+    Song.objects.bulk_update(songs, columns, batch_size=500)
+
+
+def record_events(plays=(), downloads=()):
+    """
+    Add events to the scores. ``plays`` and ``downloads`` are (song_id, when)
+    pairs. Call inside the transaction that stores the events.
+    """
+    events = [(song_id, when, PLAY_WEIGHT) for song_id, when in plays]
+    events += [(song_id, when, DOWNLOAD_WEIGHT) for song_id, when in downloads]
+    if events:
+        _merge(_scores(events))
+
+
+def rebuild(batch_size=500):
+    """Recompute every song's scores from SongPlay/SongDownload"""
+    columns = [column for column, _ in WINDOWS.values()]
+    song_ids = list(Song.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(song_ids), batch_size):
+        batch = song_ids[start:start + batch_size]
+        # Hourly buckets: an hour's events decay together to within 3%
+        events = []
+        for model, time_field, weight in ((SongPlay, 'played_at', PLAY_WEIGHT), (SongDownload, 'downloaded_at', DOWNLOAD_WEIGHT)):
+            hourly = (
+                model.objects.filter(song__in=batch)
+                .annotate(hour=TruncHour(time_field, tzinfo=UTC))
+                .values_list('song_id', 'hour')
+                .annotate(count=Count('id'))
+                .order_by()
+            )
+            events += [(song_id, hour, weight * count) for song_id, hour, count in hourly]
+        scores = _scores(events)
+        with transaction.atomic():
+            Song.objects.filter(pk__in=batch).exclude(pk__in=scores).update(**dict.fromkeys(columns))
+            _merge(scores, replace=True)
+    return len(song_ids)
+
+
+def trending(window='day', genre=None, queryset=None):
+    """Approved songs ordered by trending score; slice for the top N"""
+    column, _ = WINDOWS[window]
+    songs = (queryset if queryset is not None else Song.objects.all()).approved().filter(**{f'{column}__isnull': False})
+    if genre is not None:
+        songs = songs.by_genre(genre)
+    return songs.order_by(f'-{column}', '-id')
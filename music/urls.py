@@ -4,14 +4,27 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('discover/', views.discover, name='discover'),
+    path('discover/page/', views.discover_page, name='discover_page'),
     path('library/', views.library, name='library'),
     path('playlists/', views.playlists, name='playlists'),
     path('genres/', views.genres, name='genres'),
     path('genre/<int:genre_id>/', views.genre_songs, name='genre_songs'),
     path('play-song/<int:song_id>/', views.play_song, name='play_song'),
+    path('plays/', views.record_plays, name='record_plays'),
+    path('api/songs/', views.api_songs, name='api_songs'),
+    path('api/songs/<int:song_id>/', views.api_song, name='api_song'),
+    path('api/songs/<int:song_id>/like/', views.api_song_like, name='api_song_like'),
+    path('api/songs/<int:song_id>/related/', views.api_related_songs, name='api_related_songs'),
+    path('api/charts/trending/', views.api_trending, name='api_trending'),
+    path('api/playlists/<int:playlist_id>/queue/', views.api_playlist_queue, name='api_playlist_queue'),
+    path('api/playlists/<int:playlist_id>/export/', views.api_playlist_export, name='api_playlist_export'),
+    path('api/playlists/<int:playlist_id>/songs/', views.api_playlist_songs, name='api_playlist_songs'),
+    path('api/genres/<int:genre_id>/queue/', views.api_genre_queue, name='api_genre_queue'),
     path('like-song/<int:song_id>/', views.like_song, name='like_song'),
     path('download-song/<int:song_id>/', views.download_song, name='download_song'),
+    path('stream/<int:song_id>/', views.stream_song, name='stream_song'),
     path('search/', views.search, name='search'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     path('analytics/song/<int:song_id>/', views.song_analytics, name='song_analytics'),
     path('analytics/top-songs/', views.top_songs, name='top_songs'),
     path('logout/', views.logout_view, name='logout'),
@@ -19,5 +32,7 @@ urlpatterns = [
     path('signup/', views.signup, name='signup'),
     path('get-song-stats/<int:song_id>/', views.get_song_stats, name='get_song_stats'),
     path('upload/', views.upload_music, name='upload_music'),
+    path('upload/status/<int:job_id>/', views.upload_status, name='upload_status'),
     path('my-uploads/', views.my_uploads, name='my_uploads'),
+    path('thumbs/<str:preset>/<int:scale>x/<str:fmt>/<path:source>', views.thumbnail, name='thumbnail'),
 ]
\ No newline at end of file
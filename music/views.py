@@ -1,16 +1,37 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, Http404, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.utils import timezone
-from django.db.models import Count, Sum
+from django.views.decorators.http import require_http_methods
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.db import IntegrityError
+from django.db.models import Q, Subquery
+from django.template.loader import render_to_string
+from django.conf import settings
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
+import hashlib
 import json
 import os
-from .models import Song, Genre, Playlist, UserProfile, SongPlay, SongDownload, Artist
+from .models import (
+    Song, Genre, Playlist, PlaylistEntry, SongPlay, SongDownload, Artist, MediaJob, Like,
+    create_user_with_profile,
+)
 from .forms import SongUploadForm
+from .pagination import keyset_paginate, InvalidCursor
+from .counters import counter_buffer
+from .streaming import serve_audio
+from .charts import get_charts_snapshot
+from .search import search_songs, suggest_songs
+from .pipeline import enqueue_media_job
+from .rollups import artist_activity, song_activity
+from .pagecache import cache_anonymous_page, cached_value
+from .playevents import InvalidPlayEvents, clean_play_events
+from .playlists import InvalidPlaylistEdit, append_songs, apply_diff, parse_diff, queue_songs, remove_songs
+from .trending import WINDOWS as TRENDING_WINDOWS, trending
+from . import thumbnails
 
 # Authentication Views
 def login_view(request):
@@ -43,7 +64,7 @@ def signup(request):
         genre_id = request.POST.get('genre')
         website = request.POST.get('website', '')
 
-        # Basic validation
+        # Basic validation; taken usernames/emails are caught by the unique indexes
         errors = []
         
         if not username or not email or not password1:
@@ -52,69 +73,55 @@ def signup(request):
         if password1 != password2:
             errors.append('Passwords do not match.')
         
-        if User.objects.filter(username=username).exists():
-            errors.append('Username already exists.')
-        
-        if User.objects.filter(email=email).exists():
-            errors.append('Email already exists.')
-        
         # Artist-specific validation
         if is_artist:
             if not artist_name:
                 errors.append('Artist name is required when signing up as an artist.')
         
+        artist = None
+        if is_artist and not errors:
+            artist = {
+                'name': artist_name,
+                'bio': bio,
+                'website': website if website else None,
+            }
+            # Unknown genres are dropped by the INSERT itself (a subquery), not a lookup first
+            if genre_id and genre_id.isdigit():
+                artist['genre_id'] = Subquery(Genre.objects.filter(id=genre_id).values('id'))
+        
+        if not errors:
+            try:
+                # User, profile and artist in one transaction
+                user = create_user_with_profile(
+                    username=username,
+                    email=email,
+                    password=password1,
+                    artist=artist,
+                    first_name=first_name,
+                    last_name=last_name
+                )
+            except IntegrityError:
+                # Only now find out which one clashed
+                if User.objects.filter(username=username).exists():
+                    errors.append('Username already exists.')
+                elif User.objects.filter(email__iexact=email).exists():
+                    errors.append('Email already exists.')
+                else:
+                    raise
+        
         if errors:
             for error in errors:
                 messages.error(request, error)
             return render(request, 'signup.html')
         
-        try:
-            # Create user
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password1,
-                first_name=first_name,
-                last_name=last_name
-            )
-            
-            # Update user profile
-            profile = user.userprofile
-            if is_artist:
-                profile.user_type = 'artist'
-                profile.save()
-                
-                # Create artist profile
-                artist_data = {
-                    'user': user,
-                    'name': artist_name,
-                    'bio': bio,
-                    'website': website if website else None
-                }
-                
-                # Add genre if provided and exists
-                if genre_id:
-                    try:
-                        genre = Genre.objects.get(id=genre_id)
-                        artist_data['genre'] = genre
-                    except Genre.DoesNotExist:
-                        # Continue without genre if it doesn't exist
-                        pass
-                
-                Artist.objects.create(**artist_data)
-                messages.success(request, 'Artist account created successfully!')
-            else:
-                messages.success(request, 'Account created successfully!')
-            
-            # Login user and redirect
-            login(request, user)
-            return redirect('home')
-            
-        except Exception as e:
-            messages.error(request, f'Error creating account: {str(e)}')
-            # If user was created but failed later, delete it
-            if 'user' in locals():
-                user.delete()
+        if is_artist:
+            messages.success(request, 'Artist account created successfully!')
+        else:
+            messages.success(request, 'Account created successfully!')
+        
+        # Login user and redirect
+        login(request, user)
+        return redirect('home')
     
     return render(request, 'signup.html')
 
@@ -123,53 +130,103 @@ def logout_view(request):
     messages.info(request, 'You have been successfully logged out.')
     return redirect('home')
 
+@cache_anonymous_page(['charts', 'genres', 'artists'])
 def home(request):
-    # Get featured songs (most played)
-    featured_songs = Song.objects.all().order_by('-plays')[:8]
-    
-    # Get most played songs for charts
-    most_played = Song.objects.all().order_by('-plays')[:5]
-    most_downloaded = Song.objects.all().order_by('-downloads')[:5]
-    
-    # Get genres with song counts
-    genres = Genre.objects.annotate(song_count=Count('song'))
+    # Charts, genre counts and totals come from one cached snapshot
+    context = dict(get_charts_snapshot())
     
-    # Get total stats
-    total_songs = Song.objects.count()
-    total_plays = Song.objects.aggregate(total=Sum('plays'))['total'] or 0
-    total_downloads = Song.objects.aggregate(total=Sum('downloads'))['total'] or 0
-    
-    # Get recent plays for authenticated users
+    # Get recent plays and the recommended shelf for authenticated users
     recent_plays = []
+    recommended = []
     if request.user.is_authenticated:
-        recent_plays = SongPlay.objects.filter(user=request.user).select_related('song').order_by('-played_at')[:5]
-    
-    context = {
-        'featured_songs': featured_songs,
-        'most_played': most_played,
-        'most_downloaded': most_downloaded,
-        'genres': genres,
-        'total_songs': total_songs,
-        'total_plays': total_plays,
-        'total_downloads': total_downloads,
-        'recent_plays': recent_plays,
-    }
+        recent_plays = SongPlay.objects.filter(user=request.user).select_related('song__artist').order_by('-played_at')[:5]
+        recommended = (
+            Song.objects.for_listing().approved().filter(recommended_to__user=request.user)
+            .order_by('-recommended_to__score')[:8]
+        )
+    
+    context['recent_plays'] = recent_plays
+    context['recommended_songs'] = recommended
     return render(request, 'home.html', context)
+
+# Discover sort options, each ending in a unique column for keyset pagination
+DISCOVER_SORTS = {
+    'newest': ('-upload_date', '-id'),
+    'oldest': ('upload_date', 'id'),
+    'plays': ('-plays', '-id'),
+    'downloads': ('-downloads', '-id'),
+    'title': ('title', 'id'),
+}
+
+def get_discover_page(request):
+    """Filter and paginate the discover catalog from the query string"""
+    genre_id = request.GET.get('genre', '')
+    query = request.GET.get('q', '').strip()
+    sort = request.GET.get('sort', 'newest')
+    if sort not in DISCOVER_SORTS:
+        sort = 'newest'
+
+    songs = Song.objects.for_listing()
+    if genre_id.isdigit():
+        songs = songs.by_genre(genre_id)
+    if query:
+        songs = songs.filter(Q(title__icontains=query) | Q(artist__name__icontains=query))
+
+    page_size = getattr(settings, 'DISCOVER_PAGE_SIZE', 24)
+    try:
+        page = keyset_paginate(songs, DISCOVER_SORTS[sort], request.GET.get('cursor'), page_size)
+    except InvalidCursor:
+        page = keyset_paginate(songs, DISCOVER_SORTS[sort], None, page_size)
+
+    filters = {'genre': genre_id, 'q': query, 'sort': sort}
+    return page, filters
+
+def song_player_data(song):
+    """Serialise a song for the base.html player"""
+    return {
+        'id': song.id,
+        'title': song.title,
+        'artist': song.artist.name,
+        'audio': reverse('stream_song', args=[song.id]),
+        'cover': thumbnails.thumbnail_url(song.cover_image, 'large'),
+        'duration': song.duration,
+        'plays': song.plays,
+        'downloads': song.downloads,
+        'genre': song.genre.name,
+    }
+
+@cache_anonymous_page(['songs', 'genres', 'artists'])
 def discover(request):
-    songs = Song.objects.all().order_by('-upload_date')
+    page, filters = get_discover_page(request)
     genres = Genre.objects.all()
     
     context = {
-        'songs': songs,
+        'songs': page.items,
+        'page': page,
+        'filters': filters,
         'genres': genres,
+        'player_songs': [song_player_data(song) for song in page.items],
     }
     return render(request, 'discover.html', context)
 
+@cache_anonymous_page(['songs', 'artists'])
+def discover_page(request):
+    """JSON fragment of the next discover page for infinite scroll"""
+    page, filters = get_discover_page(request)
+    context = {'songs': page.items}
+    
+    return JsonResponse({
+        'grid_html': render_to_string('discover_song_cards.html', context, request=request),
+        'list_html': render_to_string('discover_song_items.html', context, request=request),
+        'songs': [song_player_data(song) for song in page.items],
+        'next_cursor': page.next_cursor,
+        'count': len(page),
+    })
+
 @login_required
 def library(request):
-    user_profile = UserProfile.objects.get(user=request.user)
-    liked_songs = user_profile.liked_songs.all()
-    playlists = Playlist.objects.filter(user=request.user)
+    liked_songs = Song.objects.for_listing().filter(likes__user=request.user).order_by('-likes__liked_at')
+    playlists = Playlist.objects.filter(user=request.user).with_song_count()
     
     context = {
         'liked_songs': liked_songs,
@@ -179,7 +236,7 @@ def library(request):
 
 @login_required
 def playlists(request):
-    playlists = Playlist.objects.filter(user=request.user)
+    playlists = Playlist.objects.filter(user=request.user).with_previews()
     
     if request.method == 'POST':
         name = request.POST.get('name')
@@ -200,8 +257,10 @@ def playlist_detail(request, playlist_id):
     if request.method == 'POST':
         song_id = request.POST.get('song_id')
         if song_id:
-            song = get_object_or_404(Song, id=song_id)
-            playlist.songs.add(song)
+            try:
+                append_songs(playlist, [int(song_id)])
+            except (ValueError, InvalidPlaylistEdit):
+                raise Http404("Song not found")
             messages.success(request, 'Song added to playlist!')
     
     context = {
@@ -209,6 +268,7 @@ def playlist_detail(request, playlist_id):
     }
     return render(request, 'playlist_detail.html', context)
 
+@cache_anonymous_page(['genres'])
 def genres(request):
     genres = Genre.objects.all()
     
@@ -217,9 +277,10 @@ def genres(request):
     }
     return render(request, 'genres.html', context)
 
+@cache_anonymous_page(lambda genre_id: ['genres', f'genre:{genre_id}', 'artists'])
 def genre_songs(request, genre_id):
     genre = get_object_or_404(Genre, id=genre_id)
-    songs = Song.objects.filter(genre=genre)
+    songs = Song.objects.for_listing().by_genre(genre)
     
     context = {
         'genre': genre,
@@ -230,15 +291,12 @@ def genre_songs(request, genre_id):
 # Song Actions
 @csrf_exempt
 def play_song(request, song_id):
-    song = get_object_or_404(Song, id=song_id)
+    song = get_object_or_404(Song.objects.select_related('artist'), id=song_id)
     
-    # Increment play count
-    song.increment_plays()
-    
-    # Record play in SongPlay model
-    SongPlay.objects.create(
-        song=song,
-        user=request.user if request.user.is_authenticated else None,
+    # Buffer the play count and SongPlay row; both are written in the next flush
+    counter_buffer.record_play(
+        song.id,
+        user_id=request.user.id if request.user.is_authenticated else None,
         ip_address=get_client_ip(request)
     )
     
@@ -246,64 +304,129 @@ def play_song(request, song_id):
         'id': song.id,
         'title': song.title,
         'artist': song.artist.name,
-        'cover': song.cover_image.url if song.cover_image else '/static/images/default-cover.jpg',
-        'audio': song.audio_file.url,
+        'cover': thumbnails.thumbnail_url(song.cover_image, 'large'),
+        'audio': reverse('stream_song', args=[song.id]),
         'duration': song.duration,
-        'plays': song.plays
+        'plays': song.plays + counter_buffer.pending_plays(song.id)
     })
 
+# Like play_song, this is posted by the player (often via sendBeacon) without a CSRF token
+@csrf_exempt
+@require_http_methods(['POST'])
+def record_plays(request):
+    """Record a batch of listening events from the player"""
+    try:
+        payload = json.loads(request.body or b'null')
+        events = payload.get('events') if isinstance(payload, dict) else payload
+        plays, rejected = clean_play_events(events)
+    except (ValueError, InvalidPlayEvents) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    counter_buffer.record_plays(
+        plays,
+        user_id=request.user.id if request.user.is_authenticated else None,
+        ip_address=get_client_ip(request)
+    )
+    return JsonResponse({'accepted': len(plays), 'rejected': rejected}, status=202)
+
+def set_song_like(user, song, liked):
+    """Like or unlike ``song``; repeating either is a no-op. Returns the new like count."""
+    if liked:
+        Like.objects.get_or_create(user=user, song=song)
+    else:
+        Like.objects.filter(user=user, song=song).delete()
+    # like_count is updated by the Like signal handlers
+    return Song.objects.filter(pk=song.pk).values_list('like_count', flat=True).first()
+
 @login_required
 def like_song(request, song_id):
-    song = get_object_or_404(Song, id=song_id)
-    user_profile = UserProfile.objects.get(user=request.user)
-    
-    if song in user_profile.liked_songs.all():
-        user_profile.liked_songs.remove(song)
-        liked = False
-    else:
-        user_profile.liked_songs.add(song)
-        liked = True
+    """Toggle a like (kept for older pages; the player uses api_song_like)"""
+    song = get_object_or_404(Song.objects.only('id'), id=song_id)
+    liked = not Like.objects.filter(user=request.user, song=song).exists()
+    like_count = set_song_like(request.user, song, liked)
     
-    return JsonResponse({'liked': liked})
+    return JsonResponse({'liked': liked, 'like_count': like_count})
+
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def api_song_like(request, song_id):
+    """GET the like state; PUT likes the song and DELETE unlikes it"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Log in to like songs'}, status=401)
+    song = get_object_or_404(Song.objects.only('id', 'like_count'), id=song_id)
+    
+    if request.method == 'GET':
+        liked = Like.objects.filter(user=request.user, song=song).exists()
+        return JsonResponse({'liked': liked, 'like_count': song.like_count})
+    
+    liked = request.method == 'PUT'
+    return JsonResponse({'liked': liked, 'like_count': set_song_like(request.user, song, liked)})
 
 def search(request):
-    query = request.GET.get('q', '')
-    songs = Song.objects.filter(
-        title__icontains=query, 
-        is_approved=True
-    ) | Song.objects.filter(
-        artist__name__icontains=query
-    )
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    page_size = getattr(settings, 'SEARCH_PAGE_SIZE', 20)
+    
+    # Ranked results from the search index; one extra row tells us if there is a next page
+    songs = search_songs(query, (page - 1) * page_size, page_size + 1) if query else []
+    has_next = len(songs) > page_size
+    songs = songs[:page_size]
     
     context = {
         'songs': songs,
         'query': query,
+        'page': page,
+        'has_next': has_next,
+        'player_songs': [song_player_data(song) for song in songs],
     }
     return render(request, 'search.html', context)
 
+def search_suggest(request):
+    """Typeahead suggestions for the search bar"""
+    query = request.GET.get('q', '').strip()
+    suggestions = suggest_songs(query) if query else []
+    
+    return JsonResponse({
+        'results': [
+            {'id': row['id'], 'title': row['title'], 'artist': row['artist__name']}
+            for row in suggestions
+        ]
+    })
+
 @login_required
 def download_song(request, song_id):
-    song = get_object_or_404(Song, id=song_id)
-    
-    # Increment download count
-    song.increment_downloads()
-    
-    # Record download in SongDownload model
-    SongDownload.objects.create(
-        song=song,
-        user=request.user,
-        ip_address=get_client_ip(request)
+    song = get_object_or_404(Song.objects.select_related('artist'), id=song_id)
+    
+    # Buffer the download count and SongDownload row, but not again when a
+    # download manager resumes with a Range request
+    range_header = request.META.get('HTTP_RANGE', '')
+    if not range_header or range_header.startswith('bytes=0-'):
+        counter_buffer.record_download(
+            song.id,
+            user_id=request.user.id,
+            ip_address=get_client_ip(request)
+        )
+    
+    # Stream the file for download (Range requests resume partial downloads)
+    response = serve_audio(
+        request, song.audio_file, as_attachment=True,
+        filename=f"{song.title} - {song.artist.name}{os.path.splitext(song.audio_file.name)[1]}"
     )
-    
-    # Serve the file for download
-    file_path = song.audio_file.path
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as fh:
-            response = HttpResponse(fh.read(), content_type="audio/mpeg")
-            response['Content-Disposition'] = f'attachment; filename="{song.title} - {song.artist.name}.mp3"'
-            return response
-    else:
+    if response is None:
         return JsonResponse({'error': 'File not found'}, status=404)
+    return response
+
+@require_http_methods(['GET', 'HEAD'])
+def stream_song(request, song_id):
+    """Audio for the player, with Range/conditional GET support for seeking"""
+    song = get_object_or_404(Song.objects.only('id', 'audio_file', 'stream_file'), id=song_id)
+    # Prefer the pipeline's streaming rendition over the original upload
+    response = serve_audio(request, song.stream_file or song.audio_file)
+    if response is None:
+        return JsonResponse({'error': 'File not found'}, status=404)
+    return response
 
 @login_required
 def upload_music(request):
@@ -328,9 +451,20 @@ def upload_music(request):
             song.is_approved = False
             
             song.save()
+            
+            # Duration, bitrate, hash and the streaming rendition are filled in by the media pipeline
+            job = enqueue_media_job(song)
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({
+                    'job_id': job.id,
+                    'status_url': reverse('upload_status', args=[job.id]),
+                    'redirect_url': reverse('my_uploads'),
+                })
             messages.success(request, "Your song has been uploaded successfully and is pending review!")
             return redirect('my_uploads')
         else:
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                return JsonResponse({'errors': form.errors}, status=400)
             messages.error(request, "Please correct the errors below.")
     else:
         form = SongUploadForm()
@@ -344,6 +478,23 @@ def upload_music(request):
     }
     return render(request, 'upload_music.html', context)
 
+@login_required
+def upload_status(request, job_id):
+    """Processing status of an upload, polled by the upload page"""
+    job = get_object_or_404(
+        MediaJob.objects.select_related('song'),
+        id=job_id,
+        song__artist__user=request.user
+    )
+    
+    return JsonResponse({
+        'status': job.status,
+        'error': job.error,
+        'duration': job.song.duration,
+        'formatted_duration': job.song.formatted_duration,
+        'bitrate': job.song.bitrate,
+    })
+
 @login_required
 def my_uploads(request):
     # Check if user is an artist
@@ -353,7 +504,7 @@ def my_uploads(request):
     
     try:
         artist_profile = Artist.objects.get(user=request.user)
-        songs = Song.objects.filter(artist=artist_profile).order_by('-upload_date')
+        songs = Song.objects.for_listing().by_artist(artist_profile).order_by('-upload_date')
     except Artist.DoesNotExist:
         messages.error(request, "Artist profile not found.")
         songs = []
@@ -372,19 +523,16 @@ def artist_dashboard(request):
     
     try:
         artist_profile = Artist.objects.get(user=request.user)
-        songs = Song.objects.filter(artist=artist_profile)
+        songs = Song.objects.for_listing().by_artist(artist_profile)
         
-        # Calculate stats
-        total_plays = songs.aggregate(total=Sum('plays'))['total'] or 0
-        total_downloads = songs.aggregate(total=Sum('downloads'))['total'] or 0
-        total_songs = songs.count()
+        # Totals are kept on the artist row
+        total_plays = artist_profile.play_count
+        total_downloads = artist_profile.download_count
+        total_songs = artist_profile.song_count
         
-        # Recent plays (last 7 days)
-        week_ago = timezone.now() - timezone.timedelta(days=7)
-        recent_plays = SongPlay.objects.filter(
-            song__artist=artist_profile,
-            played_at__gte=week_ago
-        ).count()
+        # Recent plays (last 7 days) from the daily rollups
+        activity = artist_activity(artist_profile, days=7)
+        recent_plays = activity['plays']
         
     except Artist.DoesNotExist:
         messages.error(request, "Artist profile not found.")
@@ -396,6 +544,7 @@ def artist_dashboard(request):
         'total_downloads': total_downloads,
         'total_songs': total_songs,
         'recent_plays': recent_plays,
+        'activity': activity,
         'songs': songs,
     }
     return render(request, 'artist_dashboard.html', context)
@@ -403,42 +552,44 @@ def artist_dashboard(request):
 # Analytics Views
 @login_required
 def song_analytics(request, song_id):
-    song = get_object_or_404(Song, id=song_id)
+    song = get_object_or_404(Song.objects.select_related('artist', 'genre'), id=song_id)
     
     # Check if user owns the song
-    if not request.user.userprofile.is_artist or song.artist.user != request.user:
+    is_artist = hasattr(request.user, 'userprofile') and request.user.userprofile.is_artist
+    if not is_artist or song.artist.user_id != request.user.id:
         messages.error(request, "You don't have permission to view these analytics.")
         return redirect('my_uploads')
     
-    # Get play history (last 30 days)
-    thirty_days_ago = timezone.now() - timezone.timedelta(days=30)
-    recent_plays = SongPlay.objects.filter(song=song, played_at__gte=thirty_days_ago)
+    # Daily totals (last 30 days) from the rollups
+    activity = song_activity(song, days=30)
     
-    # Get download history
-    recent_downloads = SongDownload.objects.filter(song=song, downloaded_at__gte=thirty_days_ago)
+    # Latest individual events
+    recent_plays = SongPlay.objects.filter(song=song).select_related('user')[:20]
+    recent_downloads = SongDownload.objects.filter(song=song).select_related('user')[:20]
     
     context = {
         'song': song,
+        'activity': activity,
         'recent_plays': recent_plays,
         'recent_downloads': recent_downloads,
         'total_plays': song.plays,
         'total_downloads': song.downloads,
     }
-    return render(request, 'analytics/song_analytics.html', context)
+    return render(request, 'song_analysis.html', context)
 
 @login_required
 def top_songs(request):
-    # Get top played songs
-    top_played = Song.objects.filter(is_approved=True).order_by('-plays')[:10]
-    
-    # Get top downloaded songs
-    top_downloaded = Song.objects.filter(is_approved=True).order_by('-downloads')[:10]
-    
-    context = {
-        'top_played': top_played,
-        'top_downloaded': top_downloaded,
-    }
-    return render(request, 'analytics/top_songs.html', context)
+    # The page is per user (login required), so cache the chart lists instead
+    context = cached_value('top_songs', ['charts', 'artists'], lambda: {
+        # Get top played songs
+        'top_played': list(Song.objects.for_listing().approved().top_by('plays', 10)),
+        # Get top downloaded songs
+        'top_downloaded': list(Song.objects.for_listing().approved().top_by('downloads', 10)),
+        # Songs gaining plays fastest today and this week
+        'trending_day': list(trending(queryset=Song.objects.for_listing())[:10]),
+        'trending_week': list(trending('week', queryset=Song.objects.for_listing())[:10]),
+    })
+    return render(request, 'top_songs.html', context)
 
 # Utility Functions
 def get_client_ip(request):
@@ -457,27 +608,147 @@ def get_song_stats(request, song_id):
         'downloads': song.downloads
     })
 
+# Song metadata API: read-only player data. Unlike play_song, these never
+# touch the play counters, so the player can prefetch freely.
+def conditional_json(request, data, public=True):
+    """JsonResponse with an ETag over the body, or 304 if the client has it"""
+    response = JsonResponse(data)
+    etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        response = not_modified
+    response['ETag'] = etag
+    max_age = getattr(settings, 'SONG_API_MAX_AGE', 60)
+    if public:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+    return response
+
+def songs_in_order(song_ids):
+    """Player data for ``song_ids`` in the given order, skipping missing ids"""
+    songs = Song.objects.for_player().in_bulk(song_ids)
+    return [song_player_data(songs[song_id]) for song_id in song_ids if song_id in songs]
+
+@require_http_methods(['GET', 'HEAD'])
+def api_song(request, song_id):
+    song = get_object_or_404(Song.objects.for_player(), id=song_id)
+    return conditional_json(request, song_player_data(song))
+
+@require_http_methods(['GET', 'HEAD'])
+def api_songs(request):
+    """Batch lookup: ?ids=3,1,2 returns those songs in that order"""
+    try:
+        song_ids = list(dict.fromkeys(int(song_id) for song_id in request.GET.get('ids', '').split(',') if song_id))
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of song ids'}, status=400)
+    max_ids = getattr(settings, 'SONG_API_MAX_IDS', 100)
+    if len(song_ids) > max_ids:
+        return JsonResponse({'error': f'At most {max_ids} ids per request'}, status=400)
+    return conditional_json(request, {'songs': songs_in_order(song_ids)})
+
+@require_http_methods(['GET', 'HEAD'])
+def api_related_songs(request, song_id):
+    """'More like this': the song's precomputed neighbours, most similar first"""
+    limit = getattr(settings, 'RELATED_SONGS_LIMIT', 10)
+    # Neighbours are built ahead of time; a song unapproved since then drops out here
+    songs = (
+        Song.objects.for_player().approved()
+        .filter(neighbor_of__song=song_id).order_by('-neighbor_of__score')[:limit]
+    )
+    return conditional_json(request, {'songs': [song_player_data(song) for song in songs]})
+
+@require_http_methods(['GET', 'HEAD'])
+def api_trending(request):
+    """Trending chart: ?window=day|week, optionally &genre=<id>"""
+    window = request.GET.get('window', 'day')
+    genre_id = request.GET.get('genre', '')
+    if window not in TRENDING_WINDOWS or (genre_id and not genre_id.isdigit()):
+        return JsonResponse({'error': 'Unknown window or genre'}, status=400)
+    limit = getattr(settings, 'TRENDING_CHART_SIZE', 20)
+    songs = trending(window, genre=genre_id or None, queryset=Song.objects.for_player())[:limit]
+    return conditional_json(request, {'songs': [song_player_data(song) for song in songs]})
+
+def visible_playlist(request, playlist_id):
+    """A public playlist or one of the user's own, or 404"""
+    visible = Q(is_public=True)
+    if request.user.is_authenticated:
+        visible |= Q(user=request.user)
+    return get_object_or_404(Playlist.objects.filter(visible).only('id', 'name', 'is_public'), id=playlist_id)
+
+@require_http_methods(['GET', 'HEAD'])
+def api_playlist_queue(request, playlist_id):
+    """Songs of a visible playlist, in playlist order"""
+    playlist = visible_playlist(request, playlist_id)
+    song_ids = list(
+        PlaylistEntry.objects.filter(playlist=playlist).order_by('position').values_list('song_id', flat=True)
+    )
+    return conditional_json(request, {'songs': songs_in_order(song_ids)}, public=playlist.is_public)
+
+@require_http_methods(['GET', 'HEAD'])
+def api_playlist_export(request, playlist_id):
+    """The whole play queue as a JSON download, streamed so long playlists stay cheap"""
+    playlist = visible_playlist(request, playlist_id)
+    
+    def body():
+        yield '{"playlist": %s, "songs": [' % json.dumps({'id': playlist.id, 'name': playlist.name})
+        for index, song in enumerate(queue_songs(playlist)):
+            yield (',' if index else '') + json.dumps(song_player_data(song))
+        yield ']}'
+    
+    response = StreamingHttpResponse(body(), content_type='application/json')
+    response['Content-Disposition'] = f'attachment; filename="playlist-{playlist.id}.json"'
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@require_http_methods(['PATCH', 'POST'])
+def api_playlist_songs(request, playlist_id):
+    """Apply a bulk edit (see playlists.py) to one of the user's playlists"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Log in to edit playlists'}, status=401)
+    playlist = get_object_or_404(Playlist.objects.only('id'), id=playlist_id, user=request.user)
+    try:
+        result = apply_diff(playlist, *parse_diff(json.loads(request.body or b'null')))
+    except (ValueError, InvalidPlaylistEdit) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(result)
+
+@require_http_methods(['GET', 'HEAD'])
+def api_genre_queue(request, genre_id):
+    """A genre's songs, newest first, one keyset page at a time"""
+    genre = get_object_or_404(Genre, id=genre_id)
+    songs = Song.objects.for_player().by_genre(genre)
+    page_size = getattr(settings, 'SONG_API_QUEUE_SIZE', 50)
+    try:
+        page = keyset_paginate(songs, DISCOVER_SORTS['newest'], request.GET.get('cursor'), page_size)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return conditional_json(request, {
+        'songs': [song_player_data(song) for song in page.items],
+        'next_cursor': page.next_cursor,
+    })
+
 # API Views
 @csrf_exempt
 @login_required
 def add_to_playlist(request, song_id):
     if request.method == 'POST':
-        song = get_object_or_404(Song, id=song_id)
         playlist_id = request.POST.get('playlist_id')
         
         if playlist_id:
-            playlist = get_object_or_404(Playlist, id=playlist_id, user=request.user)
-            playlist.songs.add(song)
+            playlist = get_object_or_404(Playlist.objects.only('id'), id=playlist_id, user=request.user)
+            try:
+                append_songs(playlist, [song_id])
+            except InvalidPlaylistEdit:
+                raise Http404("Song not found")
             return JsonResponse({'success': True})
         
     return JsonResponse({'success': False})
 
 @login_required
 def remove_from_playlist(request, playlist_id, song_id):
-    playlist = get_object_or_404(Playlist, id=playlist_id, user=request.user)
-    song = get_object_or_404(Song, id=song_id)
-    
-    playlist.songs.remove(song)
+    playlist = get_object_or_404(Playlist.objects.only('id'), id=playlist_id, user=request.user)
+    remove_songs(playlist, [song_id])
     messages.success(request, 'Song removed from playlist!')
     return redirect('playlist_detail', playlist_id=playlist_id)
 
@@ -488,6 +759,19 @@ def delete_playlist(request, playlist_id):
     messages.success(request, 'Playlist deleted!')
     return redirect('playlists')
 
+# Image derivatives
+def thumbnail(request, preset, scale, fmt, source):
+    """Serve a resized cover/artist image, generating it on first request"""
+    try:
+        path = thumbnails.generate(source, preset, scale, fmt)
+    except (thumbnails.InvalidThumbnail, FileNotFoundError, OSError):
+        raise Http404("Image not found")
+    
+    response = FileResponse(open(path, 'rb'), content_type=f"image/{'jpeg' if fmt == 'jpg' else fmt}")
+    # The URL changes whenever the source image does
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 # Error Handlers
 def handler404(request, exception):
     return render(request, '404.html', status=404)
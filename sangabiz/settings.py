@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'music.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,7 +56,8 @@ ROOT_URLCONF = 'sangabiz.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for the request metrics
+        'BACKEND': 'music.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,13 +76,45 @@ WSGI_APPLICATION = 'sangabiz.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+SQLITE_PATH = os.environ.get('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': SQLITE_PATH,
+        # Seconds to keep a connection open between requests (0 = close each time)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so it waits on
+            # busy_timeout instead of failing when it later tries to write
+            'transaction_mode': os.environ.get('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+        },
     }
 }
 
+# Read-only connection to the same file for ORM reads (see sangabiz/db.py)
+if os.environ.get('SQLITE_READ_ALIAS', '') == '1':
+    DATABASES['readonly'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{SQLITE_PATH}?mode=ro',
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['sangabiz.db.ReadWriteRouter']
+
+# Applied to every SQLite connection when it opens
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024)),  # bytes
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -20000)),  # negative = KiB
+    'temp_store': os.environ.get('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -136,3 +170,122 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Music app settings
+
+# Songs per discover page (and per infinite-scroll fragment)
+DISCOVER_PAGE_SIZE = int(os.environ.get('DISCOVER_PAGE_SIZE', 24))
+
+# Play/download counters are buffered in-process and flushed on this interval
+# (seconds). 0 writes through on every request.
+COUNTER_FLUSH_INTERVAL = float(os.environ.get('COUNTER_FLUSH_INTERVAL', 5))
+COUNTER_FLUSH_BATCH_SIZE = int(os.environ.get('COUNTER_FLUSH_BATCH_SIZE', 500))
+
+# Audio delivery. Set AUDIO_SENDFILE_HEADER (e.g. X-Accel-Redirect) to let the
+# front-end server send files; AUDIO_SENDFILE_PREFIX is its internal location.
+AUDIO_SENDFILE_HEADER = os.environ.get('AUDIO_SENDFILE_HEADER', '')
+AUDIO_SENDFILE_PREFIX = os.environ.get('AUDIO_SENDFILE_PREFIX', MEDIA_URL)
+AUDIO_CACHE_MAX_AGE = int(os.environ.get('AUDIO_CACHE_MAX_AGE', 86400))
+
+# Maximum age (seconds) of the home page charts snapshot before it is rebuilt
+CHARTS_SNAPSHOT_MAX_AGE = int(os.environ.get('CHARTS_SNAPSHOT_MAX_AGE', 300))
+
+# Search results per page. SEARCH_BACKEND can point at another
+# music.search.SearchBackend subclass (defaults to SQLite FTS5).
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+if os.environ.get('SEARCH_BACKEND'):
+    SEARCH_BACKEND = os.environ['SEARCH_BACKEND']
+
+# Media pipeline: in-process worker threads (0 = only `manage.py run_media_worker`),
+# and the format/bitrate of the streaming rendition made when ffmpeg is installed
+MEDIA_PIPELINE_WORKERS = int(os.environ.get('MEDIA_PIPELINE_WORKERS', 2))
+MEDIA_STREAM_FORMAT = os.environ.get('MEDIA_STREAM_FORMAT', 'mp3')
+MEDIA_STREAM_BITRATE = int(os.environ.get('MEDIA_STREAM_BITRATE', 128))
+MEDIA_JOB_TIMEOUT = int(os.environ.get('MEDIA_JOB_TIMEOUT', 900))
+
+# Image derivative sizes (width, height) used by the music_images template tags.
+# THUMBNAIL_SERVE_DIRECT links generated files under MEDIA_URL instead of the
+# thumbnail view; only enable it when the front-end server serves media.
+THUMBNAIL_PRESETS = {
+    'thumb': (64, 64),
+    'card': (300, 300),
+    'large': (600, 600),
+}
+THUMBNAIL_SERVE_DIRECT = os.environ.get('THUMBNAIL_SERVE_DIRECT', '') == '1'
+
+# Analytics rollups (`manage.py rollup_analytics --compact`): days of raw
+# play/download events and of hourly rollups to keep. Daily rollups are kept.
+ANALYTICS_RAW_RETENTION_DAYS = int(os.environ.get('ANALYTICS_RAW_RETENTION_DAYS', 90))
+ANALYTICS_HOURLY_RETENTION_DAYS = int(os.environ.get('ANALYTICS_HOURLY_RETENTION_DAYS', 14))
+
+# Cache backend: locmem (per process), file or redis. Page-cache invalidation
+# only reaches every gunicorn worker with a shared backend (file or redis).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_LOCATIONS = {
+    'locmem': 'sangabiz',
+    'file': str(BASE_DIR / '.cache'),
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_LOCATIONS[CACHE_BACKEND]),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 5000))} if CACHE_BACKEND != 'redis' else {},
+    }
+}
+
+# Anonymous page cache (music/pagecache.py): seconds a page is kept
+# server-side (and by shared caches), and max-age sent to browsers.
+# Edits invalidate pages at once, but play/download counts do not, so
+# anonymous visitors may see counts up to PAGE_CACHE_TIMEOUT seconds old.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 300))
+PAGE_CACHE_BROWSER_MAX_AGE = int(os.environ.get('PAGE_CACHE_BROWSER_MAX_AGE', 60))
+
+# Batched play events from the player (music/playevents.py): events per
+# request, how old an event may be, plays of one song counted per request,
+# and seconds listened for a play to count
+PLAY_EVENTS_MAX_BATCH = int(os.environ.get('PLAY_EVENTS_MAX_BATCH', 200))
+PLAY_EVENT_MAX_AGE_HOURS = int(os.environ.get('PLAY_EVENT_MAX_AGE_HOURS', 168))
+PLAY_EVENTS_MAX_PER_SONG = int(os.environ.get('PLAY_EVENTS_MAX_PER_SONG', 5))
+PLAY_MIN_SECONDS = int(os.environ.get('PLAY_MIN_SECONDS', 30))
+
+# Song metadata API (/api/songs/...): browser max-age, ids per batch lookup
+# and songs per genre queue page
+SONG_API_MAX_AGE = int(os.environ.get('SONG_API_MAX_AGE', 60))
+SONG_API_MAX_IDS = int(os.environ.get('SONG_API_MAX_IDS', 100))
+SONG_API_QUEUE_SIZE = int(os.environ.get('SONG_API_QUEUE_SIZE', 50))
+
+# Recommendations (`manage.py build_recommendations`): neighbours kept per
+# song, songs per home shelf, songs/users per batch, and the largest basket
+# (user history or playlist) counted when scoring similarity
+RECOMMENDATION_NEIGHBORS = int(os.environ.get('RECOMMENDATION_NEIGHBORS', 20))
+RECOMMENDATION_SHELF_SIZE = int(os.environ.get('RECOMMENDATION_SHELF_SIZE', 20))
+RECOMMENDATION_CHUNK_SIZE = int(os.environ.get('RECOMMENDATION_CHUNK_SIZE', 500))
+RECOMMENDATION_MAX_BASKET = int(os.environ.get('RECOMMENDATION_MAX_BASKET', 500))
+RELATED_SONGS_LIMIT = int(os.environ.get('RELATED_SONGS_LIMIT', 10))
+
+# Songs per trending chart from /api/charts/trending/ (music/trending.py)
+TRENDING_CHART_SIZE = int(os.environ.get('TRENDING_CHART_SIZE', 20))
+
+# Most removals, additions and moves in one bulk playlist edit (music/playlists.py)
+PLAYLIST_EDIT_MAX_OPERATIONS = int(os.environ.get('PLAYLIST_EDIT_MAX_OPERATIONS', 5000))
+
+# Password hashers, preferred first. Tests and benchmarks of sign-up bursts
+# can use a cheap one, e.g. PASSWORD_HASHERS=django.contrib.auth.hashers.MD5PasswordHasher
+if os.environ.get('PASSWORD_HASHERS'):
+    PASSWORD_HASHERS = os.environ['PASSWORD_HASHERS'].split(',')
+
+# Request metrics (music/instrumentation.py): seconds between flushes to
+# RequestMetric (0 writes every request), and which slow queries are sampled
+INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', '1') == '1'
+INSTRUMENTATION_FLUSH_INTERVAL = float(os.environ.get('INSTRUMENTATION_FLUSH_INTERVAL', 60))
+INSTRUMENTATION_SLOW_QUERY_MS = float(os.environ.get('INSTRUMENTATION_SLOW_QUERY_MS', 100))
+INSTRUMENTATION_SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SLOW_QUERY_SAMPLE_RATE', 0.1))
+INSTRUMENTATION_SLOW_QUERIES_PER_FLUSH = int(os.environ.get('INSTRUMENTATION_SLOW_QUERIES_PER_FLUSH', 50))